@@ -0,0 +1,173 @@
+'''
+This module contains the retry policy and circuit breakers that guard the pool data sources.
+'''
+
+# standard library imports
+import asyncio
+import logging
+import os
+import random
+import time
+
+# retry settings, overridable with environment variables
+RETRY_ATTEMPTS = int(os.getenv("ETAX_RETRY_ATTEMPTS", default=5))
+RETRY_BASE_DELAY = float(os.getenv("ETAX_RETRY_BASE_DELAY", default=0.5))
+RETRY_MAX_DELAY = float(os.getenv("ETAX_RETRY_MAX_DELAY", default=30))
+# every success earns a fraction of a retry, so retries stay a bounded share of the traffic to a source
+RETRY_BUDGET_RATIO = float(os.getenv("ETAX_RETRY_BUDGET_RATIO", default=0.2))
+RETRY_BUDGET_MAX = float(os.getenv("ETAX_RETRY_BUDGET_MAX", default=10))
+# consecutive failed requests before the breaker opens, and how long it stays open
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("ETAX_BREAKER_FAILURE_THRESHOLD", default=3))
+BREAKER_RESET_TIMEOUT = float(os.getenv("ETAX_BREAKER_RESET_TIMEOUT", default=60))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    ''' Raised instead of calling a source whose breaker is open. '''
+
+
+class RetryableError(Exception):
+    ''' A failed response worth retrying, optionally with the delay the source asked for. '''
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    ''' Tracks the health of one data source, failing fast while it is degraded and probing it once the timeout passes. '''
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        # while half open only one request at a time probes the source
+        self.probe_in_flight = False
+        self.retry_tokens = RETRY_BUDGET_MAX
+        self.last_error = None
+        self.last_success = None
+        self.total_requests = 0
+        self.total_failures = 0
+        self.total_retries = 0
+
+    def allow_request(self) -> bool:
+        if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+            # let a probe through, its result decides whether the breaker closes
+            self.state = HALF_OPEN
+            logging.info(f'{self.name} circuit half open, probing')
+        if self.state == HALF_OPEN:
+            # everyone else fails fast until the probe comes back
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+        return self.state != OPEN
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logging.info(f'{self.name} circuit closed')
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.last_success = time.time()
+        self.retry_tokens = min(RETRY_BUDGET_MAX, self.retry_tokens + RETRY_BUDGET_RATIO)
+
+    def record_failure(self, error: Exception):
+        self.failures += 1
+        self.total_failures += 1
+        self.last_error = repr(error)
+        self.probe_in_flight = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logging.warning(f'{self.name} circuit open after {self.failures} failures, serving the last good pools')
+            self.state = OPEN
+            self.opened_at = time.time()
+
+    def take_retry(self) -> bool:
+        ''' Spends one retry from the budget, returns False once the budget is used up. '''
+        if self.retry_tokens < 1:
+            return False
+        self.retry_tokens -= 1
+        self.total_retries += 1
+        return True
+
+    @property
+    def degraded(self) -> bool:
+        return self.state != CLOSED
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'degraded': self.degraded,
+            'consecutive_failures': self.failures,
+            'total_requests': self.total_requests,
+            'total_failures': self.total_failures,
+            'total_retries': self.total_retries,
+            'retry_budget': round(self.retry_tokens, 2),
+            'probe_in_flight': self.probe_in_flight,
+            'opened_at': self.opened_at,
+            'last_success': self.last_success,
+            'last_error': self.last_error
+        }
+
+
+# one breaker per data source
+breakers = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name)
+    return breakers[name]
+
+
+def backoff_delay(attempt: int) -> float:
+    ''' Exponential backoff with full jitter. '''
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+async def call_with_retry(name: str, request, attempts: int = RETRY_ATTEMPTS):
+    '''
+    Awaits request() through the named source's breaker, retrying failures with backoff while the retry budget lasts.
+    Raises CircuitOpenError while the breaker is open, otherwise the last error once the retries run out.
+    '''
+    breaker = get_breaker(name)
+    for attempt in range(attempts):
+        if not breaker.allow_request():
+            raise CircuitOpenError(f'{name} circuit is open')
+        probing = breaker.state == HALF_OPEN
+        breaker.total_requests += 1
+        try:
+            result = await request()
+        except Exception as e:
+            breaker.record_failure(e)
+            logging.error(f'Error while fetching from {name} (attempt {attempt + 1}/{attempts}): {e!r}')
+            if attempt + 1 == attempts:
+                raise
+            if breaker.state == OPEN:
+                # this failure opened the breaker, don't spend a retry and sleep only to be turned away
+                raise CircuitOpenError(f'{name} circuit is open') from e
+            if not breaker.take_retry():
+                raise
+            delay = backoff_delay(attempt)
+            if isinstance(e, RetryableError) and e.retry_after:
+                delay = max(delay, e.retry_after)
+            await asyncio.sleep(delay)
+        except BaseException:
+            # a cancelled probe decided nothing, let the next request probe instead
+            if probing:
+                breaker.probe_in_flight = False
+            raise
+        else:
+            breaker.record_success()
+            return result
+
+
+def breaker_stats() -> dict:
+    return {name: breaker.stats() for name, breaker in breakers.items()}
@@ -7,3 +7,43 @@ BALANCER_V2 = 'Balancer_V2'
 DODO = 'DODO'
 PANCAKESWAP_V3 = 'PancakeSwap_V3'
 MAX_ROUTES = 10
+
+DEX_LIST = (
+    UNISWAP_V2,
+    UNISWAP_V3,
+    SUSHISWAP_V2,
+    CURVE,
+    BALANCER_V1,
+    BALANCER_V2,
+    DODO,
+    PANCAKESWAP_V3
+)
+
+DEX_METRIC_MAP = {
+    UNISWAP_V2: 'reserveUSD',
+    UNISWAP_V3: 'totalValueLockedUSD',
+    SUSHISWAP_V2: 'liquidityUSD',
+    CURVE: 'reserveUSD',
+    BALANCER_V1: 'liquidity',
+    BALANCER_V2: 'totalLiquidity',
+    DODO: 'volumeUSD',
+    PANCAKESWAP_V3: 'totalValueLockedUSD'
+}
+
+DEX_LIQUIDITY_METRIC_MAP = {
+    UNISWAP_V2: 'reserveUSD',
+    UNISWAP_V3: 'totalValueLockedUSD',
+    SUSHISWAP_V2: 'liquidityUSD',
+    CURVE: 'reserveUSD',
+    BALANCER_V1: 'reserveUSD',
+    BALANCER_V2: 'reserveUSD',
+    DODO: 'reserveUSD',
+    PANCAKESWAP_V3: 'totalValueLockedUSD'
+}
+
+BLACKLISTED_TOKENS = [
+    '0xd233d1f6fd11640081abb8db125f722b5dc729dc'  # Dollar Protocol
+]
+
+# compact protocol codes used by the pool records and store
+PROTOCOL_CODES = {protocol: code for code, protocol in enumerate(DEX_LIST)}
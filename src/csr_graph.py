@@ -0,0 +1,264 @@
+'''
+This module contains the routing engine's token graph, stored as NumPy arrays in compressed sparse row form.
+Tokens are nodes, numbered by their index in the shared token table, and every pool is an edge in each swap direction.
+'''
+
+# local imports
+from constants import CURVE, DODO, SUSHISWAP_V2, PROTOCOL_CODES
+from pool_records import TOKENS
+# standard library imports
+import heapq
+import math
+from collections import Counter
+# third party imports
+import numpy as np
+import networkx as nx
+
+# edge attribute -> (pool column for the token0 -> token1 direction, pool column for the token1 -> token0 direction)
+EDGE_COLUMNS = {
+    'reserve_in': ('reserve0', 'reserve1'),
+    'reserve_out': ('reserve1', 'reserve0'),
+    'price_in_usd': ('price0_usd', 'price1_usd'),
+    'price_out_usd': ('price1_usd', 'price0_usd'),
+    'weight_in': ('weight0', 'weight1'),
+    'weight_out': ('weight1', 'weight0'),
+    # the pool's own quotes, token{i}_price is what token i costs in the other token for DODO and the other token
+    # costs in token i for Curve, the price impact functions read them the same way
+    'token_price_in': ('token0_price', 'token1_price'),
+    'token_price_out': ('token1_price', 'token0_price'),
+    'fee': ('fee', 'fee'),
+    'liquidity': ('liquidity', 'liquidity'),
+    'protocol': ('protocol', 'protocol')
+}
+
+
+class CSRGraph:
+    '''
+    Immutable token graph over a pool store. The edges leaving node n are indptr[n]:indptr[n + 1], edge e swaps
+    into targets[e] through the store's pool handle pools[e], and its attributes are the arrays named in EDGE_COLUMNS.
+    token_prices is the store's USD price of every node, one table for every pool so values along a path compare.
+    A published snapshot renumbers every handle, so the graph is rebuilt with each snapshot rather than patched, the build
+    is a few vectorized passes, about 20 ms at 60k pools. Requests search it through a mask of their allowed pools.
+    '''
+
+    def __init__(self, indptr: np.ndarray, targets: np.ndarray, pools: np.ndarray, attributes: dict, token_prices: np.ndarray = None):
+        self.indptr = indptr
+        self.targets = targets
+        self.pools = pools
+        self.token_prices = np.full(len(indptr) - 1, np.nan)
+        if token_prices is not None:
+            # tokens interned after the table was built have no price yet
+            size = min(len(token_prices), len(self.token_prices))
+            self.token_prices[:size] = token_prices[:size]
+        for name, column in attributes.items():
+            setattr(self, name, column)
+
+    @classmethod
+    def from_store(cls, store) -> 'CSRGraph':
+        # a pool can't swap a token for itself
+        handles = np.flatnonzero(store.token0 != store.token1)
+        sources = np.concatenate((store.token0[handles], store.token1[handles]))
+        targets = np.concatenate((store.token1[handles], store.token0[handles]))
+        pools = np.concatenate((handles, handles))
+        order = np.argsort(sources, kind='stable')
+        counts = np.bincount(sources, minlength=len(TOKENS))
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        attributes = {
+            name: np.concatenate((getattr(store, forward)[handles], getattr(store, backward)[handles]))[order]
+            for name, (forward, backward) in EDGE_COLUMNS.items()
+        }
+        # the sushiswap subgraph reports reserves without decimals applied, the price impact functions adjust them the same way
+        sushiswap = attributes['protocol'] == PROTOCOL_CODES[SUSHISWAP_V2]
+        if sushiswap.any():
+            decimals = np.array([value or 0 for value in TOKENS.decimals], dtype=np.float64)
+            sorted_sources, sorted_targets = sources[order], targets[order]
+            attributes['reserve_in'][sushiswap] /= 10 ** decimals[sorted_sources[sushiswap]]
+            attributes['reserve_out'][sushiswap] /= 10 ** decimals[sorted_targets[sushiswap]]
+        attributes['spot_rate'] = spot_rates(attributes)
+        return cls(indptr, targets[order].astype(np.int32), pools[order], attributes, store.token_prices())
+
+    def __len__(self):
+        return len(self.targets)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.indptr) - 1
+
+    def node(self, token_id: str) -> int:
+        ''' Returns the node of a token, or None when no pool holds it. '''
+        node = TOKENS.lookup.get(token_id)
+        if node is None or node >= self.node_count or self.indptr[node] == self.indptr[node + 1]:
+            return None
+        return node
+
+    def out_edges(self, node: int, allowed: np.ndarray = None) -> np.ndarray:
+        ''' Returns the edges leaving a node, only those through allowed pools when given a mask over the store's handles. '''
+        edges = np.arange(self.indptr[node], self.indptr[node + 1])
+        if allowed is not None:
+            edges = edges[allowed[self.pools[edges]]]
+        return edges
+
+    def bfs(self, sources, allowed: np.ndarray = None, max_hops: int = None) -> np.ndarray:
+        ''' Returns the fewest swaps from any of the source nodes to every node, -1 where a node can't be reached. '''
+        hops = np.full(self.node_count, -1, dtype=np.int32)
+        frontier = np.unique(np.asarray(sources, dtype=np.int64))
+        hops[frontier] = 0
+        depth = 0
+        while len(frontier) and (max_hops is None or depth < max_hops):
+            depth += 1
+            edges = np.concatenate([self.out_edges(node, allowed) for node in frontier.tolist()])
+            reached = np.unique(self.targets[edges])
+            frontier = reached[hops[reached] < 0]
+            hops[frontier] = depth
+        return hops
+
+    def best_paths(self, source: int, target: int, amount: float, k: int = 10, max_hops: int = 3, allowed: np.ndarray = None) -> list:
+        '''
+        Returns up to k paths of at most max_hops swaps from source to target with the highest output bounds, best first,
+        as (bound in target tokens, edges) pairs. A swap can't return more than its input at the pool's spot rate, nor more
+        than the pool holds, and a path's bound chains these per hop. A partial path is dropped as soon as what it holds,
+        converted to target tokens with the token price table, falls below the k-th best complete path, value can only
+        shrink along a path while the pools trade near the table's prices. Tokens without a price are never pruned.
+        '''
+        if source is None or target is None or source == target:
+            return []
+        remaining = self.bfs([target], allowed, max_hops)
+        if remaining[source] < 0:
+            return []
+
+        # min-heap of the k best complete paths, the root is the bound to beat
+        best = []
+        visited = {source}
+        path = []
+
+        def extend(node: int, amount_in: float):
+            budget = max_hops - len(path) - 1
+            edges = self.out_edges(node, allowed)
+            reachable = remaining[self.targets[edges]]
+            edges = edges[(reachable >= 0) & (reachable <= budget)]
+            targets = self.targets[edges]
+            # an unpriced rate only leaves the reserve as the bound
+            amounts = np.nan_to_num(np.fmin(amount_in * self.spot_rate[edges], self.reserve_out[edges]))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bounds = np.where(targets == target, amounts, amounts * self.token_prices[targets] / self.token_prices[target])
+            bounds[~np.isfinite(bounds)] = np.inf
+            # best bound first, so good paths fill the heap early and everything after the first miss is pruned
+            order = np.argsort(-bounds, kind='stable')
+            for edge, next_node, amount_out, bound in zip(edges[order].tolist(), targets[order].tolist(), amounts[order].tolist(), bounds[order].tolist()):
+                if len(best) == k and bound <= best[0][0]:
+                    break
+                if next_node in visited:
+                    continue
+                path.append(edge)
+                if next_node == target:
+                    # ties keep the path with fewer swaps
+                    entry = (amount_out, -len(path), list(path))
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    else:
+                        heapq.heapreplace(best, entry)
+                else:
+                    visited.add(next_node)
+                    extend(next_node, amount_out)
+                    visited.discard(next_node)
+                path.pop()
+
+        extend(source, amount)
+        return [(amount_out, edges) for amount_out, _, edges in sorted(best, reverse=True)]
+
+    def swap_amounts(self, edges: np.ndarray, amount_in: float) -> np.ndarray:
+        ''' Returns what swapping amount_in through each edge returns, with the same formulas as the price impact functions. '''
+        reserve_in, reserve_out = self.reserve_in[edges], self.reserve_out[edges]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # constant product
+            amounts = reserve_out * amount_in / (reserve_in + amount_in)
+            # weighted pools, the fee comes off the input
+            weighted = np.isfinite(self.weight_in[edges]) & np.isfinite(self.weight_out[edges])
+            if weighted.any():
+                fee = np.nan_to_num(self.fee[edges][weighted])
+                ratio = reserve_in[weighted] / (reserve_in[weighted] + amount_in * (1 - fee))
+                amounts[weighted] = reserve_out[weighted] * (1 - ratio ** (self.weight_in[edges][weighted] / self.weight_out[edges][weighted]))
+            # quoted pools pay out at their price until they run dry
+            quoted = np.isin(self.protocol[edges], [PROTOCOL_CODES[CURVE], PROTOCOL_CODES[DODO]])
+            amounts[quoted] = np.fmin(amount_in * self.spot_rate[edges][quoted], reserve_out[quoted])
+        return np.where(np.isfinite(amounts) & (amounts > 0), amounts, 0.0)
+
+    def max_output_paths(self, source: int, target: int, amount: float, k: int = 1, max_hops: int = 3, allowed: np.ndarray = None) -> list:
+        '''
+        Returns up to k paths of at most max_hops swaps from source to target with the highest output, best first,
+        as (output amount, edges) pairs. Each swap is weighted by -log of its effective rate at the amount that actually
+        reaches it, with every token valued in target tokens through the token price table, and partial paths are expanded
+        lowest total weight first, so strong routes are found first and weak ones are never priced. A path that reaches
+        the target is valued at exactly its output. Each token is expanded at most k times. While the pools trade near
+        the table's prices no swap adds value, the weights are never negative and the first path to reach the target is
+        the best one. Tokens without a table price are expanded last.
+        '''
+        if source is None or target is None or source == target:
+            return []
+        remaining = self.bfs([target], allowed, max_hops)
+        if remaining[source] < 0:
+            return []
+
+        # (-log of the value held in target tokens, the sum of the swap weights up to a constant, insertion order, node, amount held, edges taken)
+        queue = [(0.0, 0, source, amount, ())]
+        pushed = 1
+        expanded = Counter()
+        found = []
+        while queue and len(found) < k:
+            _, _, node, amount_in, path = heapq.heappop(queue)
+            if node == target:
+                found.append((amount_in, list(path)))
+                continue
+            if expanded[node] == k:
+                continue
+            expanded[node] += 1
+
+            budget = max_hops - len(path) - 1
+            edges = self.out_edges(node, allowed)
+            reachable = remaining[self.targets[edges]]
+            edges = edges[(reachable >= 0) & (reachable <= budget)]
+            if path:
+                # a path never comes back to a token it already swapped out of
+                edges = edges[~np.isin(self.targets[edges], self.targets[list(path)]) & (self.targets[edges] != source)]
+            amounts = self.swap_amounts(edges, amount_in)
+            targets = self.targets[edges]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.nan_to_num(np.where(targets == target, amounts, amounts * self.token_prices[targets] / self.token_prices[target]), posinf=0.0)
+            for edge, next_node, amount_out, value in zip(edges.tolist(), targets.tolist(), amounts.tolist(), values.tolist()):
+                if amount_out <= 0:
+                    continue
+                weight = -math.log(value) if value > 0 else math.inf
+                heapq.heappush(queue, (weight, pushed, next_node, amount_out, path + (edge,)))
+                pushed += 1
+        return sorted(found, key=lambda result: -result[0])
+
+    def to_networkx(self, allowed: np.ndarray = None) -> nx.MultiDiGraph:
+        ''' Exports the graph, or just its edges through allowed pools, as a networkx graph keyed by pool handle. '''
+        edges = np.arange(len(self)) if allowed is None else np.flatnonzero(allowed[self.pools])
+        # an edge's source is the node whose row holds it
+        sources = np.searchsorted(self.indptr, edges, side='right') - 1
+        T = nx.MultiDiGraph()
+        for index, edge in enumerate(edges.tolist()):
+            T.add_edge(TOKENS.ids[sources[index]], TOKENS.ids[self.targets[edge]], key=int(self.pools[edge]),
+                       **{name: getattr(self, name)[edge].item() for name in EDGE_COLUMNS})
+        return T
+
+def spot_rates(edges: dict) -> np.ndarray:
+    ''' Output tokens per input token at each edge's current price, before price impact and fees. '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # constant product pools trade at the reserve ratio
+        rates = edges['reserve_out'] / edges['reserve_in']
+        # weighted pools scale it by the token weights
+        weighted = np.isfinite(edges['weight_in']) & np.isfinite(edges['weight_out'])
+        rates[weighted] = (edges['reserve_out'][weighted] / edges['weight_out'][weighted]) / (edges['reserve_in'][weighted] / edges['weight_in'][weighted])
+        # curve and DODO are quoted at the pool's own price, curve quotes the output in input tokens
+        curve = (edges['protocol'] == PROTOCOL_CODES[CURVE]) & np.isfinite(edges['token_price_in'])
+        rates[curve] = 1 / edges['token_price_in'][curve]
+        # while DODO's token1Price is 1 / lastTradePrice, so selling token0 pays out 1 / token1Price and vice versa
+        dodo = (edges['protocol'] == PROTOCOL_CODES[DODO]) & np.isfinite(edges['token_price_out'])
+        rates[dodo] = 1 / edges['token_price_out'][dodo]
+        # anything else unpriced falls back to the USD prices
+        unpriced = ~np.isfinite(rates) | (rates <= 0)
+        rates[unpriced] = edges['price_in_usd'][unpriced] / edges['price_out_usd'][unpriced]
+    return rates
@@ -8,6 +8,37 @@ import networkx as nx
 
 # standard library imports
 import json
+from collections import Counter, defaultdict
+
+# graph representations route_orders can search
+POOL_GRAPH = 'pool'
+TOKEN_GRAPH = 'token'
+
+# make the node SYMBOL1_SYMBOL2_ID, routes refer to pools by this name whichever graph found them
+def pool_name(pool: dict) -> str:
+    return pool['token0']['symbol'] + '_' + pool['token1']['symbol'] + '_' + pool['id']
+
+# the node name and attributes a pool is stored under
+def pool_node(pool: dict) -> tuple:
+    # check if the pool has reserveUSD or liquidityUSD
+    if 'reserveUSD' in pool:
+        metric = pool['reserveUSD'] 
+    elif 'liquidityUSD' in pool:
+        metric = pool['liquidityUSD']
+    elif 'totalValueLockedUSD' in pool:
+        metric = pool['totalValueLockedUSD']
+    elif 'liquidity' in pool:
+        metric = pool['liquidity']
+    return pool_name(pool), {
+        'id': pool['id'],
+        'metric': metric,
+        'token0': pool['token0'],
+        'token1': pool['token1'],
+        'reserve0': pool['reserve0'],
+        'reserve1': pool['reserve1'],
+        'price_impact': 0,
+        'pool': pool
+    }
 
 # create a graph where each pool is a node
 def construct_pool_graph(pools: json) -> nx.classes.graph.Graph:
@@ -17,42 +48,56 @@ def construct_pool_graph(pools: json) -> nx.classes.graph.Graph:
     for pool in pools:
         '''# if at least one of the pool's symbols are tokens A or B
         if pool['token0']['symbol'] == tokenA or pool['token0']['symbol'] == tokenB or pool['token1']['symbol'] == tokenA or pool['token1']['symbol'] == tokenB:'''
-        # check if the pool has reserveUSD or liquidityUSD
-        if 'reserveUSD' in pool:
-            metric = pool['reserveUSD'] 
-        elif 'liquidityUSD' in pool:
-            metric = pool['liquidityUSD']
-        elif 'totalValueLockedUSD' in pool:
-            metric = pool['totalValueLockedUSD']
-        elif 'liquidity' in pool:
-            metric = pool['liquidity']
-        # make the node SYMBOL1_SYMBOL2_ID
-        G.add_node(
-            pool['token0']['symbol'] + '_' + pool['token1']['symbol'] + '_' + pool['id'], id=pool['id'], 
-            metric=metric,
-            token0=pool['token0'],
-            token1=pool['token1'],
-            reserve0=pool['reserve0'],
-            reserve1=pool['reserve1'],
-            price_impact=0,
-            pool=pool)
-
-    # connect the nodes if they share a token
-    for node in list(G.nodes):
-        for node2 in list(G.nodes):
-            # check for common tokens
-            if G.nodes[node]['token0']['id'] == G.nodes[node2]['token0']['id'] or G.nodes[node]['token0']['id'] == G.nodes[node2]['token1']['id'] or G.nodes[node]['token1']['id'] == G.nodes[node2]['token0']['id'] or G.nodes[node]['token1']['id'] == G.nodes[node2]['token1']['id']:
-                # add an edge in both directions
-                G.add_edge(node, node2)
-                G.add_edge(node2, node)
-
-    # remove nodes that can't form a path
-    for node in list(G.nodes):
-        if len(list(G.edges(node))) < 3:
-            G.remove_node(node)
+        name, attributes = pool_node(pool)
+        G.add_node(name, **attributes)
+
+    # bucket the nodes by token, two nodes share a token exactly when they meet in a bucket
+    nodes = list(G.nodes)
+    node_tokens = [(G.nodes[node]['token0']['id'], G.nodes[node]['token1']['id']) for node in nodes]
+    buckets = defaultdict(list)
+    # nodes trading the same pair of tokens, counted once when both of their buckets are added up
+    pair_counts = Counter()
+    for index, (token0, token1) in enumerate(node_tokens):
+        buckets[token0].append(index)
+        if token1 != token0:
+            buckets[token1].append(index)
+            pair_counts[frozenset((token0, token1))] += 1
+
+    # remove nodes that can't form a path, a node's degree is the size of its two buckets (itself included)
+    token_counts = Counter({token: len(bucket) for token, bucket in buckets.items()})
+    removed = set()
+    for index, (token0, token1) in enumerate(node_tokens):
+        if token0 == token1:
+            degree = token_counts[token0]
+        else:
+            degree = token_counts[token0] + token_counts[token1] - pair_counts[frozenset((token0, token1))]
+        if degree < 3:
+            removed.add(index)
+            G.remove_node(nodes[index])
+            token_counts[token0] -= 1
+            if token1 != token0:
+                token_counts[token1] -= 1
+                pair_counts[frozenset((token0, token1))] -= 1
+
+    # connect the remaining nodes that share a token, in both directions since every node is joined with its whole buckets
+    for index, (token0, token1) in enumerate(node_tokens):
+        if index in removed:
+            continue
+        neighbours = sorted(set(buckets[token0]).union(buckets[token1]) - removed)
+        G.add_edges_from((nodes[index], nodes[neighbour]) for neighbour in neighbours)
+
+    # keep the buckets as an index of the pools holding each token, the path search starts and ends through it
+    G.graph['token_nodes'] = {token: [nodes[index] for index in bucket if index not in removed] for token, bucket in buckets.items()}
 
     # return the graph
     return G
 
 def pool_graph_to_dict(G: nx.DiGraph()) -> dict:
     return nx.to_dict_of_lists(G)
+
+# pools are keyed the same way as the pool store keys them, {id}_{token0}_{token1}
+def pool_key(pool: dict) -> str:
+    return f"{pool['id']}_{pool['token0']['id']}_{pool['token1']['id']}"
+
+def token_graph_to_dict(T: nx.MultiDiGraph) -> dict:
+    return nx.to_dict_of_lists(T)
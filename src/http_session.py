@@ -0,0 +1,57 @@
+'''
+This module manages the long-lived aiohttp session the collectors share, so page requests reuse warm connections.
+'''
+
+# standard library imports
+import asyncio
+import os
+import weakref
+# third party imports
+import aiohttp
+
+# connection pool settings, overridable with environment variables
+HTTP_LIMIT = int(os.getenv("ETAX_HTTP_LIMIT", default=100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("ETAX_HTTP_LIMIT_PER_HOST", default=10))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("ETAX_HTTP_KEEPALIVE_TIMEOUT", default=60))
+HTTP_DNS_CACHE_TTL = int(os.getenv("ETAX_HTTP_DNS_CACHE_TTL", default=300))
+HTTP_TIMEOUT = float(os.getenv("ETAX_HTTP_TIMEOUT", default=60))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("ETAX_HTTP_CONNECT_TIMEOUT", default=10))
+# how many requests may be in flight against a single endpoint at once
+ENDPOINT_CONCURRENCY = int(os.getenv("ETAX_ENDPOINT_CONCURRENCY", default=4))
+
+# a session is bound to the event loop that created it, the refresh thread and request handlers each run their own loop
+_sessions = weakref.WeakKeyDictionary()
+_endpoint_semaphores = weakref.WeakKeyDictionary()
+
+
+def get_session() -> aiohttp.ClientSession:
+    ''' Returns the running loop's shared session, creating it on first use. '''
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_LIMIT,
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            use_dns_cache=True,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL
+        )
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    ''' Closes the running loop's shared session, call it before the loop stops. '''
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def endpoint_semaphore(endpoint: str) -> asyncio.Semaphore:
+    ''' Returns the running loop's semaphore limiting concurrent requests to an endpoint. '''
+    semaphores = _endpoint_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if endpoint not in semaphores:
+        semaphores[endpoint] = asyncio.Semaphore(ENDPOINT_CONCURRENCY)
+    return semaphores[endpoint]
@@ -29,7 +29,7 @@ def get_token_price_usd(symbol, convert_to_symbol="USD"):
 G = nx.DiGraph()
 
 # calculate routes
-def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symbol: str, buy_symbol: str) -> dict:
+def calculate_routes(pools: dict, paths: list, sell_amount: float, sell_symbol: str, buy_symbol: str) -> dict:
     gas_fee = get_gas_fee_in_eth()
     count = 0
     routes = {}
@@ -37,8 +37,8 @@ def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symb
         try:
             swap_number = 0
             for pool in path:
-                protocol = G.nodes[pool]['pool']['protocol']
-                dangerous = G.nodes[pool]['pool']['dangerous']
+                protocol = pools[pool]['protocol']
+                dangerous = pools[pool]['dangerous']
 
                 if protocol == 'Balancer_V1' or protocol == 'Balancer_V2':
                     price_impact_function = constant_mean_price_impact
@@ -50,7 +50,7 @@ def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symb
                 if pool == path[0]:
                     # get the price impact calculator values
                     values = price_impact_function(
-                        G.nodes[pool]['pool'], sell_symbol, sell_amount)
+                        pools[pool], sell_symbol, sell_amount)
 
                     output_symbol = values['buy_symbol']
                     output_amount = values['actual_return']
@@ -59,7 +59,7 @@ def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symb
 
                     # determine whether output_symbol is token0 or token1
                     output_token_num = 0
-                    if output_symbol == G.nodes[pool]['pool']['token1']['symbol']:
+                    if output_symbol == pools[pool]['token1']['symbol']:
                         output_token_num = 1
 
                     # add the route to the dictionary under the swap key
@@ -72,13 +72,13 @@ def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symb
                             'dangerous': dangerous,
                             'input_token': sell_symbol,
                             'input_amount': sell_amount,
-                            'input_amount_usd': sell_amount*float(G.nodes[pool][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else 0, # ^1 flips 0 to 1 and 1 to 0
+                            'input_amount_usd': sell_amount*float(pools[pool][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else 0, # ^1 flips 0 to 1 and 1 to 0
                             'output_token': output_symbol,
                             'output_amount': output_amount,
-                            'output_amount_usd': output_amount*float(G.nodes[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else 0,
+                            'output_amount_usd': output_amount*float(pools[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else 0,
                             'price_impact': price_impact,
                             'price': sell_amount/output_amount if not output_amount_zero else float('inf'),
-                            'price_usd': sell_amount*float(G.nodes[pool][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(G.nodes[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf'),
+                            'price_usd': sell_amount*float(pools[pool][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(pools[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf'),
                             'gas_fee': gas_fee,
                             'description': description
                         }
@@ -90,7 +90,7 @@ def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symb
                     input_amount = output_amount
                     old_input_symbol = output_symbol
                     values = price_impact_function(
-                        G.nodes[pool]['pool'], output_symbol, output_amount)
+                        pools[pool], output_symbol, output_amount)
                     
                     output_symbol = values['buy_symbol']
                     output_amount = values['actual_return']
@@ -99,7 +99,7 @@ def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symb
 
                     # determine whether output_symbol is token0 or token1
                     output_token_num = 0
-                    if output_symbol == G.nodes[pool]['pool']['token1']['symbol']:
+                    if output_symbol == pools[pool]['token1']['symbol']:
                         output_token_num = 1
 
                     output_amount_zero = output_amount == 0
@@ -111,13 +111,13 @@ def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symb
                         'dangerous': dangerous,
                         'input_token': old_input_symbol,
                         'input_amount': input_amount,
-                        'input_amount_usd': input_amount*float(G.nodes[pool][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else 0, # ^1 flips 0 to 1 and 1 to 0
+                        'input_amount_usd': input_amount*float(pools[pool][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else 0, # ^1 flips 0 to 1 and 1 to 0
                         'output_token': output_symbol,
                         'output_amount': output_amount,
-                        'output_amount_usd': output_amount*float(G.nodes[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else 0,
+                        'output_amount_usd': output_amount*float(pools[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else 0,
                         'price_impact': price_impact,
                         'price': input_amount/output_amount if not output_amount_zero else float('inf'),
-                        'price_usd': input_amount*float(G.nodes[pool][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(G.nodes[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf'),
+                        'price_usd': input_amount*float(pools[pool][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(pools[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf'),
                         'gas_fee': gas_fee,
                         'description': description
                     }
@@ -128,12 +128,12 @@ def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symb
                 output_amount_zero = output_amount == 0
                 # add the final price, total gas fee, and path to the dictionary
                 routes[f'route_{count}']['amount_in'] = sell_amount
-                routes[f'route_{count}']['amount_in_usd'] = sell_amount*float(G.nodes[path[0]]['pool'][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else None
+                routes[f'route_{count}']['amount_in_usd'] = sell_amount*float(pools[path[0]][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else None
                 routes[f'route_{count}']['amount_out'] = output_amount
-                routes[f'route_{count}']['amount_out_usd'] = output_amount*float(G.nodes[path[-1]]['pool'][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else None
+                routes[f'route_{count}']['amount_out_usd'] = output_amount*float(pools[path[-1]][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else None
 
             routes[f'route_{count}']['price'] = sell_amount/output_amount if not output_amount_zero else float('inf')
-            routes[f'route_{count}']['price_usd'] = sell_amount*float(G.nodes[path[0]]['pool'][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(G.nodes[path[-1]]['pool'][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf')
+            routes[f'route_{count}']['price_usd'] = sell_amount*float(pools[path[0]][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(pools[path[-1]][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf')
             routes[f'route_{count}']['gas_fee'] = gas_fee*swap_number
             routes[f'route_{count}']['path'] = path
             routes[f'route_{count}']['price_impact'] = sum(
@@ -155,12 +155,12 @@ def calculate_routes(G: nx.DiGraph(), paths: list, sell_amount: float, sell_symb
     return routes
 
 
-def get_sub_route(g, path: dict, new_sell_amount: float, sell_symbol: str, p: float, gas_fee: float):
+def get_sub_route(pools: dict, path: dict, new_sell_amount: float, sell_symbol: str, p: float, gas_fee: float):
     route = {'percent': p}
     swap_no = 0
     for pool in path:
-        protocol = g.nodes[pool]['pool']['protocol']
-        dangerous = g.nodes[pool]['pool']['dangerous']
+        protocol = pools[pool]['protocol']
+        dangerous = pools[pool]['dangerous']
 
         if protocol == 'Balancer_V1' or protocol == 'Balancer_V2':
             price_impact_function = constant_mean_price_impact
@@ -172,7 +172,7 @@ def get_sub_route(g, path: dict, new_sell_amount: float, sell_symbol: str, p: fl
         if pool == path[0]:
             # get the price impact calculator values
             values = price_impact_function(
-                g.nodes[pool]['pool'], sell_symbol, new_sell_amount)
+                pools[pool], sell_symbol, new_sell_amount)
 
             output_symbol = values['buy_symbol']
             output_amount = values['actual_return']
@@ -181,7 +181,7 @@ def get_sub_route(g, path: dict, new_sell_amount: float, sell_symbol: str, p: fl
 
             # determine whether output_symbol is token0 or token1
             output_token_num = 0
-            if output_symbol == g.nodes[pool]['pool']['token1']['symbol']:
+            if output_symbol == pools[pool]['token1']['symbol']:
                 output_token_num = 1
 
             output_amount_zero = output_amount == 0
@@ -193,13 +193,13 @@ def get_sub_route(g, path: dict, new_sell_amount: float, sell_symbol: str, p: fl
                 'dangerous': dangerous,
                 'input_token': sell_symbol,
                 'input_amount': new_sell_amount,
-                'input_amount_usd': new_sell_amount*float(g.nodes[pool]['pool'][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else 0, # ^1 flips 0 to 1 and 1 to 0
+                'input_amount_usd': new_sell_amount*float(pools[pool][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else 0, # ^1 flips 0 to 1 and 1 to 0
                 'output_token': output_symbol,
                 'output_amount': output_amount,
-                'output_amount_usd': output_amount*float(g.nodes[pool]['pool'][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else 0,
+                'output_amount_usd': output_amount*float(pools[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else 0,
                 'price_impact': price_impact,
                 'price': new_sell_amount/output_amount if not output_amount_zero else float('inf'),
-                'price_usd': new_sell_amount*float(g.nodes[pool]['pool'][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(g.nodes[pool]['pool'][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf'),
+                'price_usd': new_sell_amount*float(pools[pool][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(pools[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf'),
                 'gas_fee': gas_fee,
                 'description': description,
             }
@@ -208,7 +208,7 @@ def get_sub_route(g, path: dict, new_sell_amount: float, sell_symbol: str, p: fl
             input_amount = output_amount
             old_input_symbol = output_symbol
             values = price_impact_function(
-                g.nodes[pool]['pool'], output_symbol, output_amount)
+                pools[pool], output_symbol, output_amount)
 
             output_symbol = values['buy_symbol']
             output_amount = values['actual_return']
@@ -217,7 +217,7 @@ def get_sub_route(g, path: dict, new_sell_amount: float, sell_symbol: str, p: fl
 
             # determine whether output_symbol is token0 or token1
             output_token_num = 0
-            if output_symbol == g.nodes[pool]['pool']['token1']['symbol']:
+            if output_symbol == pools[pool]['token1']['symbol']:
                 output_token_num = 1
 
             output_amount_zero = output_amount == 0
@@ -229,13 +229,13 @@ def get_sub_route(g, path: dict, new_sell_amount: float, sell_symbol: str, p: fl
                 'dangerous': dangerous,
                 'input_token': old_input_symbol,
                 'input_amount': input_amount,
-                'input_amount_usd': input_amount*float(g.nodes[pool]['pool'][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else 0, # ^1 flips 0 to 1 and 1 to 0
+                'input_amount_usd': input_amount*float(pools[pool][f'token{output_token_num^1}']['priceUSD']) if not output_amount_zero else 0, # ^1 flips 0 to 1 and 1 to 0
                 'output_token': output_symbol,
                 'output_amount': output_amount,
-                'output_amount_usd': output_amount*float(g.nodes[pool]['pool'][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else 0,
+                'output_amount_usd': output_amount*float(pools[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else 0,
                 'price_impact': price_impact,
                 'price': input_amount/output_amount if not output_amount_zero else float('inf'),
-                'price_usd': input_amount*float(g.nodes[pool]['pool'][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(g.nodes[pool]['pool'][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf'),
+                'price_usd': input_amount*float(pools[pool][f'token{output_token_num^1}']['priceUSD'])/output_amount*float(pools[pool][f'token{output_token_num}']['priceUSD']) if not output_amount_zero else float('inf'),
                 'gas_fee': gas_fee,
                 'description': description,
                 'percent': p
@@ -246,7 +246,7 @@ def get_sub_route(g, path: dict, new_sell_amount: float, sell_symbol: str, p: fl
     return route
 
 
-def get_final_route(g, routes: dict, sell_amount: float, sell_symbol: str) -> list:
+def get_final_route(pools: dict, routes: dict, sell_amount: float, sell_symbol: str) -> list:
     """Given a list of valid routes, sorted by amount out, get a final path which may split the order into multiple paths."""
     final_route = {'paths': []}
     remaining = sell_amount
@@ -256,15 +256,15 @@ def get_final_route(g, routes: dict, sell_amount: float, sell_symbol: str) -> li
         # get the max amount that can be swapped without exceeding the price impact limit
         first_pool_id = route['swap_0']['pool']
         second_pool_id = route['swap_1']['pool'] if 'swap_1' in route else 0
-        first_pool = g.nodes[first_pool_id]['pool']
+        first_pool = pools[first_pool_id]
 
-        max_amount = min(get_max_amount_for_impact_limit(g, route), remaining)
+        max_amount = min(get_max_amount_for_impact_limit(pools, route), remaining)
         p = (max_amount / sell_amount) * 100
         if p < 1:
             continue
         # add the route to the final path
         final_route['paths'].append(get_sub_route(
-            g, route['path'], max_amount, sell_symbol, p, gas_fee))
+            pools, route['path'], max_amount, sell_symbol, p, gas_fee))
         route_num += 1
         if route_num == MAX_ROUTES:
             break
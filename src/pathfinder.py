@@ -6,26 +6,65 @@ This file contains the functions that find the shortest paths between two symbol
 import networkx as nx
 # import matplotlib.pyplot as plt
 
-# get the shortest paths from sell_symbol to buy_symbol using bellman-ford
-def find_shortest_paths(G: nx.classes.digraph.DiGraph, sell_symbol: str, buy_symbol: str) -> list:
-    # get all nodes that contain the sell symbol
-    sell_nodes = [node for node in list(G.nodes) if sell_symbol in node]
-    # get all nodes that contain the buy symbol
-    buy_nodes = [node for node in list(G.nodes) if buy_symbol in node]
-    # get all paths
+# token id -> the pool nodes holding the token, construct_pool_graph leaves this index on the graph
+def token_node_index(G: nx.classes.digraph.DiGraph) -> dict:
+    if 'token_nodes' in G.graph:
+        return G.graph['token_nodes']
+    index = {}
+    for node, data in G.nodes(data=True):
+        for token in {data['token0']['id'], data['token1']['id']}:
+            index.setdefault(token, []).append(node)
+    return index
+
+# get the shortest paths from the pools holding sell_id to the pools holding buy_id with a single breadth first search
+def find_shortest_paths(G: nx.classes.digraph.DiGraph, sell_id: str, buy_id: str) -> list:
+    '''
+    The search starts from every sell pool at once and keeps every predecessor on a shortest path, so it visits each
+    pool once however many sell and buy pools there are. Returns one shortest path to each reachable buy pool from
+    every sell pool at the buy pool's minimal distance, shortest first. Unlike a shortest path per sell and buy pool
+    pair, a sell pool farther from the buy pool than the nearest one gets no path to it.
+    '''
+    index = token_node_index(G)
+    sell_nodes = index.get(sell_id, [])
+    buy_nodes = set(index.get(buy_id, []))
+    if not sell_nodes or not buy_nodes:
+        return []
+
+    # pool -> hops from the nearest sell pool, the pools one hop closer on its shortest paths,
+    # and the sell pools those shortest paths start from
+    distance = {node: 0 for node in sell_nodes}
+    parents = {node: [] for node in sell_nodes}
+    origins = {node: {node} for node in sell_nodes}
+    frontier = list(sell_nodes)
+    reached = [node for node in frontier if node in buy_nodes]
+    found = len(reached)
+    while frontier and found < len(buy_nodes):
+        next_frontier = []
+        for node in frontier:
+            for neighbour in G.successors(node):
+                if neighbour not in distance:
+                    distance[neighbour] = distance[node] + 1
+                    parents[neighbour] = [node]
+                    origins[neighbour] = set(origins[node])
+                    next_frontier.append(neighbour)
+                    if neighbour in buy_nodes:
+                        reached.append(neighbour)
+                        found += 1
+                elif distance[neighbour] == distance[node] + 1:
+                    parents[neighbour].append(node)
+                    origins[neighbour] |= origins[node]
+        frontier = next_frontier
+
+    # walk back from each buy pool once per sell pool, always through a predecessor reachable from that sell pool,
+    # the buy pools were reached in order of distance
+    order = {node: rank for rank, node in enumerate(sell_nodes)}
     paths = []
-    # for each sell node
-    for sell_node in sell_nodes:
-        # for each buy node
-        for buy_node in buy_nodes:
-            # get the shortest path from the sell node to the buy node
-            try:
-                paths.append(list(nx.shortest_path(G, sell_node, buy_node)))
-            except:
-                pass
-    # sort the paths by length
-    paths.sort(key=len)
-    # return the paths
+    for node in reached:
+        for origin in sorted(origins[node], key=order.get):
+            path = [node]
+            while path[-1] != origin:
+                path.append(next(parent for parent in parents[path[-1]] if origin in origins[parent]))
+            paths.append(path[::-1])
     return paths
 
 def get_partner_symbol(node: str, current_symbol: str) -> str:
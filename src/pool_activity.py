@@ -0,0 +1,120 @@
+'''
+This module tracks how often routes use each pool and how much its reserves move, and ranks pools into refresh tiers from that.
+'''
+
+# local imports
+from pool_store import PoolStore
+# standard library imports
+import os
+import time
+from threading import Lock
+# third party imports
+import numpy as np
+
+# how fast route usage is forgotten, a use counts half as much after this many seconds
+USAGE_HALF_LIFE = float(os.getenv("ETAX_USAGE_HALF_LIFE", default=600))
+# smoothing of the reserve moves, higher reacts faster to the latest refresh
+VOLATILITY_ALPHA = float(os.getenv("ETAX_VOLATILITY_ALPHA", default=0.3))
+# a 1% reserve move per refresh ranks like one recent route through the pool
+VOLATILITY_WEIGHT = float(os.getenv("ETAX_VOLATILITY_WEIGHT", default=100))
+# pools of each protocol kept in the hot tier
+HOT_POOLS = int(os.getenv("ETAX_HOT_POOLS", default=100))
+
+# protocol -> pool id -> (decayed use count, time of the last use)
+route_usage = {}
+# protocol -> pool id -> smoothed relative reserve move per refresh
+reserve_volatility = {}
+# route handlers and the refresh thread both record activity
+activity_lock = Lock()
+
+
+def decayed(count: float, since: float, now: float) -> float:
+    return count * 0.5 ** ((now - since) / USAGE_HALF_LIFE)
+
+
+def record_route_usage(pools):
+    ''' Counts one use of every (protocol, pool id) a returned route swaps through. '''
+    now = time.time()
+    with activity_lock:
+        for protocol, pool_id in pools:
+            usage = route_usage.setdefault(protocol, {})
+            count, since = usage.get(pool_id, (0.0, now))
+            usage[pool_id] = (decayed(count, since, now) + 1, now)
+
+
+def record_reserve_moves(protocol: str, old_store: PoolStore, new_store: PoolStore):
+    ''' Folds the reserve moves between a protocol's previous and new pools into their volatility. '''
+    old_lookup = old_store.key_lookup()
+    pairs = [(new_handle, old_lookup[key]) for new_handle, key in enumerate(new_store.keys()) if key in old_lookup]
+    if not pairs:
+        return
+    new_handles, old_handles = np.array(pairs).T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        moves = np.maximum(
+            np.abs(new_store.reserve0[new_handles] - old_store.reserve0[old_handles]) / old_store.reserve0[old_handles],
+            np.abs(new_store.reserve1[new_handles] - old_store.reserve1[old_handles]) / old_store.reserve1[old_handles]
+        )
+    moves = np.nan_to_num(moves, nan=0.0, posinf=1.0)
+
+    # a multi-asset pool has several pairs, it moves as much as its most moved pair
+    moved = {}
+    for pool_id, move in zip(new_store.id[new_handles].tolist(), moves.tolist()):
+        moved[pool_id] = max(move, moved.get(pool_id, 0.0))
+
+    with activity_lock:
+        volatility = reserve_volatility.setdefault(protocol, {})
+        for pool_id, move in moved.items():
+            smoothed = VOLATILITY_ALPHA * move + (1 - VOLATILITY_ALPHA) * volatility.get(pool_id, 0.0)
+            if smoothed > 1e-9:
+                volatility[pool_id] = smoothed
+            else:
+                volatility.pop(pool_id, None)
+
+
+def activity_scores(protocol: str) -> dict:
+    ''' Returns the activity score of every pool of the protocol with any route usage or reserve movement. '''
+    now = time.time()
+    with activity_lock:
+        usage = route_usage.get(protocol, {})
+        scores = {pool_id: decayed(count, since, now) for pool_id, (count, since) in usage.items()}
+        # forget pools whose uses have all but decayed away
+        for pool_id in [pool_id for pool_id, score in scores.items() if score < 0.01]:
+            del usage[pool_id]
+            del scores[pool_id]
+        for pool_id, volatility in reserve_volatility.get(protocol, {}).items():
+            scores[pool_id] = scores.get(pool_id, 0.0) + VOLATILITY_WEIGHT * volatility
+    return scores
+
+
+def hot_pools(protocol: str, store: PoolStore, count: int = HOT_POOLS) -> list:
+    '''
+    Returns the ids of the protocol's hot tier, its most active pools in the store.
+    Until enough pools have seen any activity the tier is topped up with the most liquid pools.
+    '''
+    if not len(store):
+        return []
+    scores = activity_scores(protocol)
+    pool_ids = store.id.tolist()
+    ranked = sorted((pool_id for pool_id in set(pool_ids) if scores.get(pool_id, 0.0) > 0), key=scores.get, reverse=True)[:count]
+    if len(ranked) < count:
+        chosen = set(ranked)
+        for handle in np.argsort(-store.liquidity, kind='stable').tolist():
+            pool_id = pool_ids[handle]
+            if pool_id not in chosen:
+                chosen.add(pool_id)
+                ranked.append(pool_id)
+                if len(ranked) == count:
+                    break
+    return ranked
+
+
+def activity_stats() -> dict:
+    with activity_lock:
+        return {
+            protocol: {
+                'used_pools': len(route_usage.get(protocol, {})),
+                'moving_pools': len(reserve_volatility.get(protocol, {}))
+            }
+            for protocol in set(route_usage) | set(reserve_volatility)
+        }
@@ -3,15 +3,19 @@ This file handles the querying of liquidity pool data from various DEXs.
 '''
 
 # locla utility imports
-from constants import UNISWAP_V2, UNISWAP_V3, SUSHISWAP_V2, CURVE, BALANCER_V1, BALANCER_V2, DODO, PANCAKESWAP_V3
+from constants import UNISWAP_V2, UNISWAP_V3, SUSHISWAP_V2, CURVE, BALANCER_V1, BALANCER_V2, DODO, PANCAKESWAP_V3, DEX_METRIC_MAP
+from pool_records import TOKENS, MultiAssetPool, to_float
+from http_session import endpoint_semaphore
+import transport
+from circuit_breaker import RetryableError, call_with_retry
 
 # standard library imports
 import asyncio
-import aiohttp
 import json
-from itertools import combinations
+from functools import lru_cache
 import logging
-import requests
+import os
+import time
 
 # Collect the list of bad_tokens
 with open(r'data/bad_tokens.json') as f:
@@ -27,664 +31,568 @@ BALANCER_V2_ENDPOINT = "https://api.thegraph.com/subgraphs/name/balancer-labs/ba
 DODO_ENDPOINT = "https://api.thegraph.com/subgraphs/name/dodoex/dodoex-v2"
 PANCAKESWAP_V3_ENDPOINT = "https://api.thegraph.com/subgraphs/name/pancakeswap/exchange-v3-eth"
 
-
-def pancakeswap_v3_query(X: int, skip: int, max_metric: float):
-    if not max_metric:
-        return f"""
-        {{
-        pools(first: {X}, skip: {skip}, orderDirection: desc, orderBy: totalValueLockedUSD) {{
-            token0 {{
-            id
-            symbol
-            decimals
-            }}
-            token1 {{
-            symbol
-            id
-            decimals
-            }}
-            id
-            totalValueLockedToken0
-            totalValueLockedToken1
-            totalValueLockedUSD
-            liquidity
-            token0Price
-            token1Price
-            feeTier
-            sqrtPrice
-        }}
-        }}
-        """
-    else:
-        return f"""
-        {{
-        pools(first: {X}, skip: {skip}, orderDirection: desc, orderBy: totalValueLockedUSD, where: {{totalValueLockedUSD_lt: {max_metric}}}) {{
-            token0 {{
-            id
-            symbol
-            decimals
-            }}
-            token1 {{
-            symbol
-            id
-            decimals
-            }}
-            id
-            totalValueLockedToken0
-            totalValueLockedToken1
-            totalValueLockedUSD
-            liquidity
-            token0Price
-            token1Price
-            feeTier
-            sqrtPrice
-        }}
-        }}
-        """
-
-        
-def dodo_query(X: int, skip: int, max_metric: float):
-    if not max_metric:
-        return f"""
-        {{
-        pairs(first: {X}, orderBy: volumeUSD, orderDirection: desc, skip: {skip}, where:{{type_not: "VIRTUAL"}}) {{
-            baseReserve
-            baseToken {{
-            decimals
-            id
-            name
-            usdPrice
-            symbol
-            }}
-            i
-            id
-            feeUSD
-            feeBase
-            feeQuote
-            k
-            lastTradePrice
-            quoteReserve
-            quoteToken {{
-            decimals
-            id
-            name
-            usdPrice
-            symbol
-            }}
-            volumeUSD
-            type
-        }}
-        }}
-        """
-    else:
-        return f"""
-        {{
-        pairs(first: {X}, orderBy: volumeUSD, orderDirection: desc, skip: {skip}, where: {{volumeUSD_lt: {max_metric}, type_not: "VIRTUAL"}}) {{
-            baseReserve
-            baseToken {{
-            decimals
-            id
-            name
-            usdPrice
-            symbol
-            }}
-            i
-            id
-            feeUSD
-            feeBase
-            feeQuote
-            k
-            lastTradePrice
-            quoteReserve
-            quoteToken {{
-            decimals
-            id
-            name
-            usdPrice
-            symbol
-            }}
-            volumeUSD
-            type
-        }}
-        }}
-        """
-
-def uniswap_v3_query(X: int, skip: int, max_metric: float):
-    if not max_metric:
-        return f"""
-        {{
-        pools(first:1000, skip: {skip}, orderDirection: desc, orderBy: totalValueLockedUSD) {{
-            token0 {{
-                id
-                symbol
-                decimals
-            }}
-            token1 {{
-                symbol
-                id
-                decimals
-            }}
-            id
-            totalValueLockedToken0
-            totalValueLockedToken1
-            totalValueLockedUSD
-            token0Price
-            token1Price
-            liquidity
-            sqrtPrice
-        }}
-        }}
-        """
-    else:
-        return f"""
-        {{
-        pools(first:1000, skip: {skip}, orderDirection: desc, orderBy: totalValueLockedUSD, where: {{totalValueLockedUSD_lt: {max_metric}}}) {{
-            token0 {{
-            id
-            symbol
-            decimals
-            }}
-            token1 {{
-            symbol
-            id
-            decimals
-            }}
-            id
-            totalValueLockedToken0
-            totalValueLockedToken1
-            totalValueLockedUSD
-            token0Price
-            token1Price
-            liquidity
-            sqrtPrice
-        }}
-        }}
-        """
-    
-
-def balancer_v1_query(X: int, skip: int, max_metric: float):
-    if not max_metric:
-        return f"""
-        {{
-        pools(first: {X}, orderBy: liquidity, orderDirection: desc, skip: {skip}) {{
-            id
-            liquidity
-            swapFee
-            tokensList
-            tokens(orderBy: address) {{
-                address
-                balance
-                symbol
-                denormWeight
-            }}
-            }}
-        }}
-        """
-    else:
-        return f"""
-        {{
-        pools(first: {X}, orderBy: liquidity, orderDirection: desc, skip: {skip}, where: {{liquidity_lt: {max_metric}}}) {{
-            id
-            liquidity
-            swapFee
-            tokensList
-            tokens(orderBy: address) {{
-                address
-                balance
-                symbol
-                denormWeight
-            }}
-            }}
-        }}
-        """
-
-
-def fetch_balancer_v1_token_prices(token_ids, missing_ids=None):
-    # GraphQL endpoint
-    url = BALANCER_V1_ENDPOINT
-
-    # GraphQL query for token prices
-    query = """
-    query ($tokenIds: [String!]) {
-      tokenPrices(where: {id_in: $tokenIds}) {
+SUBGRAPH_ENDPOINTS = {
+    UNISWAP_V2: UNISWAPV2_ENDPOINT,
+    UNISWAP_V3: UNISWAPV3_ENDPOINT,
+    SUSHISWAP_V2: SUSHISWAPV2_ENDPOINT,
+    BALANCER_V1: BALANCER_V1_ENDPOINT,
+    BALANCER_V2: BALANCER_V2_ENDPOINT,
+    DODO: DODO_ENDPOINT,
+    PANCAKESWAP_V3: PANCAKESWAP_V3_ENDPOINT
+}
+
+# number of id bands a subgraph protocol is split into and paged concurrently
+PAGINATION_BANDS = int(os.getenv("ETAX_PAGINATION_BANDS", default=16))
+# pages merged into one aliased request to a subgraph
+BATCH_PAGES = int(os.getenv("ETAX_BATCH_PAGES", default=4))
+
+
+# the entity each subgraph lists its pools as, and the GraphQL type of one pool
+POOL_ENTITIES = {
+    UNISWAP_V2: ('pairs', 'Pair'),
+    SUSHISWAP_V2: ('pairs', 'Pair'),
+    UNISWAP_V3: ('pools', 'Pool'),
+    BALANCER_V1: ('pools', 'Pool'),
+    BALANCER_V2: ('pools', 'Pool'),
+    DODO: ('pairs', 'Pair'),
+    PANCAKESWAP_V3: ('pools', 'Pool')
+}
+
+# the fields collected for each pool
+POOL_FIELDS = {
+    UNISWAP_V2: """
+        id
+        reserveUSD
+        reserve0
+        reserve1
+        token0Price
+        token1Price
+        token0 { id symbol decimals }
+        token1 { id symbol decimals }
+    """,
+    SUSHISWAP_V2: """
+        id
+        liquidityUSD
+        reserve0
+        reserve1
+        token0Price
+        token1Price
+        token0 { id symbol decimals }
+        token1 { id symbol decimals }
+    """,
+    UNISWAP_V3: """
+        id
+        token0 { id symbol decimals }
+        token1 { id symbol decimals }
+        totalValueLockedToken0
+        totalValueLockedToken1
+        totalValueLockedUSD
+        token0Price
+        token1Price
+        liquidity
+        sqrtPrice
+    """,
+    BALANCER_V1: """
+        id
+        liquidity
+        swapFee
+        tokensList
+        tokens(orderBy: address) { address balance symbol denormWeight }
+    """,
+    BALANCER_V2: """
+        address
+        swapFee
+        tokensList
+        totalLiquidity
+        tokens {
+          address
+          balance
+          symbol
+          weight
+          token { totalBalanceUSD latestUSDPrice }
+        }
+    """,
+    DODO: """
         id
-        price
-      }
-    }
+        i
+        k
+        type
+        baseReserve
+        quoteReserve
+        lastTradePrice
+        feeUSD
+        feeBase
+        feeQuote
+        volumeUSD
+        baseToken { id symbol name decimals usdPrice }
+        quoteToken { id symbol name decimals usdPrice }
+    """,
+    PANCAKESWAP_V3: """
+        id
+        token0 { id symbol decimals }
+        token1 { id symbol decimals }
+        totalValueLockedToken0
+        totalValueLockedToken1
+        totalValueLockedUSD
+        liquidity
+        token0Price
+        token1Price
+        feeTier
+        sqrtPrice
     """
+}
+
+# conditions every query of a protocol carries
+FIXED_FILTERS = {
+    DODO: {'type_not': 'VIRTUAL'}
+}
+
+
+def pool_filter(protocol: str, max_metric: float = None, id_band: tuple = None, changed_since: int = None, ids: list = None, tied_ids: list = None) -> dict:
+    '''
+    Builds the where variable of a page: an optional metric cursor, an id band, a changed since block and a list of pool ids.
+    Metrics aren't unique, so the cursor also takes the ids already collected at max_metric, the pools tied with them are
+    still fetched, whatever order the subgraph breaks the tie in.
+    '''
+    where = dict(FIXED_FILTERS.get(protocol, {}))
+    if id_band:
+        id_gte, id_lt = id_band
+        if id_gte:
+            where['id_gte'] = id_gte
+        if id_lt:
+            where['id_lt'] = id_lt
+    if changed_since is not None:
+        where['_change_block'] = {'number_gte': changed_since}
+    # balancer v2 pools are stored by their address, their subgraph id has the pool's specialization appended
+    id_field = 'address' if protocol == BALANCER_V2 else 'id'
+    if ids is not None:
+        where[f'{id_field}_in'] = list(ids)
+    if max_metric:
+        metric_field = DEX_METRIC_MAP[protocol]
+        # the metrics are BigDecimals, which GraphQL variables carry as strings
+        below = dict(where, **{f'{metric_field}_lt': str(max_metric)})
+        if tied_ids:
+            # a filter can't mix or with other fields, so both branches carry the rest of the conditions
+            where = {'or': [below, dict(where, **{metric_field: str(max_metric), f'{id_field}_not_in': sorted(tied_ids)})]}
+        else:
+            where = below
+    return where
+
+
+def page_cursor(protocol: str, pools: list) -> tuple:
+    ''' The cursor after the last of the pools collected so far, its metric and the ids of the pools tied with it. '''
+    metric_field = DEX_METRIC_MAP[protocol]
+    id_field = 'address' if protocol == BALANCER_V2 else 'id'
+    last_metric = pools[-1][metric_field]
+    tied_ids = []
+    for pool in reversed(pools):
+        if pool[metric_field] != last_metric:
+            break
+        tied_ids.append(pool[id_field])
+    return last_metric, tied_ids
+
+
+@lru_cache(maxsize=None)
+def pools_document(protocol: str, pages: int) -> str:
+    '''
+    Returns the query for a batch of pages of a protocol's pools, page{i} is an aliased field with its own first{i} and where{i} variables.
+    Documents are built once per protocol and batch size, only the variables change between requests.
+    '''
+    entity, pool_type = POOL_ENTITIES[protocol]
+    variables = ', '.join(f'$first{i}: Int!, $where{i}: {pool_type}_filter' for i in range(pages))
+    fields = '\n'.join(
+        f'  page{i}: {entity}(first: $first{i}, orderBy: {DEX_METRIC_MAP[protocol]}, orderDirection: desc, where: $where{i}) {{ ...pool }}'
+        for i in range(pages)
+    )
+    return f'''query ({variables}) {{
+{fields}
+}}
+fragment pool on {pool_type} {{{POOL_FIELDS[protocol]}}}
+'''
+
+
+# balancer v1 token prices by token id, with when they were fetched
+token_price_cache = {}
+TOKEN_PRICE_TTL = float(os.getenv("ETAX_TOKEN_PRICE_TTL", default=300))
+
+
+@lru_cache(maxsize=None)
+def token_prices_document(chunks: int) -> str:
+    ''' Returns the query for a batch of token price chunks, prices{i} is an aliased field with its own ids{i} variable. '''
+    variables = ', '.join(f'$ids{i}: [String!]' for i in range(chunks))
+    fields = '\n'.join(f'  prices{i}: tokenPrices(first: 1000, where: {{id_in: $ids{i}}}) {{ id price }}' for i in range(chunks))
+    return f'''query ({variables}) {{
+{fields}
+}}
+'''
 
-    def chunks(lst, n):
-        """Yield successive n-sized chunks from lst."""
-        for i in range(0, len(lst), n):
-            yield lst[i:i + n]
 
-    token_prices = {}
-    chunk_size = 50
-    for token_chunk in chunks(token_ids, chunk_size):
-        # Fetch token prices
-        response = requests.post(url, json={'query': query, 'variables': {'tokenIds': token_chunk}})
-        prices = json.loads(response.text)["data"]["tokenPrices"]
-        token_prices.update({price["id"]: float(price["price"]) for price in prices})
+async def fetch_balancer_v1_token_prices(token_ids, chunk_size: int = 50) -> dict:
+    ''' Returns the USD price of every token, fetching the tokens missing from the cache in concurrent batches of chunks. '''
+    now = time.time()
+    stale_ids = [token_id for token_id in token_ids if now - token_price_cache.get(token_id, (0.0, 0.0))[1] > TOKEN_PRICE_TTL]
 
-    # Check if there are any missing token IDs and attempt to fetch their prices
-    if missing_ids:
-        missing_prices = fetch_balancer_v1_token_prices(missing_ids)
-        token_prices.update(missing_prices)
+    async def fetch_batch(batch: list):
+        query = token_prices_document(len(batch))
+        variables = {f'ids{i}': chunk for i, chunk in enumerate(batch)}
 
-    # If any token_ids are still missing, set their price to 0
-    for token_id in token_ids:
-        if token_id not in token_prices:
-            token_prices[token_id] = 0.0
+        async def fetch_prices():
+            data = await post_query(BALANCER_V1_ENDPOINT, query, variables)
+            return [price for i in range(len(batch)) for price in data[f'prices{i}']]
+        return await call_with_retry(BALANCER_V1, fetch_prices)
 
-    return token_prices
+    for prices in await asyncio.gather(*(fetch_batch(batch) for batch in batches(batches(stale_ids, chunk_size)))):
+        for price in prices:
+            token_price_cache[price['id']] = (to_float(price['price'], 0.0), now)
+    # tokens the subgraph has no price for are cached at 0 too, so they aren't asked for again every refresh
+    for token_id in stale_ids:
+        if token_price_cache.get(token_id, (0.0, 0.0))[1] != now:
+            token_price_cache[token_id] = (0.0, now)
 
+    return {token_id: token_price_cache[token_id][0] for token_id in token_ids}
 
-def reformat_balancer_v1_pools(pool_list):
+
+async def reformat_balancer_v1_pools(pool_list):
     balancer_pool_tokens = set()
     for pool in pool_list:
         for token in pool['tokens']:
             balancer_pool_tokens.add(token['address'])
-    
-    token_prices = fetch_balancer_v1_token_prices(list(balancer_pool_tokens))
 
-    all_reformatted_pools = []
-    for pool in pool_list:
-        reformatted_pools = reformat_balancer_v1_pool(pool, token_prices)
-        all_reformatted_pools.extend(reformatted_pools)
-    return all_reformatted_pools
+    token_prices = await fetch_balancer_v1_token_prices(list(balancer_pool_tokens))
+
+    return [reformat_balancer_v1_pool(pool, token_prices) for pool in pool_list]
 
 
 def reformat_balancer_v1_pool(pool, token_prices):
-    token_combinations = list(combinations(pool['tokens'], 2))
-    reformatted_pools = []
-
-    for combination in token_combinations:
-        token0 = combination[0]
-        token1 = combination[1]
-
-        new_pair = {
-            'id': pool['id'],
-            'liquidity': pool['liquidity'],
-            'swapFee': pool['swapFee'],
-            'reserve0': token0['balance'],
-            'reserve1': token1['balance'],
-            'token0': {
-                'id': token0['address'],
-                'symbol': token0['symbol'],
-                'denormWeight': token0['denormWeight'],
-            },
-            'token1': {
-                'id': token1['address'],
-                'symbol': token1['symbol'],
-                'denormWeight': token1['denormWeight']
-            },
-            'protocol': 'Balancer_V1',
-        }
+    ''' Reformats a Balancer V1 pool into a multi-asset pool, its pairs are derived when they are ingested. '''
+    tokens = pool['tokens']
+    prices = tuple(token_prices.get(token['address'], 0.0) for token in tokens)
+
+    return MultiAssetPool(
+        pool['id'],
+        BALANCER_V1,
+        tokens=tuple(TOKENS.intern(token['address'], token['symbol']) for token in tokens),
+        balances=tuple(to_float(token['balance'], 0.0) for token in tokens),
+        prices=prices,
+        bad_tokens=tuple(token['symbol'] in BAD_TOKEN_SYMS for token in tokens),
+        weights=tuple(to_float(token['denormWeight']) for token in tokens),
+        fee=to_float(pool['swapFee']),
+        metric=to_float(pool['liquidity'], 0.0)
+    )
 
-        try:
-            new_pair['reserveUSD'] = float(new_pair['reserve0']) * token_prices[new_pair['token0']['id']] + float(new_pair['reserve1']) * token_prices[new_pair['token1']['id']]
-            new_pair['token0']['priceUSD'] = token_prices[new_pair['token0']['id']]
-            new_pair['token1']['priceUSD'] = token_prices[new_pair['token1']['id']]
-        except KeyError as e:
-            missing_id = str(e)
-            missing_prices = fetch_balancer_v1_token_prices([], [missing_id])
-            token_prices.update(missing_prices)
-            new_pair['reserveUSD'] = float(new_pair['reserve0']) * token_prices[new_pair['token0']['id']] + float(new_pair['reserve1']) * token_prices[new_pair['token1']['id']]
-
-        new_pair['dangerous'] = (
-            new_pair['token0']['symbol'] in BAD_TOKEN_SYMS or
-            new_pair['token1']['symbol'] in BAD_TOKEN_SYMS or
-            new_pair['reserve0'] == 0 or
-            new_pair['reserve1'] == 0
-        )
 
-        reformatted_pools.append(new_pair)
+def reformat_balancer_v2_pools(pool_list):
+    ''' Reformats a list of Balancer V2 pools into multi-asset pools, their pairs are derived when they are ingested. '''
 
-    return reformatted_pools
+    def token_price(token):
+        # fall back to the token's USD balance over its pool balance when the subgraph has no price
+        if token['token']['latestUSDPrice'] is not None:
+            return to_float(token['token']['latestUSDPrice'], 0.0)
+        try:
+            return float(token['token']['totalBalanceUSD']) / float(token['balance'])
+        except ZeroDivisionError:
+            return 0.0
 
+    def reformat_balancer_v2_pool(pool):
+        tokens = pool['tokens']
+        return MultiAssetPool(
+            pool['address'],
+            BALANCER_V2,
+            tokens=tuple(TOKENS.intern(token['address'], token['symbol']) for token in tokens),
+            balances=tuple(to_float(token['balance'], 0.0) for token in tokens),
+            prices=tuple(token_price(token) for token in tokens),
+            bad_tokens=tuple(token['symbol'] in BAD_TOKEN_SYMS for token in tokens),
+            weights=tuple(to_float(token['weight']) for token in tokens),
+            fee=to_float(pool['swapFee']),
+            metric=to_float(pool['totalLiquidity'], 0.0)
+        )
 
-def balancer_v2_query(X: int, skip: int, max_metric: float = None):
-    max_metric_filter = f', where: {{totalLiquidity_lt: {max_metric}}}' if max_metric else ''
+    return [reformat_balancer_v2_pool(pool) for pool in pool_list]
 
-    return f"""
-    {{
-      pools(first: {X}, orderBy: totalLiquidity, orderDirection: desc, skip: {skip}{max_metric_filter}) {{
-        address
-        swapFee
-        tokensList
-        totalLiquidity
-        tokens {{
-          address
-          balance
-          symbol
-          weight
-          token {{
-            totalBalanceUSD
-            latestUSDPrice
-          }}
-        }}
-      }}
-    }}
-    """
 
+async def collect_curve_pools(if_modified: bool = False) -> list:
+    ''' Returns the raw pools of the Curve API, or None with if_modified when the API reports nothing changed since the last call. '''
+    print('collecting data from curve...')
 
-def reformat_balancer_v2_pools(pool_list):
-    ''' Reformats a list of Balancer V2 pools into the uniswap/sushiswap format. '''
+    async def fetch_pools():
+        response = await transport.request('GET', CURVE_ENDPOINT)
+        if response.status == 429 or response.status >= 500:
+            raise RetryableError(f'{CURVE_ENDPOINT} returned {response.status}')
+        if if_modified and response.not_modified:
+            return None
+        return response.json()['data']['poolData']
 
-    def reformat_balancer_v2_pool(pool):
-        token_combinations = list(combinations(pool['tokens'], 2))
-        reformatted_pools = []
-
-        for combination in token_combinations:
-            token0 = combination[0]
-            token1 = combination[1]
-            new_pair = {
-                'id': pool['address'],
-                'totalLiquidity': pool['totalLiquidity'],
-                'swapFee': pool['swapFee'],
-                'reserve0': token0['balance'],
-                'reserve1': token1['balance'],
-                'token0': {
-                    'id': token0['address'],
-                    'symbol': token0['symbol'],
-                    'weight': token0['weight'],
-                    'totalBalanceUSD': token0['token']['totalBalanceUSD'],
-                    'priceUSD': token0['token']['latestUSDPrice'],
-                },
-                'token1': {
-                    'id': token1['address'],
-                    'symbol': token1['symbol'],
-                    'weight': token1['weight'],
-                    'totalBalanceUSD': token1['token']['totalBalanceUSD'],
-                    'priceUSD': token1['token']['latestUSDPrice'],
-                },
-                # 'reserveUSD': float(token0['token']['totalBalanceUSD']) + float(token1['token']['totalBalanceUSD']),
-                'protocol': 'Balancer_V2',
-            }
-            reformatted_pools.append(new_pair)
-            new_pair['dangerous'] = new_pair['token0']['symbol'] in BAD_TOKEN_SYMS or new_pair['token1']['symbol'] in BAD_TOKEN_SYMS
-            # check if priceUSD is None and calculate it if it is
-            if new_pair['token0']['priceUSD'] is None:
-                try:
-                    new_pair['token0']['priceUSD'] = float(new_pair['token0']['totalBalanceUSD']) / float(new_pair['reserve0'])
-                except ZeroDivisionError:
-                    new_pair['token0']['priceUSD'] = 0
-            if new_pair['token1']['priceUSD'] is None:
-                try:
-                    new_pair['token1']['priceUSD'] = float(new_pair['token1']['totalBalanceUSD']) / float(new_pair['reserve1'])
-                except ZeroDivisionError:
-                    new_pair['token1']['priceUSD'] = 0
-            # calculate reserveUSD
-            '''
-            use this logic:
-            totalLiquidity = 6809675
-            reserve0 = 2596148429267441
-            reserve1 = 1511
-            totalReserve = reserve0 + reserve1
-
-            proportion0 = reserve0 / totalReserve
-            proportion1 = reserve1 / totalReserve
-
-            priceUSD0 = 1863
-            priceUSD1 = 1766
-
-
-            reserveUSD = totalLiquidity * priceUSD0 * proportion0 + totalLiquidity * priceUSD1 * proportion1
-            '''
-            try:
-                reserveUSD = float(new_pair['totalLiquidity']) * float(new_pair['token0']['priceUSD']) * (float(new_pair['reserve0']) / (float(new_pair['reserve0']) + float(new_pair['reserve1']))) + float(new_pair['totalLiquidity']) * float(new_pair['token1']['priceUSD']) * (float(new_pair['reserve1']) / (float(new_pair['reserve0']) + float(new_pair['reserve1'])))
-                new_pair['reserveUSD'] = reserveUSD
-            except ZeroDivisionError:
-                new_pair['reserveUSD'] = 0
-
-        return reformatted_pools
-
-    all_reformatted_pools = []
-    for pool in pool_list:
-        reformatted_pools = reformat_balancer_v2_pool(pool)
-        all_reformatted_pools.extend(reformatted_pools)
-    
-    return all_reformatted_pools
+    return await call_with_retry(CURVE, fetch_pools)
 
 
-async def collect_curve_pools():
-    print('collecting data from curve...')
+def reformat_curve_pools(data: list) -> list:
+    ''' Reformats the pools returned by the Curve API into multi-asset pools, their pairs are derived when they are ingested. '''
     res = []
-    async with aiohttp.ClientSession() as session:
-        async with session.get(CURVE_ENDPOINT) as response:
-            obj = await response.json()
-            data = obj['data']['poolData']
-            #print(json.dumps(data, indent=4))
-            for pool in data:
-                try:
-                    pairs = combinations(pool['coins'], 2)
-                    for pair in pairs:
-                        # Check if either usdPrice is None and skip this pair if true
-                        if pair[0]['usdPrice'] is None or pair[1]['usdPrice'] is None:
-                            continue
-                        # print(f"pool: {pool.get('name', 'NONE')}, pair: {pair[0]['symbol']}-{pair[1]['symbol']}")
-
-                        decimals0 = int(pair[0]['decimals'])
-                        decimals1 = int(pair[1]['decimals'])
-
-                        new_pair = {}
-                        new_pair['id'] = pool['address'].lower()
-                        new_pair['reserve0'] = int(pair[0]['poolBalance']) / 10**decimals0
-                        new_pair['reserve1'] = int(pair[1]['poolBalance']) / 10**decimals1
-                        new_pair['token0'] = {
-                            'id': pair[0]['address'].lower(),
-                            'symbol': pair[0]['symbol'],
-                            'decimals': decimals0,
-                            'priceUSD': pair[0]['usdPrice']
-                        }
-                        new_pair['token1'] = {
-                            'id': pair[1]['address'].lower(),
-                            'symbol': pair[1]['symbol'],
-                            'decimals': decimals1,
-                            'priceUSD': pair[1]['usdPrice']
-                        }
-                        new_pair['token0Price'] = pair[1]['usdPrice'] / pair[0]['usdPrice']
-                        new_pair['token1Price'] = pair[0]['usdPrice'] / pair[1]['usdPrice']
-                        new_pair['reserveUSD'] = new_pair['reserve0'] * pair[0]['usdPrice'] + new_pair['reserve1'] * pair[1]['usdPrice']
-                        new_pair['protocol'] = CURVE
-                        new_pair['dangerous'] = new_pair['token0']['symbol'] in BAD_TOKEN_SYMS or new_pair['token1']['symbol'] in BAD_TOKEN_SYMS
-                        res.append(new_pair)
-                except Exception as e:
-                    print(e)
-                    # print(pool)
-                    break
+    #print(json.dumps(data, indent=4))
+    for pool in data:
+        try:
+            coins = pool['coins']
+            decimals = [int(coin['decimals']) for coin in coins]
+            res.append(MultiAssetPool(
+                pool['address'].lower(),
+                CURVE,
+                tokens=tuple(TOKENS.intern(coin['address'].lower(), coin['symbol'], coin_decimals) for coin, coin_decimals in zip(coins, decimals)),
+                balances=tuple(int(coin['poolBalance']) / 10**coin_decimals for coin, coin_decimals in zip(coins, decimals)),
+                # pairs with an unpriced coin are skipped when the pool is expanded
+                prices=tuple(coin['usdPrice'] for coin in coins),
+                bad_tokens=tuple(coin['symbol'] in BAD_TOKEN_SYMS for coin in coins)
+            ))
+        except Exception as e:
+            print(e)
+            # print(pool)
+            break
     return res
 
 
-async def get_latest_pool_data(protocol: str, X: int = 1000, skip: int = 0, max_metric: float = None) -> dict:
-    # check which endpoint to use, the schema for Uniswap V2 and Sushiswap V2 only differs by the liquidity and reserve metrics
+def process_pool(protocol: str, pool: dict) -> dict:
+    ''' Derives the USD prices, reserves and dangerous flag of a raw subgraph pool, in the uniswap/sushiswap dict format. '''
+    pool['protocol'] = protocol
+    if protocol == SUSHISWAP_V2:
+        try:
+            pool['token0']['priceUSD'] = float(pool['liquidityUSD']) / float(pool['reserve0'])
+            pool['token1']['priceUSD'] = float(pool['liquidityUSD']) / float(pool['reserve1'])
+        except:
+            pool['token0']['priceUSD'] = 0
+            pool['token1']['priceUSD'] = 0
+    if protocol == PANCAKESWAP_V3:
+        pool['reserve0'] = pool.pop('totalValueLockedToken0')
+        pool['reserve1'] = pool.pop('totalValueLockedToken1')
+        try:
+            pool['token0']['priceUSD'] = float(pool['totalValueLockedUSD']) / float(pool['reserve0'])
+            pool['token1']['priceUSD'] = float(pool['totalValueLockedUSD']) / float(pool['reserve1'])
+        except:
+            pool['token0']['priceUSD'] = 0
+            pool['token1']['priceUSD'] = 0
     if protocol == UNISWAP_V2:
-        endpoint = UNISWAPV2_ENDPOINT
-        orderBy = 'reserveUSD'
-        print('collecting data from Uniswap V2...')
-        data_field = 'pairs'
-    elif protocol == SUSHISWAP_V2:
-        endpoint = SUSHISWAPV2_ENDPOINT
-        orderBy = 'liquidityUSD'
-        print('collecting data from Sushiswap V2...')
-        data_field = 'pairs'
-    elif protocol == UNISWAP_V3:
-        endpoint = UNISWAPV3_ENDPOINT
-        print('collecting data from Uniswap V3...')
-        data_field = 'pools'
-    elif protocol == BALANCER_V1:
-        endpoint = BALANCER_V1_ENDPOINT
-        print('collecting data from Balancer V1...')
-        data_field = 'pools'
-    elif protocol == BALANCER_V2:
-        endpoint = BALANCER_V2_ENDPOINT
-        print('collecting data from Balancer V2...')
-        data_field = 'pools'
-    elif protocol == DODO:
-        endpoint = DODO_ENDPOINT
-        print('collecting data from DODO...')
-        data_field = 'pairs'
-    elif protocol == PANCAKESWAP_V3:
-        endpoint = PANCAKESWAP_V3_ENDPOINT
-        print('collecting data from Pancakeswap V3...')
-        data_field = 'pools'
-    while True:
         try:
-            if protocol == UNISWAP_V3:
-                query = uniswap_v3_query(X, skip, max_metric)
-            elif protocol == BALANCER_V1:
-                query = balancer_v1_query(X, skip, max_metric)
-            elif protocol == BALANCER_V2:
-                query = balancer_v2_query(X, skip, max_metric)
-            elif protocol == DODO:
-                query = dodo_query(X, skip, max_metric)
-            elif protocol == PANCAKESWAP_V3:
-                query = pancakeswap_v3_query(X, skip, max_metric)
-            else:
-                if not max_metric:
-                    query = f"""
-                    {{
-                    pairs(first: {X}, orderBy: {orderBy}, orderDirection: desc, skip: {skip}) {{
-                        id
-                        {orderBy}
-                        reserve0
-                        reserve1
-                        token0Price
-                        token1Price
-                        token0 {{
-                            id
-                            symbol
-                            decimals
-                        }}
-                        token1 {{
-                            id
-                            symbol
-                            decimals
-                        }}
-                        }}
-                    }}
-                    """
-                else:
-                    query = f"""
-                    {{
-                    pairs(first: {X}, orderBy: {orderBy}, orderDirection: desc, skip: {skip}, where: {{{orderBy}_lt: {max_metric}}}) {{
-                        id
-                        {orderBy}
-                        reserve0
-                        reserve1
-                        token0Price
-                        token1Price
-                        token0 {{
-                            id
-                            symbol
-                            decimals
-                        }}
-                        token1 {{
-                            id
-                            symbol
-                            decimals
-                        }}
-                        }}
-                    }}
-                    """
-            async with aiohttp.ClientSession() as session:
-                async with session.post(endpoint, json={'query': query}) as response:
-                    obj = await response.json()
-                    pools = obj['data'][data_field]
-                    # pool processing
-                    for pool in pools:
-                        pool['protocol'] = protocol
-                        if protocol == SUSHISWAP_V2:
-                            try:
-                                pool['token0']['priceUSD'] = float(pool['liquidityUSD']) / float(pool['reserve0'])
-                                pool['token1']['priceUSD'] = float(pool['liquidityUSD']) / float(pool['reserve1'])
-                            except:
-                                pool['token0']['priceUSD'] = 0
-                                pool['token1']['priceUSD'] = 0
-                        if protocol == PANCAKESWAP_V3:
-                            pool['reserve0'] = pool.pop('totalValueLockedToken0')
-                            pool['reserve1'] = pool.pop('totalValueLockedToken1')
-                            try:
-                                pool['token0']['priceUSD'] = float(pool['totalValueLockedUSD']) / float(pool['reserve0'])
-                                pool['token1']['priceUSD'] = float(pool['totalValueLockedUSD']) / float(pool['reserve1'])
-                            except:
-                                pool['token0']['priceUSD'] = 0
-                                pool['token1']['priceUSD'] = 0
-                        if protocol == UNISWAP_V2:
-                            try:
-                                pool['token0']['priceUSD'] = float(pool['reserveUSD']) / float(pool['reserve0'])
-                                pool['token1']['priceUSD'] = float(pool['reserveUSD']) / float(pool['reserve1'])
-                            except:
-                                pool['token0']['priceUSD'] = 0
-                                pool['token1']['priceUSD'] = 0
-                        if protocol == UNISWAP_V3:
-                            if pool['sqrtPrice'] == '0':
-                                pool['reserve0'] = 0
-                                pool['reserve1'] = 0
-                                continue
-                            sqrtPrice = float(pool['sqrtPrice']) / (2 ** 96)
-                            liquidity = int(pool['liquidity'])
-                            reserve0raw = liquidity / sqrtPrice
-                            reserve1raw = liquidity * sqrtPrice
-                            reserve0 = reserve0raw / (10 ** int(pool['token0']['decimals']))
-                            reserve1 = reserve1raw / (10 ** int(pool['token1']['decimals']))
-                            pool['reserve0'] = reserve0
-                            pool['reserve1'] = reserve1
-                            try:
-                                # Calculate the total value in terms of token0
-                                total_value_token0 = float(pool['totalValueLockedToken0']) + float(pool['token1Price']) * float(pool['totalValueLockedToken1'])
-                                # Calculate the total value in terms of token1
-                                total_value_token1 = float(pool['totalValueLockedToken1']) + 1/float(pool['token0Price']) * float(pool['totalValueLockedToken0'])
-                                # Calculate the price of each token
-                                pool['token0']['priceUSD'] = float(pool['totalValueLockedUSD']) / total_value_token0
-                                pool['token1']['priceUSD'] = float(pool['totalValueLockedUSD']) / total_value_token1
-                            except Exception as e:
-                                print(e)
-                                print(pool)
-                                pool['token0']['priceUSD'] = 0
-                                pool['token1']['priceUSD'] = 0
-                        if protocol == DODO:
-                            # volumeUSD doesn't seem to be accurate for DODO, augment a reserveUSD metric for sorting
-                            pool['reserveUSD'] = float(pool['quoteReserve']) * float(pool['quoteToken']['usdPrice']) + float(pool['baseReserve']) * float(pool['baseToken']['usdPrice'])
-                            # rename fields to match other protocols, base = 0 and quote = 1
-                            pool['token0'] = pool.pop('baseToken')
-                            pool['token1'] = pool.pop('quoteToken')
-                            pool['reserve0'] = pool.pop('baseReserve')
-                            pool['reserve1'] = pool.pop('quoteReserve')
-                            pool['token0Price'] = float(pool['lastTradePrice'])
-                            pool['token0']['priceUSD'] = pool['token0'].pop('usdPrice')
-                            pool['token1']['priceUSD'] = pool['token1'].pop('usdPrice')
-                            try:
-                                pool['token1Price'] = 1 / float(pool['lastTradePrice'])
-                            except:
-                                pool['token1Price'] = 0
-                        pool['dangerous'] = (
-                            (protocol not in (BALANCER_V1, BALANCER_V2) and (
-                                pool['token0']['symbol'] in BAD_TOKEN_SYMS or
-                                pool['token1']['symbol'] in BAD_TOKEN_SYMS or
-                                pool['reserve0'] == 0 or
-                                pool['reserve1'] == 0
-                            )) or
-                            (protocol == BALANCER_V1 and any(
-                                token['symbol'] in BAD_TOKEN_SYMS for token in pool['tokens']
-                            )) or
-                            (protocol == BALANCER_V2 and any(
-                                token['symbol'] in BAD_TOKEN_SYMS for token in pool['tokens']
-                            ))
-                        )
-
-                    return pools
-        # this sometimes fails but works on the next try, retry until it works
-        except KeyError as e:
-            logging.error("Key error while fetching pools, retrying...")
-            continue
-        except asyncio.exceptions.TimeoutError as e:
-            logging.error("Timeout error while fetching pools, retrying...")
-            # print(protocol)
-            continue
+            pool['token0']['priceUSD'] = float(pool['reserveUSD']) / float(pool['reserve0'])
+            pool['token1']['priceUSD'] = float(pool['reserveUSD']) / float(pool['reserve1'])
+        except:
+            pool['token0']['priceUSD'] = 0
+            pool['token1']['priceUSD'] = 0
+    if protocol == UNISWAP_V3:
+        if pool['sqrtPrice'] == '0':
+            pool['reserve0'] = 0
+            pool['reserve1'] = 0
+            return pool
+        sqrtPrice = float(pool['sqrtPrice']) / (2 ** 96)
+        liquidity = int(pool['liquidity'])
+        reserve0raw = liquidity / sqrtPrice
+        reserve1raw = liquidity * sqrtPrice
+        reserve0 = reserve0raw / (10 ** int(pool['token0']['decimals']))
+        reserve1 = reserve1raw / (10 ** int(pool['token1']['decimals']))
+        pool['reserve0'] = reserve0
+        pool['reserve1'] = reserve1
+        try:
+            # Calculate the total value in terms of token0
+            total_value_token0 = float(pool['totalValueLockedToken0']) + float(pool['token1Price']) * float(pool['totalValueLockedToken1'])
+            # Calculate the total value in terms of token1
+            total_value_token1 = float(pool['totalValueLockedToken1']) + 1/float(pool['token0Price']) * float(pool['totalValueLockedToken0'])
+            # Calculate the price of each token
+            pool['token0']['priceUSD'] = float(pool['totalValueLockedUSD']) / total_value_token0
+            pool['token1']['priceUSD'] = float(pool['totalValueLockedUSD']) / total_value_token1
         except Exception as e:
-            logging.error("Error while fetching pools, retrying...")
-            #print(protocol)
-            logging.error(e)
-            continue
-        
\ No newline at end of file
+            print(e)
+            print(pool)
+            pool['token0']['priceUSD'] = 0
+            pool['token1']['priceUSD'] = 0
+    if protocol == DODO:
+        # volumeUSD doesn't seem to be accurate for DODO, augment a reserveUSD metric for sorting
+        pool['reserveUSD'] = float(pool['quoteReserve']) * float(pool['quoteToken']['usdPrice']) + float(pool['baseReserve']) * float(pool['baseToken']['usdPrice'])
+        # rename fields to match other protocols, base = 0 and quote = 1
+        pool['token0'] = pool.pop('baseToken')
+        pool['token1'] = pool.pop('quoteToken')
+        pool['reserve0'] = pool.pop('baseReserve')
+        pool['reserve1'] = pool.pop('quoteReserve')
+        pool['token0Price'] = float(pool['lastTradePrice'])
+        pool['token0']['priceUSD'] = pool['token0'].pop('usdPrice')
+        pool['token1']['priceUSD'] = pool['token1'].pop('usdPrice')
+        try:
+            pool['token1Price'] = 1 / float(pool['lastTradePrice'])
+        except:
+            pool['token1Price'] = 0
+    pool['dangerous'] = (
+        (protocol not in (BALANCER_V1, BALANCER_V2) and (
+            pool['token0']['symbol'] in BAD_TOKEN_SYMS or
+            pool['token1']['symbol'] in BAD_TOKEN_SYMS or
+            pool['reserve0'] == 0 or
+            pool['reserve1'] == 0
+        )) or
+        (protocol == BALANCER_V1 and any(
+            token['symbol'] in BAD_TOKEN_SYMS for token in pool['tokens']
+        )) or
+        (protocol == BALANCER_V2 and any(
+            token['symbol'] in BAD_TOKEN_SYMS for token in pool['tokens']
+        ))
+    )
+    return pool
+
+
+async def post_query(endpoint: str, query: str, variables: dict = None) -> dict:
+    ''' Posts a GraphQL query to a subgraph and returns its data, rate limits, server and GraphQL errors raise a RetryableError. '''
+    async with endpoint_semaphore(endpoint):
+        response = await transport.request('POST', endpoint, {'query': query, 'variables': variables or {}})
+    if response.status == 429 or response.status >= 500:
+        retry_after = response.headers.get('Retry-After')
+        raise RetryableError(f'{endpoint} returned {response.status}',
+                             retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+    obj = response.json()
+    if obj.get('errors') or not obj.get('data'):
+        raise RetryableError(f'{endpoint} returned errors: {obj.get("errors")}')
+    return obj['data']
+
+
+async def fetch_pool_pages(protocol: str, pages: list) -> list:
+    ''' Fetches several pages of a protocol's pools in one aliased request, each page is a (first, where) pair. '''
+    query = pools_document(protocol, len(pages))
+    variables = {}
+    for i, (first, where) in enumerate(pages):
+        variables[f'first{i}'] = first
+        variables[f'where{i}'] = where
+
+    async def fetch_pages():
+        data = await post_query(SUBGRAPH_ENDPOINTS[protocol], query, variables)
+        return [data[f'page{i}'] for i in range(len(pages))]
+
+    print(f'collecting data from {protocol}...')
+    # retried with backoff, raises once the retries run out or while the protocol's circuit is open
+    results = await call_with_retry(protocol, fetch_pages)
+    for page in results:
+        for pool in page:
+            pool['protocol'] = protocol
+    return results
+
+
+def batches(items: list, size: int = BATCH_PAGES) -> list:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def get_latest_pool_data(protocol: str, X: int = 1000, max_metric: float = None, id_band: tuple = None, changed_since: int = None, ids: list = None, tied_ids: list = None) -> list:
+    pages = await fetch_pool_pages(protocol, [(X, pool_filter(protocol, max_metric, id_band, changed_since, ids, tied_ids))])
+    return pages[0]
+
+
+def id_bands(count: int) -> list:
+    ''' Splits the hex id space into contiguous [id_gte, id_lt) bands, ids are lowercase 0x prefixed hex strings. '''
+    digits = 1 if count <= 16 else 2
+    bounds = sorted({f'0x{(16 ** digits) * i // count:0{digits}x}' for i in range(1, count)})
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+async def collect_pools(protocol: str, max_pools: int = 6000, page_size: int = 1000, bands: int = PAGINATION_BANDS, on_page=None) -> list:
+    '''
+    Collects the top max_pools pools of a subgraph protocol, ordered by its metric from highest to lowest.
+    The id space is split into bands that are paged concurrently, BATCH_PAGES to a request, with a metric cursor, a band only
+    fetches its next page while its last pool still ranks within the current top max_pools.
+    on_page is called with every page as soon as it arrives, so it can be processed while the rest load.
+    '''
+    metric_field = DEX_METRIC_MAP[protocol]
+    # read the indexed block first, so changes made while the pages load are picked up by the next delta sync
+    block = await fetch_indexed_block(protocol)
+    # ids are spread evenly over the bands, so twice a band's share of the pools is usually a single page
+    page_size = min(page_size, -(-2 * max_pools // bands))
+    band_ranges = id_bands(bands)
+    band_pools = [[] for _ in band_ranges]
+    # the cursor of every band still being paged, see page_cursor, None until its first page
+    cursors = {band: None for band in range(len(band_ranges))}
+
+    def band_filter(band: int) -> dict:
+        max_metric, tied_ids = cursors[band] or (None, None)
+        return pool_filter(protocol, max_metric, band_ranges[band], tied_ids=tied_ids)
+
+    async def fetch_batch(batch: list):
+        pages = await fetch_pool_pages(protocol, [(page_size, band_filter(band)) for band in batch])
+        for band, page in zip(batch, pages):
+            band_pools[band].extend(page)
+            if on_page is not None:
+                on_page(page)
+        return zip(batch, pages)
+
+    collected = []
+    while cursors:
+        # the bands still being paged are merged into a few aliased requests, which are sent concurrently
+        pages = [result for results in await asyncio.gather(*(fetch_batch(batch) for batch in batches(list(cursors)))) for result in results]
+        collected = sorted((pool for pools in band_pools for pool in pools), key=lambda pool: float(pool[metric_field]), reverse=True)
+        # the metric a pool has to beat to make the cut, nothing is cut until enough pools are collected
+        cutoff = float(collected[max_pools - 1][metric_field]) if len(collected) >= max_pools else None
+        cursors = {}
+        for band, page in pages:
+            if len(page) < page_size:
+                continue
+            last_metric = float(page[-1][metric_field])
+            if last_metric > 0 and (cutoff is None or last_metric > cutoff):
+                cursors[band] = page_cursor(protocol, band_pools[band])
+        logging.info(f'{protocol} pools collected: {len(collected)}, bands left: {len(cursors)}')
+
+    indexed_blocks[protocol] = block
+    return collected[:max_pools]
+
+
+# the block each subgraph had indexed when its pools were last collected, delta syncs ask for changes from there
+indexed_blocks = {}
+
+
+async def fetch_indexed_block(protocol: str) -> int:
+    ''' Returns the latest block the protocol's subgraph has indexed. '''
+
+    async def fetch_meta():
+        data = await post_query(SUBGRAPH_ENDPOINTS[protocol], '{ _meta { block { number } } }')
+        return int(data['_meta']['block']['number'])
+
+    return await call_with_retry(protocol, fetch_meta)
+
+
+async def collect_pool_changes(protocol: str, max_pools: int = 6000, page_size: int = 1000, on_page=None) -> list:
+    '''
+    Collects the pools of a subgraph protocol that changed since its last collection, ordered by its metric from highest to lowest.
+    The protocol has to have been collected in full first, see indexed_blocks. on_page works as in collect_pools.
+    At most max_pools changes are collected, past that a full sweep is cheaper, so the protocol's indexed block is dropped
+    and its next sync is a full one.
+    '''
+    metric_field = DEX_METRIC_MAP[protocol]
+    since = indexed_blocks[protocol]
+    block = await fetch_indexed_block(protocol)
+    changed = []
+    cursor, tied_ids = None, None
+    while True:
+        page = await get_latest_pool_data(protocol=protocol, X=min(page_size, max_pools - len(changed)), max_metric=cursor, changed_since=since, tied_ids=tied_ids)
+        changed.extend(page)
+        if on_page is not None:
+            on_page(page)
+        if len(changed) >= max_pools:
+            # the highest ranked changes are still applied, the rest are picked up by the full sweep
+            del indexed_blocks[protocol]
+            logging.warning(f'{protocol} pools changed since block {since} exceed {max_pools}, next sync is a full sweep')
+            return changed
+        if len(page) < page_size:
+            break
+        if float(page[-1][metric_field]) <= 0:
+            break
+        cursor, tied_ids = page_cursor(protocol, changed)
+    indexed_blocks[protocol] = block
+    logging.info(f'{protocol} pools changed since block {since}: {len(changed)}')
+    return changed
+
+
+async def collect_pools_by_id(protocol: str, pool_ids: list, chunk_size: int = 100, on_page=None) -> list:
+    ''' Collects the given pools of a subgraph protocol, in chunks merged into concurrent aliased requests. on_page works as in collect_pools. '''
+
+    async def fetch_batch(batch: list):
+        pages = await fetch_pool_pages(protocol, [(len(chunk), pool_filter(protocol, ids=chunk)) for chunk in batch])
+        if on_page is not None:
+            for page in pages:
+                on_page(page)
+        return pages
+
+    chunks = batches(pool_ids, chunk_size)
+    return [pool for pages in await asyncio.gather(*(fetch_batch(batch) for batch in batches(chunks))) for page in pages for pool in page]
+
+
+def requests_for_pages(pages: int) -> int:
+    ''' Returns how many requests a number of pages takes once they are batched. '''
+    return -(-pages // BATCH_PAGES)
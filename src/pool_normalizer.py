@@ -0,0 +1,138 @@
+'''
+This module turns raw collector pages into pool stores, parsing them in worker processes while the loop keeps fetching.
+'''
+
+# local imports
+from constants import CURVE, BALANCER_V1, BALANCER_V2, DEX_METRIC_MAP
+from pool_collector import (collect_pools, collect_pool_changes, collect_pools_by_id, collect_curve_pools, fetch_balancer_v1_token_prices,
+                            process_pool, reformat_balancer_v1_pool, reformat_balancer_v2_pools, reformat_curve_pools)
+from pool_records import PairRecord, expand_pairs
+from pool_store import PoolStore, localize_tokens, intern_tokens
+# standard library imports
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+# third party imports
+import numpy as np
+
+# worker processes used for parsing, 0 parses on the event loop instead
+NORMALIZE_WORKERS = int(os.getenv("ETAX_NORMALIZE_WORKERS", default=os.cpu_count() or 1))
+# pools handed to a worker at once, big payloads like the Curve API response are split up
+NORMALIZE_CHUNK = int(os.getenv("ETAX_NORMALIZE_CHUNK", default=250))
+
+_executor = None
+# curve pool address -> digest of the API entry its pairs were last derived from
+curve_pool_hashes = {}
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None and NORMALIZE_WORKERS > 0:
+        _executor = ProcessPoolExecutor(max_workers=NORMALIZE_WORKERS)
+    return _executor
+
+
+def normalize_page(protocol: str, pools: list, token_prices: dict = None) -> tuple:
+    '''
+    Parses raw pools of a protocol into pair records and returns them as compact columns, see localize_tokens.
+    Runs in a worker process, so it only takes and returns plain data.
+    '''
+    if protocol == CURVE:
+        records = expand_pairs(reformat_curve_pools(pools))
+    elif protocol == BALANCER_V1:
+        records = expand_pairs(reformat_balancer_v1_pool(pool, token_prices) for pool in pools)
+    elif protocol == BALANCER_V2:
+        records = expand_pairs(reformat_balancer_v2_pools(pools))
+    else:
+        records = (PairRecord.from_dict(process_pool(protocol, pool)) for pool in pools)
+    return localize_tokens(PoolStore.from_records(records))
+
+
+async def normalize_pools(protocol: str, pools: list) -> PoolStore:
+    ''' Parses raw pools into a store, split into chunks that are parsed concurrently by the worker processes. '''
+    if not pools:
+        return PoolStore()
+    token_prices = None
+    if protocol == BALANCER_V1:
+        # prices come from the network, fetch them here so the workers only compute, the ids are sorted so the batches
+        # and their recording keys don't depend on set order
+        token_prices = await fetch_balancer_v1_token_prices(sorted({token['address'] for pool in pools for token in pool['tokens']}))
+
+    executor = get_executor()
+    chunks = [pools[i:i + NORMALIZE_CHUNK] for i in range(0, len(pools), NORMALIZE_CHUNK)]
+    if executor is None:
+        pages = [normalize_page(protocol, chunk, token_prices) for chunk in chunks]
+    else:
+        loop = asyncio.get_running_loop()
+        pages = await asyncio.gather(*(loop.run_in_executor(executor, normalize_page, protocol, chunk, token_prices) for chunk in chunks))
+    # token indices from the workers are local to each page, intern them into this process's table
+    return PoolStore.concat([PoolStore(intern_tokens(columns, tokens)) for columns, tokens in pages])
+
+
+def pool_digest(pool: dict) -> bytes:
+    return hashlib.blake2b(json.dumps(pool, sort_keys=True).encode(), digest_size=16).digest()
+
+
+async def collect_curve_store(current: PoolStore = None) -> PoolStore:
+    '''
+    Collects the Curve pools into a store, only re-deriving the pairs of pools whose API entry changed since the last collection.
+    Returns current itself when nothing changed.
+    '''
+    # the hashes only describe current, without it every pool is derived again
+    incremental = current is not None and len(current) > 0 and bool(curve_pool_hashes)
+    pools = await collect_curve_pools(if_modified=incremental)
+    if pools is None:
+        return current
+
+    digests = {pool['address'].lower(): pool_digest(pool) for pool in pools}
+    if not incremental:
+        store = await normalize_pools(CURVE, pools)
+    else:
+        changed = [pool for pool in pools if curve_pool_hashes.get(pool['address'].lower()) != digests[pool['address'].lower()]]
+        stale = {pool['address'].lower() for pool in changed} | (set(curve_pool_hashes) - set(digests))
+        if not stale:
+            return current
+        print(f'{CURVE} pools changed: {len(changed)}, removed: {len(set(curve_pool_hashes) - set(digests))}')
+        kept = current.take(np.fromiter((pool_id not in stale for pool_id in current.id), dtype=bool, count=len(current)))
+        store = PoolStore.concat([kept, await normalize_pools(CURVE, changed)])
+    # only remember the pools once their pairs are in a store
+    curve_pool_hashes.clear()
+    curve_pool_hashes.update(digests)
+    return store
+
+
+async def collect_store(protocol: str, full_sync: bool = True, pool_ids: list = None, current: PoolStore = None) -> PoolStore:
+    '''
+    Collects a protocol's pools, the pools that changed since its last collection, or just the given pools, into a store.
+    Pages are parsed as they arrive, overlapping the parsing with the rest of the collection.
+    Curve is always collected in full, current is the protocol's published store and is returned as is when nothing changed.
+    '''
+    if protocol == CURVE:
+        return await collect_curve_store(current)
+
+    parsing = []
+
+    def on_page(page):
+        parsing.append(asyncio.ensure_future(normalize_pools(protocol, page)))
+
+    try:
+        if pool_ids is not None:
+            pools = await collect_pools_by_id(protocol, pool_ids, on_page=on_page)
+        elif full_sync:
+            pools = await collect_pools(protocol, on_page=on_page)
+        else:
+            pools = await collect_pool_changes(protocol, on_page=on_page)
+        stores = await asyncio.gather(*parsing)
+    except BaseException:
+        for task in parsing:
+            task.cancel()
+        raise
+
+    store = PoolStore.concat(stores)
+    if pool_ids is None and full_sync and pools and len(store):
+        # pages are parsed before the top pools are known, drop the pools that didn't make the cut
+        store = store.take(store.metric >= float(pools[-1][DEX_METRIC_MAP[protocol]]))
+    return store
@@ -0,0 +1,193 @@
+'''
+This module contains the compact records the collectors produce: a shared token table, pair records and multi-asset pools.
+'''
+
+# local imports
+from constants import BALANCER_V1, BALANCER_V2, CURVE, DEX_METRIC_MAP, DEX_LIQUIDITY_METRIC_MAP, PROTOCOL_CODES
+# standard library imports
+from itertools import combinations
+from math import nan
+
+# the token field holding the pool weight for weighted pools
+WEIGHT_FIELDS = {
+    BALANCER_V1: 'denormWeight',
+    BALANCER_V2: 'weight'
+}
+
+
+def to_float(value, default: float = nan) -> float:
+    # subgraph values arrive as strings, numbers or None
+    try:
+        return float(value) if value is not None else default
+    except (TypeError, ValueError):
+        return default
+
+
+def to_int(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenTable:
+    ''' Interned token metadata keyed by address, records reference tokens by their index in this table. '''
+
+    def __init__(self):
+        self.ids = []
+        self.symbols = []
+        self.decimals = []
+        self.lookup = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, token_id: str, symbol: str, decimals=None) -> int:
+        index = self.lookup.get(token_id)
+        if index is None:
+            index = len(self.ids)
+            self.ids.append(token_id)
+            self.symbols.append(symbol)
+            self.decimals.append(to_int(decimals))
+            # publish the lookup last so readers never see a half-added token
+            self.lookup[token_id] = index
+        elif self.decimals[index] is None:
+            # not every protocol reports decimals, fill them in once a source does
+            self.decimals[index] = to_int(decimals)
+        return index
+
+    def token(self, index: int) -> dict:
+        token = {'id': self.ids[index], 'symbol': self.symbols[index]}
+        if self.decimals[index] is not None:
+            token['decimals'] = self.decimals[index]
+        return token
+
+
+# one table shared by every collector and store, so records and stores can be combined without remapping
+TOKENS = TokenTable()
+
+
+class PairRecord:
+    ''' A single tradeable pair with its fields parsed, tokens are referenced by their index in TOKENS. '''
+
+    # same order as the pool store columns
+    __slots__ = ('id', 'protocol', 'token0', 'token1', 'reserve0', 'reserve1', 'price0_usd', 'price1_usd', 'token0_price',
+                 'token1_price', 'fee', 'weight0', 'weight1', 'liquidity', 'metric', 'dangerous', 'type')
+
+    def __init__(self, id: str, protocol: int, token0: int, token1: int, reserve0: float, reserve1: float, price0_usd: float, price1_usd: float,
+                 token0_price: float = nan, token1_price: float = nan, fee: float = nan, weight0: float = nan, weight1: float = nan,
+                 liquidity: float = 0.0, metric: float = 0.0, dangerous: bool = False, type: str = None):
+        self.id = id
+        self.protocol = protocol
+        self.token0 = token0
+        self.token1 = token1
+        self.reserve0 = reserve0
+        self.reserve1 = reserve1
+        self.price0_usd = price0_usd
+        self.price1_usd = price1_usd
+        self.token0_price = token0_price
+        self.token1_price = token1_price
+        self.fee = fee
+        self.weight0 = weight0
+        self.weight1 = weight1
+        self.liquidity = liquidity
+        self.metric = metric
+        self.dangerous = dangerous
+        self.type = type
+
+    def row(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    @classmethod
+    def from_dict(cls, pool: dict) -> 'PairRecord':
+        ''' Parses a pool in the uniswap/sushiswap dict format the subgraph collectors produce. '''
+        protocol = pool['protocol']
+        token0 = pool['token0']
+        token1 = pool['token1']
+        weight_field = WEIGHT_FIELDS.get(protocol)
+        return cls(
+            pool['id'],
+            PROTOCOL_CODES[protocol],
+            TOKENS.intern(token0['id'], token0['symbol'], token0.get('decimals')),
+            TOKENS.intern(token1['id'], token1['symbol'], token1.get('decimals')),
+            to_float(pool.get('reserve0'), 0.0),
+            to_float(pool.get('reserve1'), 0.0),
+            to_float(token0.get('priceUSD'), 0.0),
+            to_float(token1.get('priceUSD'), 0.0),
+            token0_price=to_float(pool.get('token0Price')),
+            token1_price=to_float(pool.get('token1Price')),
+            fee=to_float(pool.get('swapFee')),
+            weight0=to_float(token0.get(weight_field)) if weight_field else nan,
+            weight1=to_float(token1.get(weight_field)) if weight_field else nan,
+            liquidity=to_float(pool.get(DEX_LIQUIDITY_METRIC_MAP[protocol]), 0.0),
+            metric=to_float(pool.get(DEX_METRIC_MAP[protocol]), 0.0),
+            # pools that were skipped during processing never got flagged, treat them as dangerous
+            dangerous=bool(pool.get('dangerous', True)),
+            type=pool.get('type')
+        )
+
+
+class MultiAssetPool:
+    ''' A Balancer or Curve pool holding any number of tokens, stored once and expanded into pair records on demand. '''
+
+    __slots__ = ('id', 'protocol', 'tokens', 'balances', 'prices', 'weights', 'bad_tokens', 'fee', 'metric')
+
+    def __init__(self, id: str, protocol: str, tokens: tuple, balances: tuple, prices: tuple, bad_tokens: tuple,
+                 weights: tuple = None, fee: float = nan, metric: float = 0.0):
+        self.id = id
+        self.protocol = protocol
+        self.tokens = tokens
+        self.balances = balances
+        # None for tokens the source couldn't price
+        self.prices = prices
+        self.bad_tokens = bad_tokens
+        self.weights = weights
+        self.fee = fee
+        self.metric = metric
+
+    def pairs(self):
+        ''' Yields a pair record for every combination of two tokens in the pool. '''
+        protocol_code = PROTOCOL_CODES[self.protocol]
+        for i, j in combinations(range(len(self.tokens)), 2):
+            reserve0, reserve1 = self.balances[i], self.balances[j]
+            price0, price1 = self.prices[i], self.prices[j]
+            dangerous = self.bad_tokens[i] or self.bad_tokens[j]
+            token0_price = token1_price = nan
+
+            if self.protocol == CURVE:
+                # curve pairs can only be quoted when both coins have a (non zero) price
+                if not price0 or not price1:
+                    continue
+                token0_price = price1 / price0
+                token1_price = price0 / price1
+                liquidity = reserve0 * price0 + reserve1 * price1
+            elif self.protocol == BALANCER_V1:
+                price0, price1 = price0 or 0.0, price1 or 0.0
+                liquidity = reserve0 * price0 + reserve1 * price1
+                dangerous = dangerous or reserve0 == 0 or reserve1 == 0
+            else:
+                price0, price1 = price0 or 0.0, price1 or 0.0
+                # split the pool's total liquidity between the pair by their share of the reserves
+                try:
+                    liquidity = self.metric * price0 * (reserve0 / (reserve0 + reserve1)) + self.metric * price1 * (reserve1 / (reserve0 + reserve1))
+                except ZeroDivisionError:
+                    liquidity = 0.0
+
+            yield PairRecord(
+                self.id, protocol_code, self.tokens[i], self.tokens[j], reserve0, reserve1, price0, price1,
+                token0_price=token0_price,
+                token1_price=token1_price,
+                fee=self.fee,
+                weight0=self.weights[i] if self.weights else nan,
+                weight1=self.weights[j] if self.weights else nan,
+                liquidity=liquidity,
+                # curve has no pagination metric, it is ranked by the same reserveUSD figure
+                metric=liquidity if self.protocol == CURVE else self.metric,
+                dangerous=dangerous
+            )
+
+
+def expand_pairs(pools: list):
+    ''' Yields the pair records of every multi-asset pool in the list. '''
+    for pool in pools:
+        yield from pool.pairs()
@@ -0,0 +1,439 @@
+'''
+This module contains the pool store, a columnar table of pools whose fields are parsed once at ingest.
+'''
+
+# local imports
+from constants import (DEX_LIST, DEX_METRIC_MAP, DEX_LIQUIDITY_METRIC_MAP, BLACKLISTED_TOKENS, PROTOCOL_CODES, UNISWAP_V2, SUSHISWAP_V2,
+                       PANCAKESWAP_V3)
+from pool_records import TOKENS, WEIGHT_FIELDS, PairRecord
+from csr_graph import CSRGraph
+# standard library imports
+import json
+import logging
+import os
+import struct
+import sys
+# third party imports
+import numpy as np
+
+# column name -> dtype, in the same order as the pair record fields
+COLUMNS = {
+    'id': object,
+    'protocol': np.int8,
+    'token0': np.int32,
+    'token1': np.int32,
+    'reserve0': np.float64,
+    'reserve1': np.float64,
+    'price0_usd': np.float64,
+    'price1_usd': np.float64,
+    'token0_price': np.float64,
+    'token1_price': np.float64,
+    'fee': np.float64,
+    'weight0': np.float64,
+    'weight1': np.float64,
+    'liquidity': np.float64,
+    'metric': np.float64,
+    'dangerous': np.bool_,
+    'type': object
+}
+
+
+# on-disk snapshot layout: magic, format number, header length, JSON header, then 64 byte aligned raw columns
+SNAPSHOT_MAGIC = b'ETAXPOOL'
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_PREFIX = struct.Struct('<IQ')
+SNAPSHOT_ALIGNMENT = 64
+SNAPSHOT_SUFFIX = '.snapshot'
+
+
+def pool_token_prices(protocols: np.ndarray, tokens: np.ndarray, prices: np.ndarray) -> np.ndarray:
+    '''
+    Corrects the token USD prices pools report where the collector derived them from the pool's total value,
+    prices that can't be corrected come back as NaN.
+    '''
+    prices = prices.copy()
+    # uniswap v2 and sushiswap divide the whole pool's value by one side's reserve, twice the price in a constant product pool
+    prices[np.isin(protocols, [PROTOCOL_CODES[UNISWAP_V2], PROTOCOL_CODES[SUSHISWAP_V2]])] /= 2
+    # sushiswap's reserves still carry the token decimals
+    sushiswap = protocols == PROTOCOL_CODES[SUSHISWAP_V2]
+    if sushiswap.any():
+        decimals = np.array([np.nan if value is None else value for value in TOKENS.decimals], dtype=np.float64)
+        prices[sushiswap] *= 10 ** decimals[tokens[sushiswap]]
+    # pancakeswap v3 divides the value locked by one side's locked tokens, off by however much the other side holds
+    prices[protocols == PROTOCOL_CODES[PANCAKESWAP_V3]] = np.nan
+    return prices
+
+
+class PoolStore:
+    ''' Immutable columnar pool table, each pool is addressed by an integer handle into the column arrays. '''
+
+    def __init__(self, columns: dict = None):
+        columns = columns or {}
+        for name, dtype in COLUMNS.items():
+            column = np.asarray(columns.get(name, ()), dtype=dtype)
+            # published stores are shared between threads, nothing may write to them
+            column.flags.writeable = False
+            setattr(self, name, column)
+        # snapshot version, assigned when the store is published
+        self.version = 0
+        # lazily built lookups and dict views
+        self._keys = None
+        self._key_lookup = None
+        self._token_index = None
+        self._token_prices = None
+        self._maxima = None
+        self._csr_graph = None
+        self._views = {}
+
+    def __len__(self):
+        return len(self.id)
+
+    @classmethod
+    def from_records(cls, records) -> 'PoolStore':
+        rows = [record.row() for record in records]
+        if not rows:
+            return cls()
+        return cls(dict(zip(COLUMNS, zip(*rows))))
+
+    @classmethod
+    def from_pools(cls, pools: list) -> 'PoolStore':
+        return cls.from_records(PairRecord.from_dict(pool) for pool in pools)
+
+    @classmethod
+    def concat(cls, stores: list) -> 'PoolStore':
+        stores = [store for store in stores if len(store)]
+        if not stores:
+            return cls()
+        return cls({name: np.concatenate([getattr(store, name) for store in stores]) for name in COLUMNS})
+
+    def columns(self) -> dict:
+        return {name: getattr(self, name) for name in COLUMNS}
+
+    def take(self, handles) -> 'PoolStore':
+        return PoolStore({name: column[handles] for name, column in self.columns().items()})
+
+    def unique(self) -> 'PoolStore':
+        ''' Returns the store with only the last pool collected for each key. '''
+        lookup = self.key_lookup()
+        if len(lookup) == len(self):
+            return self
+        return self.take(np.fromiter(sorted(lookup.values()), dtype=np.int64, count=len(lookup)))
+
+    def upsert(self, other: 'PoolStore') -> 'PoolStore':
+        ''' Returns a new store with the pools of other replacing any pools in this store with the same key. '''
+        other = other.unique()
+        if not len(self):
+            return other
+        replaced = other.key_lookup()
+        keep = np.fromiter((key not in replaced for key in self.keys()), dtype=bool, count=len(self))
+        return PoolStore.concat([self.take(keep), other])
+
+    def split_protocols(self) -> dict:
+        ''' Returns a store per protocol, as views over this store when it is ordered by protocol like published snapshots are. '''
+        protocols = self.protocol
+        if np.all(protocols[1:] >= protocols[:-1]):
+            bounds = np.searchsorted(protocols, np.arange(len(DEX_LIST) + 1)).tolist()
+            return {protocol: self.take(slice(bounds[code], bounds[code + 1])) for protocol, code in PROTOCOL_CODES.items()}
+        return {protocol: self.take(protocols == code) for protocol, code in PROTOCOL_CODES.items()}
+
+    def memory_usage(self) -> int:
+        ''' Returns the approximate number of bytes held by the store's columns. '''
+        size = sum(column.nbytes for column in self.columns().values())
+        # object columns only hold pointers, count the pool ID strings they point to as well
+        size += sum(sys.getsizeof(pool_id) for pool_id in self.id)
+        return size
+
+    def keys(self) -> list:
+        # pools are keyed the same way as the old pool_dict, {id}_{token0}_{token1}
+        if self._keys is None:
+            ids = TOKENS.ids
+            self._keys = [f'{pool_id}_{ids[token0]}_{ids[token1]}' for pool_id, token0, token1 in zip(self.id, self.token0.tolist(), self.token1.tolist())]
+        return self._keys
+
+    def key_lookup(self) -> dict:
+        if self._key_lookup is None:
+            self._key_lookup = {key: handle for handle, key in enumerate(self.keys())}
+        return self._key_lookup
+
+    def pool(self, handle: int) -> dict:
+        ''' Materializes the dict view of a pool, in the same shape the collectors produce. '''
+        handle = int(handle)
+        view = self._views.get(handle)
+        if view is None:
+            view = self._materialize(handle)
+            self._views[handle] = view
+        return view
+
+    def _materialize(self, handle: int) -> dict:
+        protocol = DEX_LIST[self.protocol[handle]]
+        weight_field = WEIGHT_FIELDS.get(protocol)
+        token0 = TOKENS.token(self.token0[handle])
+        token1 = TOKENS.token(self.token1[handle])
+        token0['priceUSD'] = float(self.price0_usd[handle])
+        token1['priceUSD'] = float(self.price1_usd[handle])
+        # weightless pools, like balancer's stable pools, leave the weight out rather than pricing swaps with NaN
+        if weight_field and not np.isnan(self.weight0[handle]):
+            token0[weight_field] = float(self.weight0[handle])
+        if weight_field and not np.isnan(self.weight1[handle]):
+            token1[weight_field] = float(self.weight1[handle])
+
+        pool = {
+            'id': self.id[handle],
+            'protocol': protocol,
+            'reserve0': float(self.reserve0[handle]),
+            'reserve1': float(self.reserve1[handle]),
+            'token0': token0,
+            'token1': token1,
+            'dangerous': bool(self.dangerous[handle])
+        }
+        for field, column in (('token0Price', self.token0_price), ('token1Price', self.token1_price), ('swapFee', self.fee)):
+            if not np.isnan(column[handle]):
+                pool[field] = float(column[handle])
+        pool[DEX_METRIC_MAP[protocol]] = float(self.metric[handle])
+        pool[DEX_LIQUIDITY_METRIC_MAP[protocol]] = float(self.liquidity[handle])
+        if self.type[handle] is not None:
+            pool['type'] = self.type[handle]
+        return pool
+
+    def token_mask(self, token_id: str) -> np.ndarray:
+        ''' Returns a mask of the pools containing the token. '''
+        token = TOKENS.lookup.get(token_id)
+        if token is None:
+            return np.zeros(len(self), dtype=bool)
+        return (self.token0 == token) | (self.token1 == token)
+
+    def token_index(self) -> dict:
+        ''' token index -> protocol code -> pool handles sorted descending by liquidity, blacklisted pools excluded. '''
+        if self._token_index is None:
+            self._token_index = self._build_token_index()
+        return self._token_index
+
+    def _build_token_index(self) -> dict:
+        blacklist = [TOKENS.lookup[token_id] for token_id in BLACKLISTED_TOKENS if token_id in TOKENS.lookup]
+        keep = ~(np.isin(self.token0, blacklist) | np.isin(self.token1, blacklist))
+        second = keep & (self.token1 != self.token0)
+        handles = np.arange(len(self))
+        tokens = np.concatenate((self.token0[keep], self.token1[second]))
+        pool_handles = np.concatenate((handles[keep], handles[second]))
+        if not len(tokens):
+            return {}
+        protocols = self.protocol[pool_handles]
+        # group by token then protocol, most liquid pool first within each group
+        order = np.lexsort((-self.liquidity[pool_handles], protocols, tokens))
+        tokens, protocols, pool_handles = tokens[order], protocols[order], pool_handles[order]
+        bounds = np.flatnonzero((tokens[1:] != tokens[:-1]) | (protocols[1:] != protocols[:-1])) + 1
+        starts = [0] + bounds.tolist()
+        ends = bounds.tolist() + [len(tokens)]
+
+        index = {}
+        for start, end in zip(starts, ends):
+            index.setdefault(int(tokens[start]), {})[int(protocols[start])] = pool_handles[start:end]
+        return index
+
+    def protocol_mask(self, exchanges=None) -> np.ndarray:
+        ''' Returns a mask of the pools on the allowed exchanges. '''
+        if exchanges is None:
+            return np.ones(len(self), dtype=bool)
+        # exchanges may be a list of protocols or a single protocol string
+        return np.isin(self.protocol, [code for protocol, code in PROTOCOL_CODES.items() if protocol in exchanges])
+
+    def maxima(self) -> tuple:
+        ''' (highest token USD price, highest liquidity) across the store, used to normalize pool scores. '''
+        if self._maxima is None:
+            if len(self):
+                self._maxima = (float(np.maximum(self.price0_usd, self.price1_usd).max()), float(self.liquidity.max()))
+            else:
+                self._maxima = (0.0, 0.0)
+        return self._maxima
+
+    def csr_graph(self) -> CSRGraph:
+        ''' The routing engine's token graph over the store, its edges refer to pools by handle. '''
+        if self._csr_graph is None:
+            self._csr_graph = CSRGraph.from_store(self)
+        return self._csr_graph
+
+    def token_prices(self) -> np.ndarray:
+        ''' USD price of every interned token, averaged over the pools holding it and weighted by their liquidity. '''
+        if self._token_prices is None:
+            self._token_prices = self._build_token_prices()
+        return self._token_prices
+
+    def _build_token_prices(self) -> np.ndarray:
+        tokens = np.concatenate((self.token0, self.token1))
+        prices = pool_token_prices(np.concatenate((self.protocol, self.protocol)), tokens, np.concatenate((self.price0_usd, self.price1_usd)))
+        weights = np.concatenate((self.liquidity, self.liquidity))
+        # zero prices mean the collector couldn't price the token, they shouldn't drag the average down
+        priced = np.isfinite(prices) & (prices > 0)
+        weights = np.where(priced & np.isfinite(weights) & (weights > 0), weights, 0.0)
+        tokens, prices, weights = tokens[priced], prices[priced], weights[priced]
+
+        size = len(TOKENS)
+        weight_totals = np.bincount(tokens, weights=weights, minlength=size)
+        weighted_prices = np.bincount(tokens, weights=weights * prices, minlength=size)
+        # fall back to a plain average for tokens only found in pools without a liquidity figure
+        counts = np.bincount(tokens, minlength=size)
+        price_totals = np.bincount(tokens, weights=prices, minlength=size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            token_prices = np.where(weight_totals > 0, weighted_prices / weight_totals, price_totals / np.maximum(counts, 1))
+        token_prices.flags.writeable = False
+        return token_prices
+
+    def token_price_usd(self, token_id: str) -> float:
+        token = TOKENS.lookup.get(token_id)
+        token_prices = self.token_prices()
+        if token is None or token >= len(token_prices):
+            return 0.0
+        return float(token_prices[token])
+
+    def top_token_pools(self, token_id: str, exchanges=None, X: int = 50) -> np.ndarray:
+        ''' Returns the handles of the X most liquid pools containing the token on the allowed exchanges. '''
+        token = TOKENS.lookup.get(token_id)
+        protocol_pools = self.token_index().get(token) if token is not None else None
+        if not protocol_pools:
+            return np.empty(0, dtype=np.int64)
+        # exchanges may be a list of protocols or a single protocol string
+        ranked = [protocol_pools[code][:X] for protocol, code in PROTOCOL_CODES.items() if code in protocol_pools and (exchanges is None or protocol in exchanges)]
+        if not ranked:
+            return np.empty(0, dtype=np.int64)
+        if len(ranked) == 1:
+            return ranked[0]
+        # each list is already sorted, so only the first X of each can make the cut
+        candidates = np.concatenate(ranked)
+        return candidates[np.argsort(-self.liquidity[candidates], kind='stable')[:X]]
+
+
+def align(offset: int) -> int:
+    return -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+
+def localize_tokens(store: PoolStore) -> tuple:
+    '''
+    Returns the store's columns with token indices pointing into a list of just the tokens it references, and that token list.
+    Token indices are only meaningful inside the process that interned them, this is how stores leave the process.
+    '''
+    used_tokens = np.unique(np.concatenate((store.token0, store.token1)))
+    columns = store.columns()
+    columns['token0'] = np.searchsorted(used_tokens, store.token0).astype(np.int32)
+    columns['token1'] = np.searchsorted(used_tokens, store.token1).astype(np.int32)
+    used_tokens = used_tokens.tolist()
+    tokens = {
+        'ids': [TOKENS.ids[token] for token in used_tokens],
+        'symbols': [TOKENS.symbols[token] for token in used_tokens],
+        'decimals': [TOKENS.decimals[token] for token in used_tokens]
+    }
+    return columns, tokens
+
+
+def intern_tokens(columns: dict, tokens: dict) -> dict:
+    ''' Maps columns produced by localize_tokens back onto this process's token table. '''
+    remap = np.array([
+        TOKENS.intern(token_id, symbol, decimals)
+        for token_id, symbol, decimals in zip(tokens['ids'], tokens['symbols'], tokens['decimals'])
+    ], dtype=np.int32)
+    if len(columns['token0']):
+        columns['token0'] = remap[columns['token0']]
+        columns['token1'] = remap[columns['token1']]
+    return columns
+
+
+def save_store(store: PoolStore, path: str):
+    ''' Writes the store to a compact binary file whose numeric columns can be memory-mapped back. '''
+    # token indices are only meaningful inside this process, so the referenced tokens are saved alongside
+    columns, tokens = localize_tokens(store)
+
+    layout = {}
+    offset = 0
+    for name, column in columns.items():
+        if column.dtype == object:
+            continue
+        layout[name] = [column.dtype.str, offset]
+        offset = align(offset + column.nbytes)
+    header = json.dumps({
+        'version': store.version,
+        'length': len(store),
+        'columns': layout,
+        'tokens': tokens,
+        'id': store.id.tolist(),
+        'type': {handle: pool_type for handle, pool_type in enumerate(store.type.tolist()) if pool_type is not None}
+    }).encode()
+
+    # write next to the target and rename, so a crash never leaves a truncated snapshot behind
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + SNAPSHOT_PREFIX.pack(SNAPSHOT_FORMAT, len(header)) + header)
+        data_start = align(f.tell())
+        for name, (_, column_offset) in layout.items():
+            f.seek(data_start + column_offset)
+            f.write(np.ascontiguousarray(columns[name]).tobytes())
+    os.replace(temp_path, path)
+
+
+def load_store(path: str) -> PoolStore:
+    ''' Loads a store written by save_store, numeric columns stay memory-mapped from the file. '''
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f'{path} is not a pool snapshot')
+        prefix = f.read(SNAPSHOT_PREFIX.size)
+        if len(prefix) < SNAPSHOT_PREFIX.size:
+            raise ValueError(f'{path} is truncated')
+        snapshot_format, header_length = SNAPSHOT_PREFIX.unpack(prefix)
+        if snapshot_format != SNAPSHOT_FORMAT:
+            raise ValueError(f'{path} has unsupported snapshot format {snapshot_format}')
+        header = json.loads(f.read(header_length))
+    length = header['length']
+    data_start = align(len(SNAPSHOT_MAGIC) + SNAPSHOT_PREFIX.size + header_length)
+    # a mapped column running past the end of the file would come back silently short
+    data_end = max((data_start + offset + length * np.dtype(dtype).itemsize for dtype, offset in header['columns'].values()), default=data_start)
+    if length and os.path.getsize(path) < data_end:
+        raise ValueError(f'{path} is truncated')
+
+    columns = {}
+    raw = np.memmap(path, dtype=np.uint8, mode='r') if length else None
+    for name, (dtype, offset) in header['columns'].items():
+        dtype = np.dtype(dtype)
+        start = data_start + offset
+        columns[name] = raw[start:start + length * dtype.itemsize].view(dtype) if length else np.empty(0, dtype=dtype)
+
+    # map the snapshot's token indices onto this process's token table
+    columns = intern_tokens(columns, header['tokens'])
+    columns['id'] = np.array(header['id'], dtype=object)
+    pool_types = np.full(length, None, dtype=object)
+    for handle, pool_type in header['type'].items():
+        pool_types[int(handle)] = pool_type
+    columns['type'] = pool_types
+
+    store = PoolStore(columns)
+    store.version = header['version']
+    return store
+
+
+def save_snapshot(store: PoolStore, directory: str, keep: int = 3) -> str:
+    ''' Saves the store as the newest snapshot in the directory and prunes all but the newest few. '''
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'pools-{store.version:010d}{SNAPSHOT_SUFFIX}')
+    save_store(store, path)
+    for old_path in list_snapshots(directory)[keep:]:
+        try:
+            os.remove(old_path)
+        except OSError as e:
+            # a snapshot that is still mapped can't be removed on some platforms, try again next time
+            logging.warning(f'could not remove old snapshot {old_path}: {e}')
+    return path
+
+
+def list_snapshots(directory: str) -> list:
+    ''' Returns the snapshot files in the directory, newest first. '''
+    if not os.path.isdir(directory):
+        return []
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SNAPSHOT_SUFFIX)]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def load_latest_snapshot(directory: str):
+    ''' Loads the newest readable snapshot in the directory, or returns None if there isn't one. '''
+    for path in list_snapshots(directory):
+        try:
+            return load_store(path)
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f'could not load snapshot {path}: {e}')
+    return None
@@ -24,6 +24,11 @@ INFURA_SECRET = INFURA_SECRET.strip('"') if INFURA_SECRET else None
 NODE_URL = 'https://mainnet.infura.io/v3/{}'.format(INFURA_KEY)
 w3 = Web3(Web3.HTTPProvider(NODE_URL))
 
+# what selling sell_amount into a DODO pool returns at its last trade price, before slippage
+def dodo_expected_return(pool: dict, sell_symbol: str, sell_amount: float) -> float:
+    initial_price = float(pool['token1Price']) if sell_symbol == pool['token0']['symbol'] else float(pool['token0Price'])
+    return sell_amount/initial_price
+
 # this is a placeholder web3-based price impact retrieval method, 
 # it will be replaced with a mathematical implementation 
 def dodo_price_impact(pool: dict, sell_symbol: str, sell_amount: float) -> dict:
@@ -83,8 +88,7 @@ def dodo_price_impact(pool: dict, sell_symbol: str, sell_amount: float) -> dict:
             tokens_received = tokens_received[0] / 10**float(pool[f'token{buy_token}']['decimals'])
 
         # calculate price impact as a percentage
-        initial_price = float(pool['token1Price']) if sell_symbol == pool['token0']['symbol'] else float(pool['token0Price'])
-        expected_return = sell_amount/initial_price
+        expected_return = dodo_expected_return(pool, sell_symbol, sell_amount)
         actual_return = tokens_received
         price_impact = max(0, (1-(actual_return/expected_return))*100)
 
@@ -241,7 +245,7 @@ def constant_mean_price_impact(pool: dict, sell_symbol: str, sell_amount: float)
     return {'actual_return': token_amount_out, 'price_impact': price_impact_percentage, 'buy_symbol': pool[f'token{buy_token}']['symbol'], 'description': description}
 
 
-def get_max_amount_for_impact_limit(g, path: dict) -> float:
+def get_max_amount_for_impact_limit(pools: dict, path: dict) -> float:
     pool_num = sum(key.startswith('swap_') for key in path) - 1 # more consistent than len(path) - X, need to remember not to add any keys that start with swap_
     print(f'pool_num: {pool_num}')
     print('path:')
@@ -252,7 +256,7 @@ def get_max_amount_for_impact_limit(g, path: dict) -> float:
     while pool_num >= 0:
         swap = path[f'swap_{pool_num}']
         print(swap)
-        pool = g.nodes[swap['pool']]['pool']
+        pool = pools[swap['pool']]
         sell_symbol = swap['input_token']
         buy_symbol = swap['output_token']
 
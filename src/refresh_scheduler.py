@@ -0,0 +1,130 @@
+'''
+This module schedules pool refreshes in tiers: the most used and most moving pools every block, each protocol's
+changes every minute and its full pool list every few minutes, within each protocol's subgraph request budget.
+'''
+
+# local imports
+from constants import DEX_LIST, CURVE
+from smart_order_router import refresh_pools, refresh_hot_pools, next_sync_is_full, protocol_stores
+from pool_activity import hot_pools, activity_stats
+from pool_collector import PAGINATION_BANDS, requests_for_pages
+from circuit_breaker import get_breaker
+# standard library imports
+import asyncio
+import logging
+import math
+import os
+import time
+
+# hot tier: the most active pools of each protocol, refreshed by id every block
+HOT_INTERVAL = float(os.getenv("ETAX_HOT_INTERVAL", default=12))
+# warm tier: everything that changed since the last sync, with a full sweep every FULL_SYNC_EVERY warm refreshes
+WARM_INTERVAL = float(os.getenv("ETAX_WARM_INTERVAL", default=60))
+# requests a protocol's subgraph may be sent per minute, retries included
+SUBGRAPH_BUDGET = float(os.getenv("ETAX_SUBGRAPH_BUDGET", default=120))
+# pools fetched per request by a hot refresh
+HOT_CHUNK = 100
+# how long a tier that was over budget waits before it is tried again
+DEFER_DELAY = 5
+
+
+class RequestBudget:
+    ''' A token bucket over the requests a protocol's breaker has counted, refilled at SUBGRAPH_BUDGET per minute. '''
+
+    def __init__(self, protocol: str, per_minute: float = SUBGRAPH_BUDGET):
+        self.breaker = get_breaker(protocol)
+        self.per_minute = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.counted = self.breaker.total_requests
+
+    def available(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+        # every request sent since the last check, whichever tier sent it, comes out of the bucket
+        self.tokens -= self.breaker.total_requests - self.counted
+        self.counted = self.breaker.total_requests
+        return self.tokens
+
+
+class ProtocolSchedule:
+    ''' When each tier of a protocol is next due. '''
+
+    def __init__(self, protocol: str):
+        self.protocol = protocol
+        self.budget = RequestBudget(protocol)
+        # curve is a single request for every pool, it has no hot tier
+        self.has_hot_tier = protocol != CURVE
+        self.hot_due = 0.0 if self.has_hot_tier else math.inf
+        self.warm_due = 0.0
+        self.running = False
+        self.hot_refreshes = 0
+        self.warm_refreshes = 0
+        self.deferred = 0
+
+    def warm_cost(self) -> int:
+        # a full sweep pages every band and reads the indexed block, a delta sync usually takes a page or two
+        return requests_for_pages(PAGINATION_BANDS) + 1 if next_sync_is_full(self.protocol) else 2
+
+    async def run_due(self, now: float):
+        try:
+            if now >= self.warm_due:
+                if self.protocol == CURVE or self.budget.available() >= self.warm_cost():
+                    self.warm_due = now + WARM_INTERVAL
+                    # the warm refresh covers the hot pools too
+                    if self.has_hot_tier:
+                        self.hot_due = now + HOT_INTERVAL
+                    self.warm_refreshes += 1
+                    await refresh_pools(self.protocol)
+                    return
+                # over budget, check again shortly
+                self.warm_due = now + DEFER_DELAY
+                self.deferred += 1
+            if now >= self.hot_due:
+                self.hot_due = now + HOT_INTERVAL
+                pool_ids = hot_pools(self.protocol, protocol_stores[self.protocol])
+                if pool_ids and self.budget.available() >= requests_for_pages(math.ceil(len(pool_ids) / HOT_CHUNK)):
+                    self.hot_refreshes += 1
+                    await refresh_hot_pools(self.protocol, pool_ids)
+                elif pool_ids:
+                    # over budget, skip this block
+                    self.deferred += 1
+        except Exception as e:
+            logging.error(f'{self.protocol} scheduled refresh failed: {e!r}')
+        finally:
+            self.running = False
+
+    def stats(self) -> dict:
+        return {
+            'hot_refreshes': self.hot_refreshes,
+            'warm_refreshes': self.warm_refreshes,
+            'deferred': self.deferred,
+            'budget': round(self.budget.available(), 2),
+            'next_sync_full': next_sync_is_full(self.protocol)
+        }
+
+
+schedules = {protocol: ProtocolSchedule(protocol) for protocol in DEX_LIST}
+
+
+async def run_scheduler(tick: float = 1.0):
+    ''' Runs the due tiers of every protocol, a protocol's refreshes never overlap but protocols refresh independently. '''
+    tasks = set()
+    while True:
+        now = time.monotonic()
+        for schedule in schedules.values():
+            if not schedule.running and now >= min(schedule.hot_due, schedule.warm_due):
+                schedule.running = True
+                task = asyncio.ensure_future(schedule.run_due(now))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        await asyncio.sleep(tick)
+
+
+def scheduler_stats() -> dict:
+    activity = activity_stats()
+    return {
+        protocol: dict(schedule.stats(), **activity.get(protocol, {}))
+        for protocol, schedule in schedules.items()
+    }
@@ -0,0 +1,99 @@
+'''
+This is a local stand-in for the subgraph and Curve endpoints, it serves responses saved by the record transport.
+Run it, then start the collectors with ETAX_TRANSPORT=replay to benchmark or test collection without a network.
+
+    python replay_server.py --latency 200 --jitter 50 --error-rate 0.05
+'''
+
+# local imports
+from transport import RECORDINGS_DIR, load_recording, request_key
+# standard library imports
+import argparse
+import asyncio
+import random
+# third party imports
+from aiohttp import web
+
+
+class ReplayStats:
+    ''' Counts what the stand-in served, max_in_flight shows how many requests the collectors really had open at once. '''
+
+    def __init__(self):
+        self.requests = 0
+        self.served = 0
+        self.missing = 0
+        self.injected_errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def create_app(directory: str = RECORDINGS_DIR, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+               error_status: int = 500, retry_after: int = None) -> web.Application:
+    ''' Builds the stand-in app, latency and jitter are in milliseconds and error_rate is the share of requests that fail. '''
+    stats = ReplayStats()
+
+    async def replay(request: web.Request) -> web.Response:
+        stats.requests += 1
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            delay = max(0.0, random.gauss(latency, jitter)) if jitter else latency
+            if delay:
+                await asyncio.sleep(delay / 1000)
+
+            if error_rate and random.random() < error_rate:
+                stats.injected_errors += 1
+                headers = {'Retry-After': str(retry_after)} if retry_after is not None else None
+                return web.json_response({'errors': [{'message': 'injected error'}]}, status=error_status, headers=headers)
+
+            body = await request.json()
+            recording = load_recording(request.match_info['slug'], request_key(body['method'], body['payload']), directory)
+            if recording is None:
+                stats.missing += 1
+                return web.json_response({'errors': [{'message': 'no recording for this request'}]}, status=404)
+
+            stats.served += 1
+            return web.Response(
+                status=recording['status'],
+                body=recording['body'].encode(),
+                content_type=recording['headers'].get('Content-Type', 'application/json').split(';')[0]
+            )
+        finally:
+            stats.in_flight -= 1
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats.to_dict())
+
+    async def reset_stats(request: web.Request) -> web.Response:
+        stats.__init__()
+        return web.json_response(stats.to_dict())
+
+    app = web.Application()
+    app.router.add_get('/_stats', get_stats)
+    app.router.add_delete('/_stats', reset_stats)
+    app.router.add_post('/{slug}', replay)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve recorded collector responses.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--dir', default=RECORDINGS_DIR, help='recordings directory')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean response latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='standard deviation of the latency in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with an error')
+    parser.add_argument('--error-status', type=int, default=500, help='status of injected errors, e.g. 429 or 503')
+    parser.add_argument('--retry-after', type=int, default=None, help='Retry-After seconds sent with injected errors')
+    args = parser.parse_args()
+
+    app = create_app(args.dir, args.latency, args.jitter, args.error_rate, args.error_status, args.retry_after)
+    print(f'replaying {args.dir} on http://{args.host}:{args.port}')
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
-from smart_order_router import route_orders, refresh_pools, DEX_LIST
+from smart_order_router import route_orders, refresh_pools, restore_pools, pool_store_stats, collector_status, DEX_LIST, TOKEN_GRAPH
+from refresh_scheduler import run_scheduler, scheduler_stats
+from http_session import close_session
 from threading import Thread
 from flask import Flask, request, jsonify, redirect
 from flask_cors import CORS
@@ -39,8 +41,15 @@ async def refresh_all_pools():
                 task.cancel()
         await asyncio.gather(*asyncio.all_tasks())
 
+async def refresh_in_thread():
+    # the thread's loop owns its shared session, close it before the loop stops
+    try:
+        await run_scheduler()
+    finally:
+        await close_session()
+
 def pool_thread_task():
-    asyncio.run(refresh_all_pools())
+    asyncio.run(refresh_in_thread())
     
 @app.route('/', methods=['GET'])
 def index():
@@ -59,10 +68,12 @@ async def order_router_split():
     buy_symbol = str(request.args.get('buy_symbol'))
     buy_ID = str(request.args.get('buy_ID'))
     exchanges = request.args.get('exchanges', DEX_LIST)
+    graph_type = request.args.get('graph_type', TOKEN_GRAPH)
+    routing_strategy = request.args.get('routing_strategy', 'default')
 
     print('ORDER ROUTER CALLED')
 
-    result = await route_orders(sell_symbol, sell_ID, sell_amount, buy_symbol, buy_ID, exchanges, split=True)
+    result = await route_orders(sell_symbol, sell_ID, sell_amount, buy_symbol, buy_ID, exchanges, split=True, routing_strategy=routing_strategy, graph_type=graph_type)
 
     return jsonify(result)
 
@@ -70,6 +81,18 @@ async def order_router_split():
 async def health():
     return jsonify({'status': 'ok'})
 
+@app.route('/pool_stats', methods=['GET'])
+async def pool_stats():
+    return jsonify(pool_store_stats())
+
+@app.route('/collector_status', methods=['GET'])
+async def collector_status_route():
+    return jsonify(collector_status())
+
+@app.route('/refresh_schedule', methods=['GET'])
+async def refresh_schedule():
+    return jsonify(scheduler_stats())
+
 @app.route('/order_router', methods=['GET'])
 async def order_router():
     sell_symbol = str(request.args.get('sell_symbol'))
@@ -78,10 +101,12 @@ async def order_router():
     buy_symbol = str(request.args.get('buy_symbol'))
     buy_ID = str(request.args.get('buy_ID'))
     exchanges = request.args.get('exchanges', DEX_LIST)
+    graph_type = request.args.get('graph_type', TOKEN_GRAPH)
+    routing_strategy = request.args.get('routing_strategy', 'default')
 
     print('ORDER ROUTER CALLED')
 
-    result = await route_orders(sell_symbol, sell_ID, sell_amount, buy_symbol, buy_ID, exchanges, split=False) # add routing strategy param
+    result = await route_orders(sell_symbol, sell_ID, sell_amount, buy_symbol, buy_ID, exchanges, split=False, routing_strategy=routing_strategy, graph_type=graph_type)
 
     return jsonify(result)
 
@@ -103,7 +128,11 @@ async def best_match_order_router():
 
 @app.route('/refresh_pools', methods=['GET'])
 async def refresh_pools_route():
-    await refresh_all_pools()
+    # each request runs on its own short lived loop, so its session has to be closed here
+    try:
+        await refresh_all_pools()
+    finally:
+        await close_session()
     return jsonify({'status': 'ok'})
 
 def query_process():
@@ -113,6 +142,8 @@ def query_process():
         time.sleep(29)
 
 def main():
+    # serve the last saved pools while the first refresh runs in the background
+    restore_pools()
 
     threads = [
         Thread(target=pool_thread_task)
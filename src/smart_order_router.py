@@ -3,18 +3,23 @@ This module contains the main function for the smart order router, calling all t
 '''
 
 # local imports
-from pool_collector import get_latest_pool_data, collect_curve_pools, reformat_balancer_v1_pools, reformat_balancer_v2_pools
-from graph_constructor import construct_pool_graph, pool_graph_to_dict
+from pool_collector import indexed_blocks
+from pool_normalizer import collect_store
+from graph_constructor import (construct_pool_graph, pool_graph_to_dict, token_graph_to_dict,
+                               pool_key, pool_name, POOL_GRAPH, TOKEN_GRAPH)
 from pathfinder import find_shortest_paths, validate_all_paths, create_path_graph, path_graph_to_dict
 from path_crawler import calculate_routes, get_final_route
+from pool_store import PoolStore, save_snapshot, load_latest_snapshot
+from circuit_breaker import breaker_stats, CLOSED
+from pool_activity import record_route_usage, record_reserve_moves
 # third party imports
 import logging
-from constants import UNISWAP_V2, UNISWAP_V3, SUSHISWAP_V2, CURVE, BALANCER_V1, BALANCER_V2, DODO, PANCAKESWAP_V3, MAX_ROUTES
-from heapq import merge
-import json
+from constants import CURVE, MAX_ROUTES, DEX_LIST
+import numpy as np
+import os
 import time
+from threading import Lock
 # import dotenv
-# import os
 # import requests
 
 
@@ -24,163 +29,196 @@ COINMARKETCAP_API_KEY = os.getenv("COINMARKETCAP_API_KEY")'''
 
 MAX_ORDERS = 20
 
-DEX_LIST = (
-    UNISWAP_V2,
-    UNISWAP_V3,
-    SUSHISWAP_V2,
-    CURVE,
-    BALANCER_V1,
-    BALANCER_V2,
-    DODO,
-    PANCAKESWAP_V3
-)
-
-DEX_METRIC_MAP = {
-    UNISWAP_V2: 'reserveUSD',
-    UNISWAP_V3: 'totalValueLockedUSD',
-    SUSHISWAP_V2: 'liquidityUSD',
-    CURVE: 'reserveUSD',
-    BALANCER_V1: 'liquidity',
-    BALANCER_V2: 'totalLiquidity',
-    DODO: 'volumeUSD',
-    PANCAKESWAP_V3: 'totalValueLockedUSD'
-}
-
-DEX_LIQUIDITY_METRIC_MAP = {
-    UNISWAP_V2: 'reserveUSD',
-    UNISWAP_V3: 'totalValueLockedUSD',
-    SUSHISWAP_V2: 'liquidityUSD',
-    CURVE: 'reserveUSD',
-    BALANCER_V1: 'reserveUSD',
-    BALANCER_V2: 'reserveUSD',
-    DODO: 'reserveUSD',
-    PANCAKESWAP_V3: 'totalValueLockedUSD'
-}
-
-BLACKLISTED_TOKENS = [
-    '0xd233d1f6fd11640081abb8db125f722b5dc729dc'  # Dollar Protocol
-]
-
-pool_dict = {}
-# pools = [None] * 200_000
-pools = {
-    exch: {
-        'metric': DEX_METRIC_MAP[exch],
-        'pools': [None] * 10_000
-    } for exch in DEX_LIST
-}
+# where pool snapshots are written for warm starts, and how often
+SNAPSHOT_DIR = os.getenv("ETAX_SNAPSHOT_DIR", default="snapshots")
+SNAPSHOT_INTERVAL = float(os.getenv("ETAX_SNAPSHOT_INTERVAL", default=300))
+SNAPSHOTS_KEPT = 3
+
+# every FULL_SYNC_EVERY refreshes a protocol is collected in full, which also evicts pools that are gone or fell out of the top
+FULL_SYNC_EVERY = int(os.getenv("ETAX_FULL_SYNC_EVERY", default=10))
+sync_cycles = {protocol: 0 for protocol in DEX_LIST}
+
+# candidate paths the token graph search hands to the route calculations, and the most swaps in one
+CANDIDATE_PATHS = int(os.getenv("ETAX_CANDIDATE_PATHS", default=50))
+MAX_HOPS = int(os.getenv("ETAX_MAX_HOPS", default=3))
+
+# the latest pools of each protocol, a protocol's store is only replaced once its whole refresh has been collected
+protocol_stores = {protocol: PoolStore() for protocol in DEX_LIST}
+# the published snapshot of every protocol's pools, readers take a reference to it once per request and never lock
+pool_store = PoolStore()
+# serializes publishers, the refresh thread and the /refresh_pools route can both be refreshing
+publish_lock = Lock()
+
+
+# per protocol store size, updated whenever a protocol is published
+protocol_memory = {protocol: {'pairs': 0, 'bytes': 0} for protocol in DEX_LIST}
+# when each protocol's pools were last replaced, a degraded protocol keeps serving its older pools
+protocol_published = {}
+
+
+# replace a protocol's pools with a completed refresh, build a new snapshot and publish it with a single reference swap
+def publish_pools(protocol: str, new_store: PoolStore, upsert: bool = False):
+    '''
+    With upsert the refreshed pools are applied over the protocol's current pools instead of replacing them. The current
+    pools are read under the publish lock, so a partial refresh never publishes over a sweep that finished meanwhile.
+    '''
+    global pool_store
+
+    # the same pair can be collected more than once, keep the last one
+    new_store = new_store.unique()
+    with publish_lock:
+        old_store = protocol_stores[protocol]
+        if upsert:
+            new_store = old_store.upsert(new_store)
+        # pools missing from a complete refresh have disappeared, the new store replaces the old one outright
+        evicted = len(old_store.key_lookup().keys() - new_store.key_lookup().keys())
+        protocol_stores[protocol] = new_store
+        protocol_memory[protocol] = {'pairs': len(new_store), 'bytes': new_store.memory_usage()}
+        protocol_published[protocol] = time.time()
+        snapshot = PoolStore.concat([protocol_stores[dex] for dex in DEX_LIST])
+        snapshot.version = pool_store.version + 1
+        # price the tokens, find the scoring maxima and build the routing graph once per snapshot rather than on every request
+        snapshot.token_prices()
+        snapshot.maxima()
+        snapshot.csr_graph()
+        # index the pools by token and by key too, filter_pools and route_orders read both on every request
+        snapshot.token_index()
+        snapshot.key_lookup()
+        pool_store = snapshot
+    logging.info(f'published pool snapshot {snapshot.version} with {len(snapshot)} pairs, evicted {evicted} {protocol} pairs')
+    persist_pools(snapshot)
+
+
+# periodically write the published snapshot to disk so a restart can serve from it straight away
+last_persisted = time.monotonic()
+
+def persist_pools(snapshot: PoolStore, force: bool = False):
+    global last_persisted
+
+    if not force and time.monotonic() - last_persisted < SNAPSHOT_INTERVAL:
+        return
+    last_persisted = time.monotonic()
+    try:
+        path = save_snapshot(snapshot, SNAPSHOT_DIR, keep=SNAPSHOTS_KEPT)
+        logging.info(f'saved pool snapshot {snapshot.version} to {path}')
+    except OSError as e:
+        logging.error(f'could not save pool snapshot {snapshot.version}: {e}')
+
+
+# load the newest snapshot on disk and serve it until the first refresh replaces it
+def restore_pools() -> bool:
+    global pool_store
+
+    snapshot = load_latest_snapshot(SNAPSHOT_DIR)
+    if snapshot is None:
+        logging.info('no pool snapshot to restore, starting cold')
+        return False
+    with publish_lock:
+        # published snapshots are ordered by protocol, so these are views over the memory-mapped file
+        for protocol, store in snapshot.split_protocols().items():
+            protocol_stores[protocol] = store
+            protocol_memory[protocol] = {'pairs': len(store), 'bytes': store.memory_usage()}
+        snapshot.token_prices()
+        snapshot.maxima()
+        snapshot.csr_graph()
+        # index the pools by token and by key too, filter_pools and route_orders read both on every request
+        snapshot.token_index()
+        snapshot.key_lookup()
+        pool_store = snapshot
+    logging.info(f'restored pool snapshot {snapshot.version} with {len(snapshot)} pairs')
+    return True
+
+
+# get the pair count and memory footprint of each protocol's store
+def pool_store_stats() -> dict:
+    return {
+        'snapshot_version': pool_store.version,
+        'protocols': dict(protocol_memory),
+        'total_bytes': sum(stats['bytes'] for stats in protocol_memory.values())
+    }
+
+
+def collector_status() -> dict:
+    ''' Returns the circuit breaker state of every protocol with the age and size of the pools it is serving. '''
+    breakers = breaker_stats()
+    status = {}
+    for protocol in DEX_LIST:
+        store = protocol_stores.get(protocol)
+        status[protocol] = {
+            'breaker': breakers.get(protocol, {'state': CLOSED, 'degraded': False}),
+            'pairs': len(store) if store is not None else 0,
+            'published_at': protocol_published.get(protocol)
+        }
+    return status
 
 
 async def refresh_pools(protocol: str):
     # print('refreshing pools...')
 
-    global pools
-    global pool_dict
-    
-    if protocol == CURVE:
-        new_curve_pools = await collect_curve_pools()
-        for pool in new_curve_pools:
-            token0_id = pool['token0']['id']
-            token1_id = pool['token1']['id']
-            key = f"{pool['id']}_{token0_id}_{token1_id}"
-            pool_dict[key] = pool
-            pools[protocol]['pools'].append(pool)
-        print(f'{protocol} pool count: {len([pool for pool in pools[protocol]["pools"] if pool is not None])}')
+    full_sync = next_sync_is_full(protocol)
+    sync_cycles[protocol] += 1
+    try:
+        # get the latest pool data, pages are fetched concurrently and parsed in worker processes as they arrive
+        refreshed = await collect_store(protocol, full_sync, current=protocol_stores[protocol])
+    except Exception as e:
+        # the protocol is degraded, keep serving its last good pools until the source recovers
+        logging.error(f'{protocol} refresh failed, keeping the previous pools: {e!r}')
         return
-    # get the latest pool data
-    new_pools = []
-    metric_to_use = pools[protocol]['metric']
-    last_pool_metric = None
-    for i in range(0, 1):
-        for skip in (0, 1000, 2000, 3000, 4000, 5000):
-            logging.info(
-                f'getting pools {i*6000 + skip} to {i*6000 + skip + 1000}...')
-            new_pools = await get_latest_pool_data(protocol=protocol, skip=skip, max_metric=last_pool_metric)
-            if new_pools:
-                if protocol == BALANCER_V1:
-                    new_balancer_pools = reformat_balancer_v1_pools(new_pools)
-                    for pool in new_balancer_pools:
-                        token0_id = pool['token0']['id']
-                        token1_id = pool['token1']['id']
-                        key = f"{pool['id']}_{token0_id}_{token1_id}"
-                        pool_dict[key] = pool
-                        pools[protocol]['pools'].append(pool) 
-                elif protocol == BALANCER_V2:
-                    new_balancer_pools = reformat_balancer_v2_pools(new_pools)
-                    for pool in new_balancer_pools:
-                        token0_id = pool['token0']['id']
-                        token1_id = pool['token1']['id']
-                        key = f"{pool['id']}_{token0_id}_{token1_id}"
-                        pool_dict[key] = pool
-                        pools[protocol]['pools'].append(pool)
-                else:
-                    for pool in new_pools:
-                        token0_id = pool['token0']['id']
-                        token1_id = pool['token1']['id']
-                        key = f"{pool['id']}_{token0_id}_{token1_id}"
-                        pool_dict[key] = pool
-                        pools[protocol]['pools'].append(pool)  
-
-                print("Total pairs collected: "+str(len(pool_dict)))
-                last_pool = new_pools[-1]
-                # print("last_pool:", last_pool)
-                last_pool_metric = float(last_pool[metric_to_use])
-                # print(f'last pool metric: {last_pool_metric} {metric_to_use}')
-                print(f'{protocol} pool count: {len([pool for pool in pools[protocol]["pools"] if pool is not None])}')
-
-
-# pool sorting helper function
-def pool_key(pool):
+    if refreshed is protocol_stores[protocol]:
+        print(f'{protocol} pools unchanged')
+        return
+    print(f"{protocol} pairs collected: {len(refreshed)}")
+    record_reserve_moves(protocol, protocol_stores[protocol], refreshed)
+    if not full_sync:
+        if len(refreshed):
+            # apply the changes over the protocol's current pools, only a full sweep evicts pools
+            publish_pools(protocol, refreshed, upsert=True)
+        return
+    if not len(refreshed):
+        logging.warning(f'{protocol} refresh returned no pools, keeping the previous pools')
+        return
+    publish_pools(protocol, refreshed)
+    print(f'{protocol} pool count: {len(protocol_stores[protocol])}')
+
+
+def next_sync_is_full(protocol: str) -> bool:
+    # between full sweeps only the pools that changed since the last collection are requested, curve has no change feed
+    return protocol == CURVE or protocol not in indexed_blocks or sync_cycles[protocol] % FULL_SYNC_EVERY == 0
+
+
+async def refresh_hot_pools(protocol: str, pool_ids: list):
+    ''' Refreshes just the given pools of a protocol, used for the pools that have to stay the freshest. '''
     try:
-        if pool is None:
-            return 0
-        metric_key = pools[pool['protocol']]['metric']
-        return float(pool['reserveUSD']) if 'reserveUSD' in pool else float(pool[metric_key]) if pool else 0
-    except ValueError as e:
-        print(f"Error: {e}")
-        print(f"Pool causing error: {pool}")
-        print(f"reserveUSD: {pool.get('reserveUSD', 'Not Found')}")
-        print(f"Protocol: {pool.get('protocol', 'Not Found')}")
-        print(f"Metric: {pools[pool['protocol']].get('metric', 'Not Found')}")
-        return 0
+        refreshed = await collect_store(protocol, pool_ids=pool_ids)
+    except Exception as e:
+        logging.error(f'{protocol} hot pool refresh failed, keeping the previous pools: {e!r}')
+        return
+    record_reserve_moves(protocol, protocol_stores[protocol], refreshed)
+    if len(refreshed):
+        publish_pools(protocol, refreshed, upsert=True)
 
 
 # filter the pools for the query
-def filter_pools(sell_symbol: str, sell_ID: str, buy_symbol: str, buy_ID: str, exchanges=None, X: int = 50) -> list:
-    filtered_pools = []
-    # Use 'reserveUSD' if available, or the default metric from the 'pools' dictionary
-    # ideally we should probably decouple the metric for pagination and the metric for sorting
-    full_pools = merge(*[pools[protocol]['pools'] for protocol in DEX_LIST], reverse=True, key=lambda x: float(x[pools[x['protocol']]['metric']]) if x else 0)
-    #full_pools = merge(*[pools[protocol]['pools'] for protocol in DEX_LIST], reverse=True, key=pool_key)
-    sell_count = 0
-    buy_count = 0
+def filter_pools(sell_symbol: str, sell_ID: str, buy_symbol: str, buy_ID: str, exchanges=None, X: int = 50, store: PoolStore = None) -> list:
+    store = pool_store if store is None else store
+    sell_pools = store.top_token_pools(sell_ID, exchanges, X)
+    buy_pools = store.top_token_pools(buy_ID, exchanges, X)
     min_count = 1
 
-    for pool in full_pools:
-        if not pool or exchanges is not None and pool['protocol'] not in exchanges:
-            continue
-        if sell_count >= X and buy_count >= X:
-            return filtered_pools
-        if sell_ID in (pool['token0']['id'], pool['token1']['id']):
-            # check if either token is blacklisted
-            if pool['token0']['id'] in BLACKLISTED_TOKENS or pool['token1']['id'] in BLACKLISTED_TOKENS:
-                continue
-            sell_count += 1
-            if sell_count < X and pool not in filtered_pools:
-                filtered_pools.append(pool)
-        if buy_ID in (pool['token0']['id'], pool['token1']['id']):
-            # check if either token is blacklisted
-            if pool['token0']['id'] in BLACKLISTED_TOKENS or pool['token1']['id'] in BLACKLISTED_TOKENS:
-                continue
-            buy_count += 1
-            if buy_count < X and pool not in filtered_pools:
-                filtered_pools.append(pool)
-    if buy_count < min_count or sell_count < min_count:
+    if len(buy_pools) < min_count or len(sell_pools) < min_count:
         logging.warning('Insufficient pools cached, sleeping and retrying with full DEX list...')
         logging.warning(
-            f'Final buy count: {buy_count}, final sell count: {sell_count}')
+            f'Final buy count: {len(buy_pools)}, final sell count: {len(sell_pools)}')
         return []
 
+    # pools containing both tokens show up in both lists, only keep them once
+    filtered_pools = []
+    seen = set()
+    for handle in np.concatenate((sell_pools, buy_pools)).tolist():
+        if handle not in seen:
+            seen.add(handle)
+            filtered_pools.append(store.pool(handle))
+
     return filtered_pools
 
 
@@ -194,31 +232,22 @@ def filter_pools(sell_symbol: str, sell_ID: str, buy_symbol: str, buy_ID: str, e
     response_data = json.loads(response.text)
     return response_data["data"]["quote"][convert_to_symbol]["price"]'''
 
-def get_token_price_usd(token_id):
-    global pool_dict
-    pools_with_token = [pool for pool in pool_dict.values() if token_id in (pool['token0']['id'], pool['token1']['id'])]
-    total_price_usd = 0.0
-    num_pools = 0
-    for pool in pools_with_token:
-        token0_price_usd = float(pool['token0'].get('priceUSD', 0))
-        token1_price_usd = float(pool['token1'].get('priceUSD', 0))
-        total_price_usd += token0_price_usd + token1_price_usd
-        num_pools += 2
-    average_price_usd = total_price_usd / num_pools if num_pools > 0 else 0.0
-    return average_price_usd
-
-def find_max_liquidity(pool_dict, n=10):
-    most_liquid_pools = sorted(pool_dict.items(), key=lambda x: float(x[1][DEX_LIQUIDITY_METRIC_MAP[x[1]['protocol']]]), reverse=True)[:n]
-    return float(most_liquid_pools[0][1][DEX_LIQUIDITY_METRIC_MAP[most_liquid_pools[0][1]['protocol']]])
-
-def find_max_price(pool_dict, n=10):
-    most_expensive_pools = sorted(pool_dict.items(), key=lambda x: max(float(x[1]['token0'].get('priceUSD', 0)), float(x[1]['token1'].get('priceUSD', 0))), reverse=True)[:n]
-    return max(float(most_expensive_pools[0][1]['token0'].get('priceUSD', 0)), float(most_expensive_pools[0][1]['token1'].get('priceUSD', 0)))
-
-def calculate_score(pool, trade_value, max_trade_value, max_price, max_liquidity):
-    # Normalize the factors
-    normalized_price = max(float(pool['token0'].get('priceUSD', 0)), float(pool['token1'].get('priceUSD', 0))) / max_price
-    normalized_liquidity = float(pool[DEX_LIQUIDITY_METRIC_MAP[pool['protocol']]]) / max_liquidity
+def get_token_price_usd(token_id, store: PoolStore = None):
+    store = pool_store if store is None else store
+    # liquidity weighted price computed once per snapshot
+    return store.token_price_usd(token_id)
+
+def find_max_liquidity(store):
+    # maintained per snapshot at publish time
+    return store.maxima()[1]
+
+def find_max_price(store):
+    return store.maxima()[0]
+
+def calculate_score(store, handles, trade_value, max_trade_value, max_price, max_liquidity):
+    # Normalize the factors, scoring every handle in one pass
+    normalized_price = np.maximum(store.price0_usd[handles], store.price1_usd[handles]) / (max_price or 1)
+    normalized_liquidity = store.liquidity[handles] / (max_liquidity or 1)
 
     # Adjust the weights based on the trade value
     w1 = trade_value / max_trade_value  # Liquidity weight increases with trade value
@@ -230,65 +259,93 @@ def calculate_score(pool, trade_value, max_trade_value, max_price, max_liquidity
 
     return score
 
-def filter_pools_best_match(sell_symbol: str, sell_ID: str, sell_amount: float, exchanges=None, X: int = 30, Y: int = 30):
-    global pool_dict
+# get the k highest scoring handles, best first, without sorting every score
+def top_k(handles, scores, k: int):
+    if len(handles) > k:
+        partition = np.argpartition(-scores, k - 1)[:k]
+        handles, scores = handles[partition], scores[partition]
+    return handles[np.argsort(-scores, kind='stable')]
+
+def filter_pools_best_match(sell_symbol: str, sell_ID: str, sell_amount: float, exchanges=None, X: int = 30, Y: int = 30, store: PoolStore = None):
+    store = pool_store if store is None else store
     # Calculate trade value
-    avg_sell_token_price_usd = get_token_price_usd(sell_ID) # placeholder until we get the actual price in a better way
+    avg_sell_token_price_usd = get_token_price_usd(sell_ID, store)
     trade_value = sell_amount * avg_sell_token_price_usd
     max_trade_value = 100000000  # Arbitrarily set
     
     # Get max_price and max_liquidity from all pools
-    max_price = find_max_price(pool_dict)
-    max_liquidity = find_max_liquidity(pool_dict)
+    max_price = find_max_price(store)
+    max_liquidity = find_max_liquidity(store)
     
-    pool_scores = []
-    for pool in pool_dict.values():
-        # Exclude pools whose exchange is not in the exchanges list
-        if exchanges is not None and pool['protocol'] not in exchanges:
-            continue
-        
-        # Calculate pool score
-        score = calculate_score(pool, trade_value, max_trade_value, max_price, max_liquidity)
-        pool_scores.append((pool, score))
-
-    # Sort the pools based on score
-    sorted_pool_scores = sorted(pool_scores, key=lambda x: x[1], reverse=True)
+    # Exclude pools whose exchange is not in the exchanges list
+    handles = np.flatnonzero(store.protocol_mask(exchanges))
+    # Calculate pool scores
+    scores = calculate_score(store, handles, trade_value, max_trade_value, max_price, max_liquidity)
+
     # Get the top X pools by score
-    top_X_pools = [pool_score[0] for pool_score in sorted_pool_scores[:X]]
+    top_X_pools = [store.pool(handle) for handle in top_k(handles, scores, X).tolist()]
     # Get the top Y pools that contain the sell_token
-    top_Y_sell_token_pools = [pool_score[0] for pool_score in sorted_pool_scores if sell_ID in (pool_score[0]['token0']['id'], pool_score[0]['token1']['id'])][:Y]
+    sell_pools = store.token_mask(sell_ID)[handles]
+    top_Y_sell_token_pools = [store.pool(handle) for handle in top_k(handles[sell_pools], scores[sell_pools], Y).tolist()]
     # Return a list combining the two sets of pools
     return top_X_pools + top_Y_sell_token_pools
 
-async def route_orders(sell_symbol: str, sell_ID: str, sell_amount: float, buy_symbol: str, buy_ID: str, exchanges, split=False, routing_strategy='default') -> dict:
+async def route_orders(sell_symbol: str, sell_ID: str, sell_amount: float, buy_symbol: str, buy_ID: str, exchanges, split=False, routing_strategy='default', graph_type=TOKEN_GRAPH) -> dict:
+    '''
+    Quotes are searched in the published snapshot's CSR token graph by default, restricted to the request's pools by a mask,
+    so nothing is built per request. The pool graph is still built per request when asked for, and for best match routing.
+    '''
     result = {}
+    # every step of the quote works against the same snapshot, even if a refresh publishes a new one meanwhile
+    snapshot = pool_store
+    result['snapshot_version'] = snapshot.version
     
     # get the pools
     if routing_strategy == 'best_match':
-        filt_pools = filter_pools_best_match(sell_symbol, sell_ID, sell_amount, exchanges=exchanges)
+        filt_pools = filter_pools_best_match(sell_symbol, sell_ID, sell_amount, exchanges=exchanges, store=snapshot)
         # fallback in case arg management in server.py fails
         buy_symbol = sell_symbol
         buy_ID = sell_ID
     else:
-        filt_pools = filter_pools(sell_symbol, sell_ID, buy_symbol, buy_ID, exchanges=exchanges)
+        filt_pools = filter_pools(sell_symbol, sell_ID, buy_symbol, buy_ID, exchanges=exchanges, store=snapshot)
     
     if len(filt_pools) < 5:
         time.sleep(5)
-        filter_pools(sell_symbol, sell_ID, buy_symbol, buy_ID, exchanges=DEX_LIST)
+        filter_pools(sell_symbol, sell_ID, buy_symbol, buy_ID, exchanges=DEX_LIST, store=snapshot)
     
-    # construct the pool graph
-    G = construct_pool_graph(filt_pools)
-    # get the graph dict
-    graph_dict = pool_graph_to_dict(G)
-    # append the dict to the result
-    result['pool_graph'] = graph_dict
-    # find the shortest paths
-    paths = find_shortest_paths(G, sell_symbol, buy_symbol)
-    # validate the paths
-    if routing_strategy == 'best_match': # all paths are valid if it doesn't matter what our output token is, any paths that somehow still involve selling a token to a pool not accepted will be filtered out by the price impact calculation anyway
-        valid_paths = paths
+    if routing_strategy == 'max_output' or (graph_type == TOKEN_GRAPH and routing_strategy != 'best_match'):
+        # tokens are nodes and pools are edges, the paths between the two tokens are valid as found
+        graph = snapshot.csr_graph()
+        # search the snapshot's graph through just this request's pools
+        key_lookup = snapshot.key_lookup()
+        allowed = np.zeros(len(snapshot), dtype=bool)
+        allowed[[key_lookup[pool_key(pool)] for pool in filt_pools]] = True
+        if routing_strategy == 'max_output':
+            # search straight for the highest output paths, only they get priced
+            edge_paths = graph.max_output_paths(graph.node(sell_ID), graph.node(buy_ID), sell_amount, MAX_ROUTES, MAX_HOPS, allowed)
+        else:
+            # the k paths with the best output bounds, the bounds prune the rest of the search
+            edge_paths = graph.best_paths(graph.node(sell_ID), graph.node(buy_ID), sell_amount, CANDIDATE_PATHS, MAX_HOPS, allowed)
+        valid_paths = [[pool_name(snapshot.pool(handle)) for handle in graph.pools[path].tolist()] for _, path in edge_paths]
+        # the route calculations look the pools up by node name
+        pools = {pool_name(pool): pool for pool in filt_pools}
+        # networkx only exports the graph for the response, just this request's edges are converted
+        result['pool_graph'] = token_graph_to_dict(graph.to_networkx(allowed))
     else:
-        valid_paths = validate_all_paths(G, paths, sell_ID, buy_ID)
+        # construct the pool graph
+        G = construct_pool_graph(filt_pools)
+        # get the graph dict
+        graph_dict = pool_graph_to_dict(G)
+        # append the dict to the result
+        result['pool_graph'] = graph_dict
+        # find the shortest paths
+        paths = find_shortest_paths(G, sell_ID, buy_ID)
+        # validate the paths
+        if routing_strategy == 'best_match': # all paths are valid if it doesn't matter what our output token is, any paths that somehow still involve selling a token to a pool not accepted will be filtered out by the price impact calculation anyway
+            valid_paths = paths
+        else:
+            valid_paths = validate_all_paths(G, paths, sell_ID, buy_ID)
+        pools = {node: data['pool'] for node, data in G.nodes(data=True)}
     # create the path graph
     path_graph = create_path_graph(valid_paths)
     # get the path graph dict
@@ -296,7 +353,7 @@ async def route_orders(sell_symbol: str, sell_ID: str, sell_amount: float, buy_s
     # append the dict to the result
     result['path_graph'] = path_graph_dict
     # calculate the routes (traverse the paths and calculate price impact at each swap)
-    routes = calculate_routes(G, valid_paths, sell_amount, sell_symbol, buy_symbol)
+    routes = calculate_routes(pools, valid_paths, sell_amount, sell_symbol, buy_symbol)
 
     # Loop over routes and calculate price_usd and amount_out_usd
     for route_name, route_dict in routes:
@@ -312,25 +369,32 @@ async def route_orders(sell_symbol: str, sell_ID: str, sell_amount: float, buy_s
         output_token = last_swap['output_token']
         pool_id = last_swap['pool']
         # Retrieve the pool information
-        pool = G.nodes[pool_id]['pool']  # assuming that the pool data is contained within G
-        # Find the price in USD for the output token
+        pool = pools[pool_id]
+        # Find the price in USD for the output token, preferring the snapshot's liquidity weighted price over the pool's own
         price_usd = None
         if pool['token0']['symbol'] == output_token:
-            price_usd = float(pool['token0']['priceUSD'])
+            price_usd = get_token_price_usd(pool['token0']['id'], snapshot) or float(pool['token0']['priceUSD'])
         elif pool['token1']['symbol'] == output_token:
-            price_usd = float(pool['token1']['priceUSD'])
+            price_usd = get_token_price_usd(pool['token1']['id'], snapshot) or float(pool['token1']['priceUSD'])
         # Calculate the amount out in USD
         amount_out_usd = price_usd * float(last_swap['output_amount'])
         # Add these to the route dictionary
         route_dict['price_usd'] = price_usd
         route_dict['amount_out_usd'] = amount_out_usd
 
+    # the pools routes go through are kept in the hot refresh tier
+    record_route_usage(
+        (pools[swap['pool']]['protocol'], pools[swap['pool']]['id'])
+        for _, route_dict in routes
+        for key, swap in route_dict.items() if key.startswith('swap_')
+    )
+
     if routing_strategy == 'best_match':
         # Sort the routes by amount_out_usd
         routes.sort(key=lambda x: x[1]['amount_out_usd'], reverse=True)
 
     if split:
-        final_route = get_final_route(G, routes, sell_amount, sell_symbol)
+        final_route = get_final_route(pools, routes, sell_amount, sell_symbol)
         result['routes'] = final_route
     else:
         result['routes'] = routes[:MAX_ROUTES]
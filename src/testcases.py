@@ -4,13 +4,33 @@ This file is for testing functions without having to run the entire smart order
 
 # local imports
 from pool_collector import get_latest_pool_data, collect_curve_pools, reformat_balancer_v1_pools
-from smart_order_router import refresh_pools, filter_pools, pools, pool_dict, DEX_LIST, DEX_METRIC_MAP, route_orders
+import pool_collector
+from smart_order_router import refresh_pools, filter_pools, route_orders
+import smart_order_router
+from http_session import close_session
+import pool_normalizer
+import transport
+from pool_store import PoolStore, COLUMNS, SNAPSHOT_MAGIC, save_snapshot, load_store, load_latest_snapshot
+from price_impact_calculator import dodo_expected_return
+from circuit_breaker import CircuitBreaker, CircuitOpenError, call_with_retry, breakers, OPEN
+from graph_constructor import pool_name, construct_pool_graph
+from pathfinder import find_shortest_paths
+import path_crawler
 # third party imports
 import logging
-from constants import UNISWAP_V2, UNISWAP_V3, SUSHISWAP_V2, CURVE, BALANCER_V1, BALANCER_V2, DODO, PANCAKESWAP_V3, MAX_ROUTES
+from constants import UNISWAP_V2, UNISWAP_V3, SUSHISWAP_V2, CURVE, BALANCER_V1, BALANCER_V2, DODO, PANCAKESWAP_V3, MAX_ROUTES, DEX_LIST, DEX_METRIC_MAP
 from heapq import merge
 import json
 import asyncio
+import math
+import networkx as nx
+import numpy as np
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from aiohttp import web
 
 
 async def main():
@@ -27,10 +47,11 @@ async def main():
         await asyncio.gather(*asyncio.all_tasks(), return_exceptions=True)
 
     # save the pool data
+    pool_store = smart_order_router.pool_store
     with open('test_results\\pool_dict.json', 'w') as f:
-        json.dump(pool_dict, f)
+        json.dump(dict(zip(pool_store.keys(), map(pool_store.pool, range(len(pool_store))))), f)
     with open('test_results\\pools.json', 'w') as f:
-        json.dump(pools, f)
+        json.dump({protocol: [store.pool(handle) for handle in range(len(store))] for protocol, store in smart_order_router.protocol_stores.items()}, f)
     
     # filter for:
     sell_id = '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'
@@ -98,6 +119,455 @@ async def main():
     with open(f'test_results\\all_best_match_split_routes.json', 'w') as f:
         json.dump(split_routes, f)
 
+    await close_session()
+
+
+# the routing graph has to read a DODO pool's quotes the way dodo_price_impact does
+def test_dodo_spot_rate():
+    print("testing the DODO spot rate against its expected return...")
+    # token0 is the base and token1 the quote, token0Price is the last trade price
+    pool = {
+        'id': '0xdodo', 'protocol': DODO, 'type': 'CLASSICAL', 'dangerous': False,
+        'reserve0': '1000', 'reserve1': '2000000', 'token0Price': '1800', 'token1Price': str(1 / 1800),
+        'token0': {'id': '0xdodo_base', 'symbol': 'BASE', 'decimals': '18', 'priceUSD': '1800'},
+        'token1': {'id': '0xdodo_quote', 'symbol': 'QUOTE', 'decimals': '6', 'priceUSD': '1'}
+    }
+    graph = PoolStore.from_pools([pool]).csr_graph()
+    for sell, buy, sell_amount in (('token0', 'token1', 2), ('token1', 'token0', 3600)):
+        [(amount, edges)] = graph.best_paths(graph.node(pool[sell]['id']), graph.node(pool[buy]['id']), sell_amount, k=1)
+        expected = dodo_expected_return(pool, pool[sell]['symbol'], sell_amount)
+        assert math.isclose(amount, expected), f"selling {sell_amount} {pool[sell]['symbol']} routes to {amount}, expected {expected}"
+
+    # the max output search prices DODO swaps with the same rate
+    for sell, buy, sell_amount in (('token0', 'token1', 2), ('token1', 'token0', 3600)):
+        [(amount, edges)] = graph.max_output_paths(graph.node(pool[sell]['id']), graph.node(pool[buy]['id']), sell_amount, k=1)
+        expected = dodo_expected_return(pool, pool[sell]['symbol'], sell_amount)
+        assert math.isclose(amount, expected), f"selling {sell_amount} {pool[sell]['symbol']} pays out {amount}, expected {expected}"
+
+
+# pools report their own USD prices, a pool overpricing its tokens mustn't win a route it pays out less on
+def test_parallel_pool_prices():
+    print("testing max output routing across pools that disagree on prices...")
+    pools = [
+        {
+            'id': pool_id, 'protocol': UNISWAP_V2, 'dangerous': False,
+            'reserve0': '1000', 'reserve1': reserve1, 'reserveUSD': '4000',
+            'token0': {'id': '0xparallel_a', 'symbol': 'A', 'decimals': '18', 'priceUSD': '2'},
+            'token1': {'id': '0xparallel_b', 'symbol': 'B', 'decimals': '18', 'priceUSD': price_usd}
+        }
+        # the first pool pays out more B, the second quotes B at five times its price
+        for pool_id, reserve1, price_usd in (('0xparallel_1', '2000', '1'), ('0xparallel_2', '1800', '5'))
+    ]
+    store = PoolStore.from_pools(pools)
+    graph = store.csr_graph()
+    sell, buy = graph.node('0xparallel_a'), graph.node('0xparallel_b')
+    [(amount, edges)] = graph.max_output_paths(sell, buy, 1, k=1)
+    assert store.id[graph.pools[edges[0]]] == '0xparallel_1', f'routed through {store.id[graph.pools[edges[0]]]}, paying out {amount} B'
+    [(amount, edges)] = graph.best_paths(sell, buy, 1, k=1)
+    assert store.id[graph.pools[edges[0]]] == '0xparallel_1', f'ranked {store.id[graph.pools[edges[0]]]} first, paying out {amount} B'
+
+
+# stable and other weightless balancer pools can't be priced with the weighted formula, their routes have to be dropped
+def test_weightless_balancer_pool():
+    print("testing that a weightless Balancer V2 pool yields no route...")
+    pool = {
+        'id': '0xweightless', 'protocol': BALANCER_V2, 'dangerous': False, 'swapFee': '0.0004',
+        'reserve0': '1000000', 'reserve1': '1000000', 'totalLiquidity': '2000000',
+        'token0': {'id': '0xweightless_a', 'symbol': 'STA', 'decimals': '18', 'priceUSD': '1', 'weight': None},
+        'token1': {'id': '0xweightless_b', 'symbol': 'STB', 'decimals': '18', 'priceUSD': '1', 'weight': None}
+    }
+    view = PoolStore.from_pools([pool]).pool(0)
+    assert 'weight' not in view['token0'] and 'weight' not in view['token1'], 'a missing weight was materialized'
+    # the gas price comes from the network, it doesn't matter here
+    get_gas_fee_in_eth = path_crawler.get_gas_fee_in_eth
+    path_crawler.get_gas_fee_in_eth = lambda: 0.0
+    try:
+        routes = path_crawler.calculate_routes({pool_name(view): view}, [[pool_name(view)]], 100, 'STA', 'STB')
+    finally:
+        path_crawler.get_gas_fee_in_eth = get_gas_fee_in_eth
+    assert routes == [], f'the weightless pool was routed: {routes}'
+
+
+# a uniswap v2 pool in the shape the collectors produce, for the offline checks
+def uniswap_v2_pool(pool_id: str, reserve0: float = 1000, reserve1: float = 1000, metric: float = 2000, token0: str = 'A', token1: str = 'B') -> dict:
+    return {
+        'id': pool_id, 'protocol': UNISWAP_V2, 'dangerous': False,
+        'reserve0': str(reserve0), 'reserve1': str(reserve1), 'reserveUSD': str(metric),
+        'token0': {'id': f'0xtest_{token0.lower()}', 'symbol': token0, 'decimals': '18', 'priceUSD': '1'},
+        'token1': {'id': f'0xtest_{token1.lower()}', 'symbol': token1, 'decimals': '18', 'priceUSD': '1'}
+    }
+
+
+# a hot refresh racing a full sweep from another thread must not bring back the pools the sweep evicted
+def test_hot_refresh_races_sweep():
+    print("testing a hot pool refresh racing a full sweep...")
+    published = smart_order_router.pool_store, smart_order_router.protocol_stores[UNISWAP_V2]
+    try:
+        smart_order_router.publish_pools(UNISWAP_V2, PoolStore.from_pools([uniswap_v2_pool('0xhot'), uniswap_v2_pool('0xevicted'), uniswap_v2_pool('0xswept')]))
+        hot = PoolStore.from_pools([uniswap_v2_pool('0xhot', reserve0=1200)])
+        swept = PoolStore.from_pools([uniswap_v2_pool('0xhot'), uniswap_v2_pool('0xswept', reserve0=900)])
+        # the sweep holds the lock while the hot refresh, on another thread, gets ready to publish
+        with smart_order_router.publish_lock:
+            publisher = threading.Thread(target=smart_order_router.publish_pools, args=(UNISWAP_V2, hot), kwargs={'upsert': True})
+            publisher.start()
+            time.sleep(0.2)
+            smart_order_router.protocol_stores[UNISWAP_V2] = swept
+        publisher.join()
+        store = smart_order_router.protocol_stores[UNISWAP_V2]
+        reserves = dict(zip(store.id, store.reserve0.tolist()))
+        assert reserves == {'0xhot': 1200, '0xswept': 900}, f'published {reserves}'
+    finally:
+        smart_order_router.pool_store, smart_order_router.protocol_stores[UNISWAP_V2] = published
+
+# whether a pool matches a subgraph where filter, for the filters the collectors send
+def matches_filter(protocol: str, pool: dict, where: dict) -> bool:
+    metric_field = DEX_METRIC_MAP[protocol]
+    for field, value in where.items():
+        if field == 'or':
+            if not any(matches_filter(protocol, pool, branch) for branch in value):
+                return False
+        elif field == f'{metric_field}_lt':
+            if not float(pool[metric_field]) < float(value):
+                return False
+        elif field == metric_field:
+            if float(pool[metric_field]) != float(value):
+                return False
+        elif field == 'id_gte':
+            if not pool['id'] >= value:
+                return False
+        elif field == 'id_lt':
+            if not pool['id'] < value:
+                return False
+        elif field == 'id_in':
+            if pool['id'] not in value:
+                return False
+        elif field == 'id_not_in':
+            if pool['id'] in value:
+                return False
+        elif field == '_change_block':
+            if pool.get('changed_at', 0) < value['number_gte']:
+                return False
+    return True
+
+
+# serves the collectors' page requests from the given pools instead of the protocol's subgraph
+@contextmanager
+def offline_subgraph(pools: list, block: int = 100):
+    fetch_pool_pages, fetch_indexed_block = pool_collector.fetch_pool_pages, pool_collector.fetch_indexed_block
+
+    async def fetch_pages(protocol: str, pages: list) -> list:
+        metric_field = DEX_METRIC_MAP[protocol]
+        # ties come back in descending id order, the opposite of what a cursor on id_gt would need
+        ordered = sorted(pools, key=lambda pool: (float(pool[metric_field]), pool['id']), reverse=True)
+        return [[dict(pool, protocol=protocol) for pool in ordered if matches_filter(protocol, pool, where)][:first] for first, where in pages]
+
+    async def indexed_block(protocol: str) -> int:
+        return block
+
+    pool_collector.fetch_pool_pages, pool_collector.fetch_indexed_block = fetch_pages, indexed_block
+    try:
+        yield
+    finally:
+        pool_collector.fetch_pool_pages, pool_collector.fetch_indexed_block = fetch_pool_pages, fetch_indexed_block
+
+
+# metrics aren't unique, pools tied across a page boundary mustn't be skipped by the cursor
+def test_tied_metric_paging():
+    print("testing paging through pools with tied metrics...")
+    # runs of equal metrics much longer than a page, including one that spans the whole band split
+    pools = [uniswap_v2_pool(f'0x{index:04x}', metric=metric) for index, metric in enumerate([500] * 7 + [300] * 9 + [100] * 3 + [50])]
+    with offline_subgraph(pools):
+        collected = asyncio.run(pool_collector.collect_pools(UNISWAP_V2, max_pools=100, page_size=4, bands=2))
+        assert sorted(pool['id'] for pool in collected) == sorted(pool['id'] for pool in pools), f'collected {len(collected)} of {len(pools)} pools'
+        pool_collector.indexed_blocks[UNISWAP_V2] = 0
+        changed = asyncio.run(pool_collector.collect_pool_changes(UNISWAP_V2, page_size=4))
+        assert sorted(pool['id'] for pool in changed) == sorted(pool['id'] for pool in pools), f'collected {len(changed)} of {len(pools)} changes'
+    pool_collector.indexed_blocks.pop(UNISWAP_V2, None)
+
+
+# a recovering source gets a single probe, not the whole burst of requests waiting on it
+def test_breaker_single_probe():
+    print("testing that a half open breaker lets one probe through...")
+    breakers['test_probe'] = breaker = CircuitBreaker('test_probe', failure_threshold=1, reset_timeout=0)
+    calls = []
+
+    async def request():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'ok'
+
+    async def burst():
+        return await asyncio.gather(*(call_with_retry('test_probe', request, attempts=1) for _ in range(10)), return_exceptions=True)
+
+    try:
+        breaker.record_failure(Exception('down'))
+        results = asyncio.run(burst())
+        assert len(calls) == 1, f'{len(calls)} requests probed the source'
+        assert results.count('ok') == 1 and sum(isinstance(result, CircuitOpenError) for result in results) == 9, f'results: {results}'
+        assert breaker.state != OPEN and not breaker.probe_in_flight, f'breaker left {breaker.stats()}'
+    finally:
+        del breakers['test_probe']
+
+
+# once a failure opens the breaker the call fails straight away, without spending a retry or sleeping through the backoff
+def test_breaker_opens_mid_retry():
+    print("testing that a breaker opening between retries fails fast...")
+    breakers['test_retry'] = breaker = CircuitBreaker('test_retry', failure_threshold=2, reset_timeout=60)
+
+    async def request():
+        raise Exception('down')
+
+    try:
+        started = time.monotonic()
+        try:
+            asyncio.run(call_with_retry('test_retry', request, attempts=5))
+            raise AssertionError('the call succeeded')
+        except CircuitOpenError:
+            pass
+        # the first failure is retried, the second opens the breaker
+        assert breaker.total_requests == 2 and breaker.total_retries == 1, f'breaker left {breaker.stats()}'
+        assert time.monotonic() - started < 2, 'the call slept after the breaker opened'
+    finally:
+        del breakers['test_retry']
+
+
+# a snapshot has to come back from disk exactly as it was saved, and a damaged one must never be served
+def test_snapshot_round_trip():
+    print("testing the pool snapshot save and load round trip...")
+    pools = [uniswap_v2_pool(f'0xsnapshot_{index}', reserve0=1000 + index, metric=2000 + index) for index in range(5)]
+    # NaN quotes, prices and weights are the values a naive comparison reports as changed
+    pools[1]['token0Price'], pools[2]['token1Price'] = '2.5', None
+    pools.append({
+        'id': '0xsnapshot_dodo', 'protocol': DODO, 'type': 'CLASSICAL', 'dangerous': True,
+        'reserve0': '10', 'reserve1': '18000', 'token0Price': '1800', 'token1Price': str(1 / 1800),
+        'token0': {'id': '0xsnapshot_base', 'symbol': 'BASE', 'decimals': '18', 'priceUSD': 'not a price'},
+        'token1': {'id': '0xtest_b', 'symbol': 'B', 'decimals': '18', 'priceUSD': '1'}
+    })
+    store = PoolStore.from_pools(pools)
+    with tempfile.TemporaryDirectory() as directory:
+        store.version = 1
+        older = save_snapshot(store, directory)
+        store.version = 2
+        newest = save_snapshot(store, directory)
+        os.utime(older, (1, 1))
+
+        loaded = load_latest_snapshot(directory)
+        assert loaded.version == 2 and len(loaded) == len(store), f'loaded version {loaded.version} with {len(loaded)} pools'
+        for name in COLUMNS:
+            saved, restored = getattr(store, name), getattr(loaded, name)
+            if saved.dtype.kind == 'f':
+                same = np.array_equal(saved, restored, equal_nan=True)
+            else:
+                same = saved.tolist() == restored.tolist()
+            assert same, f'column {name} changed on disk: {saved} -> {restored}'
+        assert isinstance(loaded.reserve0, np.memmap) or isinstance(loaded.reserve0.base, np.memmap), 'the columns were copied rather than mapped'
+        del loaded
+
+        # an unknown format number is refused
+        with open(newest, 'r+b') as f:
+            f.seek(len(SNAPSHOT_MAGIC))
+            f.write((99).to_bytes(4, 'little'))
+        try:
+            load_store(newest)
+            raise AssertionError('a snapshot with an unknown format loaded')
+        except ValueError:
+            pass
+
+        # and so is a truncated file, the older snapshot is served instead
+        store.version = 3
+        newest = save_snapshot(store, directory, keep=5)
+        with open(newest, 'r+b') as f:
+            f.truncate(os.path.getsize(newest) - 8)
+        try:
+            load_store(newest)
+            raise AssertionError('a truncated snapshot loaded')
+        except ValueError:
+            pass
+        os.utime(newest, (3, 3))
+        os.utime(older, (2, 2))
+        assert load_latest_snapshot(directory).version == 1, 'a damaged snapshot was restored'
+
+
+# between full sweeps only the changed pools are collected and applied, and too many changes hand over to a full sweep
+def test_delta_sync():
+    print("testing delta syncs and the full sweep after a capped one...")
+    published = smart_order_router.pool_store, smart_order_router.protocol_stores[UNISWAP_V2], smart_order_router.sync_cycles[UNISWAP_V2]
+    indexed = dict(pool_collector.indexed_blocks)
+    pools = [uniswap_v2_pool(f'0xdelta_{index}', metric=1000 * (index + 1)) for index in range(5)]
+
+    def reserves():
+        store = smart_order_router.protocol_stores[UNISWAP_V2]
+        return dict(zip(store.id, store.reserve0.tolist()))
+
+    def change(indices: list, block: int):
+        for index in indices:
+            pools[index] = dict(pools[index], reserve0=str(float(pools[index]['reserve0']) + 1), changed_at=block)
+
+    try:
+        smart_order_router.sync_cycles[UNISWAP_V2] = 0
+        with offline_subgraph(pools, block=100):
+            asyncio.run(refresh_pools(UNISWAP_V2))
+        assert pool_collector.indexed_blocks[UNISWAP_V2] == 100 and len(reserves()) == 5, f'full sweep left {reserves()}'
+
+        # an uncapped delta is applied over the current pools and advances the block
+        change([1, 3], 150)
+        assert not smart_order_router.next_sync_is_full(UNISWAP_V2)
+        with offline_subgraph(pools, block=200):
+            asyncio.run(refresh_pools(UNISWAP_V2))
+        expected = {pool['id']: float(pool['reserve0']) for pool in pools}
+        assert reserves() == expected, f'delta sync published {reserves()}, expected {expected}'
+        assert pool_collector.indexed_blocks[UNISWAP_V2] == 200, 'the delta sync did not advance the block'
+
+        # a capped delta returns what it collected but doesn't advance the block, the next sync is a full sweep
+        change([0, 2, 4], 250)
+        with offline_subgraph(pools, block=300):
+            changed = asyncio.run(pool_collector.collect_pool_changes(UNISWAP_V2, max_pools=2))
+            assert len(changed) == 2 and UNISWAP_V2 not in pool_collector.indexed_blocks, 'the capped delta advanced the block'
+            assert smart_order_router.next_sync_is_full(UNISWAP_V2), 'no full sweep follows the capped delta'
+            asyncio.run(refresh_pools(UNISWAP_V2))
+        expected = {pool['id']: float(pool['reserve0']) for pool in pools}
+        assert reserves() == expected and pool_collector.indexed_blocks[UNISWAP_V2] == 300, f'the full sweep published {reserves()}'
+    finally:
+        smart_order_router.pool_store, smart_order_router.protocol_stores[UNISWAP_V2], smart_order_router.sync_cycles[UNISWAP_V2] = published
+        pool_collector.indexed_blocks.clear()
+        pool_collector.indexed_blocks.update(indexed)
+
+
+# the curve API is revalidated with its ETag, and only pools whose entry changed are derived and published again
+def test_curve_revalidation():
+    print("testing Curve revalidation and re-deriving only the changed pools...")
+
+    def curve_pool(address: str, balance: int) -> dict:
+        return {'address': address, 'coins': [
+            {'address': f'{address}_x', 'symbol': 'CX', 'decimals': '18', 'poolBalance': str(balance * 10 ** 18), 'usdPrice': 1.0},
+            {'address': f'{address}_y', 'symbol': 'CY', 'decimals': '6', 'poolBalance': str(balance * 10 ** 6), 'usdPrice': 1.0}
+        ]}
+
+    served = {'pools': [curve_pool('0xcurve_1', 1000), curve_pool('0xcurve_2', 2000)], 'etag': '"1"', 'revalidated': 0}
+    derived = []
+
+    async def get_pools(request):
+        if request.headers.get('If-None-Match') == served['etag']:
+            served['revalidated'] += 1
+            return web.Response(status=304, headers={'ETag': served['etag']})
+        return web.json_response({'data': {'poolData': served['pools']}}, headers={'ETag': served['etag']})
+
+    async def counting_normalize(protocol: str, pools: list) -> PoolStore:
+        derived.append(sorted(pool['address'] for pool in pools))
+        return await normalize_pools(protocol, pools)
+
+    async def refresh() -> tuple:
+        await refresh_pools(CURVE)
+        store = smart_order_router.protocol_stores[CURVE]
+        return smart_order_router.pool_store.version, dict(zip(store.id, store.reserve0.tolist()))
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/getPools', get_pools)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        pool_collector.CURVE_ENDPOINT = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/getPools'
+        try:
+            version, reserves = await refresh()
+            assert derived == [['0xcurve_1', '0xcurve_2']] and reserves == {'0xcurve_1': 1000, '0xcurve_2': 2000}, f'first collection derived {derived}'
+
+            # an unchanged payload is revalidated, nothing is derived or published
+            assert await refresh() == (version, reserves) and len(derived) == 1 and served['revalidated'] == 1, 'an unchanged payload was republished'
+
+            # a changed pool is derived on its own and published
+            served['pools'][1], served['etag'] = curve_pool('0xcurve_2', 2500), '"2"'
+            changed_version, reserves = await refresh()
+            assert changed_version > version and reserves == {'0xcurve_1': 1000, '0xcurve_2': 2500}, f'the change published {reserves}'
+            assert derived[1:] == [['0xcurve_2']], f'derived {derived[1:]} for one changed pool'
+
+            # a new ETag over the same pools changes nothing either
+            served['etag'] = '"3"'
+            assert await refresh() == (changed_version, reserves) and len(derived) == 2, 'an identical payload was republished'
+        finally:
+            await close_session()
+            await runner.cleanup()
+
+    published = smart_order_router.pool_store, smart_order_router.protocol_stores[CURVE]
+    endpoint, hashes = pool_collector.CURVE_ENDPOINT, dict(pool_normalizer.curve_pool_hashes)
+    normalize_pools = pool_normalizer.normalize_pools
+    pool_normalizer.normalize_pools = counting_normalize
+    pool_normalizer.curve_pool_hashes.clear()
+    try:
+        asyncio.run(run())
+    finally:
+        transport.http_cache.pop(pool_collector.CURVE_ENDPOINT, None)
+        pool_normalizer.normalize_pools = normalize_pools
+        pool_collector.CURVE_ENDPOINT = endpoint
+        pool_normalizer.curve_pool_hashes.clear()
+        pool_normalizer.curve_pool_hashes.update(hashes)
+        smart_order_router.pool_store, smart_order_router.protocol_stores[CURVE] = published
+
+
+# a published snapshot never changes under the requests reading it, and every publish gets its own version
+def test_snapshot_publishing():
+    print("testing snapshot publishing...")
+    published = smart_order_router.pool_store, smart_order_router.protocol_stores[UNISWAP_V2]
+    try:
+        smart_order_router.publish_pools(UNISWAP_V2, PoolStore.from_pools([uniswap_v2_pool(f'0xpublish_{index}') for index in range(3)]))
+        reading = smart_order_router.pool_store
+        version, ids = reading.version, reading.id.tolist()
+        assert not reading.reserve0.flags.writeable, 'a published snapshot is writable'
+
+        # publishers on several threads are serialized, none of their versions collide
+        threads = [
+            threading.Thread(target=smart_order_router.publish_pools, args=(UNISWAP_V2, PoolStore.from_pools([uniswap_v2_pool(f'0xpublish_{index}')])))
+            for index in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert smart_order_router.pool_store.version == version + len(threads), f'{len(threads)} publishes moved the version from {version} to {smart_order_router.pool_store.version}'
+        assert len(smart_order_router.protocol_stores[UNISWAP_V2]) == 1, 'a publish did not replace the protocol\'s pools'
+        # the snapshot a request started with still holds the pools it had
+        assert reading.version == version and reading.id.tolist() == ids, 'a published snapshot changed'
+    finally:
+        smart_order_router.pool_store, smart_order_router.protocol_stores[UNISWAP_V2] = published
+
+
+# the pool graph search returns one shortest path to each buy pool from every sell pool at its minimal distance
+def test_pool_graph_paths():
+    print("testing the pool graph path search...")
+    # A-B pools, B-C pools and a longer way round through D, so the buy pools sit at different distances
+    pools = [uniswap_v2_pool(f'0xpath_ab{index}', token0='A', token1='B') for index in range(3)]
+    pools += [uniswap_v2_pool(f'0xpath_bc{index}', token0='B', token1='C') for index in range(2)]
+    pools += [uniswap_v2_pool('0xpath_ad', token0='A', token1='D'), uniswap_v2_pool('0xpath_dx', token0='D', token1='X'),
+              uniswap_v2_pool('0xpath_xc', token0='X', token1='C')]
+    for pool in pools:
+        pool['protocol'] = UNISWAP_V2
+    G = construct_pool_graph(pools)
+    paths = find_shortest_paths(G, '0xtest_a', '0xtest_c')
+    sell_nodes = G.graph['token_nodes']['0xtest_a']
+    assert paths and len({(path[0], path[-1]) for path in paths}) == len(paths), f'a sell pool got more than one path to a buy pool: {paths}'
+    assert [len(path) for path in paths] == sorted(len(path) for path in paths), 'the paths are not shortest first'
+    for buy_node in {path[-1] for path in paths}:
+        distances = {node: nx.shortest_path_length(G, node, buy_node) for node in sell_nodes if nx.has_path(G, node, buy_node)}
+        nearest = {node for node, distance in distances.items() if distance == min(distances.values())}
+        starts = {path[0] for path in paths if path[-1] == buy_node}
+        assert starts == nearest, f'{buy_node} got paths from {starts}, the nearest sell pools are {nearest}'
+        for path in paths:
+            if path[-1] == buy_node:
+                assert len(path) - 1 == distances[path[0]] and all(G.has_edge(a, b) for a, b in zip(path, path[1:])), f'{path} is not a shortest path'
+
 
 if __name__ == "__main__":
+    test_snapshot_publishing()
+    test_pool_graph_paths()
+    test_curve_revalidation()
+    test_delta_sync()
+    test_snapshot_round_trip()
+    test_breaker_single_probe()
+    test_breaker_opens_mid_retry()
+    test_tied_metric_paging()
+    test_hot_refresh_races_sweep()
+    test_weightless_balancer_pool()
+    test_dodo_spot_rate()
+    test_parallel_pool_prices()
     asyncio.run(main())
\ No newline at end of file
@@ -2,9 +2,10 @@
 This script collects the top 1000 Uniswap V2 tokens ordered descending by tradeVolumeUSD, it is not used in the final product but was used to get the top 1000 tokens for the graph_constructor.py script.
 '''
 
+# local imports
+from http_session import get_session, close_session
 # standard library imports
 import asyncio
-import aiohttp
 import json
 
 ENDPOINT = "https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2"
@@ -24,11 +25,11 @@ async def get_top_tokens(order: str) -> dict:
             }}
             """
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(ENDPOINT, json={'query': query}) as response:
-                    obj = await response.json()
-                    tokens = obj['data']['tokens']
-                    return tokens
+            session = get_session()
+            async with session.post(ENDPOINT, json={'query': query}) as response:
+                obj = await response.json()
+                tokens = obj['data']['tokens']
+                return tokens
         
         # this sometimes fails but works on the next try, retry until it works
         except KeyError:
@@ -37,6 +38,7 @@ async def get_top_tokens(order: str) -> dict:
 # main function
 async def main():
     tokens = await get_top_tokens('desc')
+    await close_session()
     # save tokens to a JSON file
     with open('uniswap_v2_tokens.json', 'w') as f:
         json.dump(tokens, f, indent=4)
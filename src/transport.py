@@ -0,0 +1,140 @@
+'''
+This module sends the collectors' HTTP requests, live, recording every response to disk, or replaying recordings from a local stand-in server.
+Repeated GETs are revalidated against the last response instead of being downloaded again.
+'''
+
+# local imports
+from http_session import get_session
+# standard library imports
+import hashlib
+import json
+import os
+import re
+from urllib.parse import urlsplit
+
+# live sends requests to the real endpoints, record does the same and saves each response, replay sends them to replay_server.py
+LIVE = 'live'
+RECORD = 'record'
+REPLAY = 'replay'
+TRANSPORT_MODE = os.getenv("ETAX_TRANSPORT", default=LIVE)
+RECORDINGS_DIR = os.getenv("ETAX_RECORDINGS_DIR", default="recordings")
+REPLAY_URL = os.getenv("ETAX_REPLAY_URL", default="http://127.0.0.1:8765")
+
+# response headers worth keeping in a recording
+RECORDED_HEADERS = ('Content-Type', 'Retry-After', 'ETag', 'Last-Modified')
+# revalidate repeated GETs with If-None-Match/If-Modified-Since instead of downloading unchanged bodies again
+HTTP_CACHE = os.getenv("ETAX_HTTP_CACHE", default="1") == "1"
+
+# url -> the last GET response that came with a validator
+http_cache = {}
+
+
+class Response:
+    ''' The parts of an HTTP response the collectors use. '''
+
+    __slots__ = ('status', 'headers', 'body', 'not_modified')
+
+    def __init__(self, status: int, headers: dict, body: bytes, not_modified: bool = False):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        # set when the server confirmed the cached body is still current, the body is the cached one
+        self.not_modified = not_modified
+
+    def json(self):
+        return json.loads(self.body)
+
+
+def endpoint_slug(url: str) -> str:
+    ''' Names the recording directory of an endpoint, e.g. api.thegraph.com/subgraphs/name/uniswap/uniswap-v2 -> uniswap_uniswap-v2. '''
+    parts = urlsplit(url)
+    path = parts.path.strip('/')
+    if path.startswith('subgraphs/name/'):
+        path = path[len('subgraphs/name/'):]
+    return re.sub(r'[^A-Za-z0-9.-]+', '_', path or parts.netloc)
+
+
+def canonical_value(value):
+    ''' Sorts every list of ids in a payload, the variables name sets of pools and tokens whose order the query ignores. '''
+    if isinstance(value, dict):
+        return {key: canonical_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [canonical_value(item) for item in value]
+        return sorted(items) if all(isinstance(item, str) for item in items) else items
+    return value
+
+
+def request_key(method: str, payload: dict = None) -> str:
+    ''' Identifies a request within its endpoint, the same query and variables always give the same key. '''
+    canonical = json.dumps(canonical_value(payload), sort_keys=True, separators=(',', ':')) if payload is not None else ''
+    return hashlib.sha1(f'{method}\n{canonical}'.encode()).hexdigest()
+
+
+def recording_path(slug: str, key: str, directory: str = None) -> str:
+    return os.path.join(directory or RECORDINGS_DIR, slug, key + '.json')
+
+
+def save_recording(url: str, method: str, payload: dict, response: Response):
+    slug = endpoint_slug(url)
+    path = recording_path(slug, request_key(method, payload))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    recording = {
+        'url': url,
+        'method': method,
+        'payload': payload,
+        'status': response.status,
+        'headers': response.headers,
+        'body': response.body.decode()
+    }
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(recording, f)
+    os.replace(temp_path, path)
+
+
+def load_recording(slug: str, key: str, directory: str = None) -> dict:
+    ''' Returns the recording of a request, or None if it was never recorded. '''
+    path = recording_path(slug, key, directory)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+async def request(method: str, url: str, payload: dict = None) -> Response:
+    ''' Sends a GET or a JSON POST through the configured transport. '''
+    session = get_session()
+    if TRANSPORT_MODE == REPLAY:
+        # everything goes to the stand-in as a POST, it finds the recording from the endpoint's slug and the original request
+        context = session.post(f'{REPLAY_URL}/{endpoint_slug(url)}', json={'method': method, 'payload': payload})
+    elif method == 'POST':
+        context = session.post(url, json=payload)
+    else:
+        context = session.get(url, headers=validators(http_cache.get(url)) if HTTP_CACHE else None)
+    async with context as response:
+        result = Response(
+            response.status,
+            {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            await response.read()
+        )
+
+    if result.status == 304 and url in http_cache:
+        cached = http_cache[url]
+        return Response(200, cached.headers, cached.body, not_modified=True)
+    if HTTP_CACHE and method == 'GET' and TRANSPORT_MODE != REPLAY and result.status == 200 and validators(result):
+        http_cache[url] = result
+    if TRANSPORT_MODE == RECORD and result.status < 400:
+        save_recording(url, method, payload, result)
+    return result
+
+
+def validators(response: Response) -> dict:
+    ''' Returns the conditional request headers that revalidate a cached response. '''
+    if response is None:
+        return {}
+    headers = {}
+    if 'ETag' in response.headers:
+        headers['If-None-Match'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        headers['If-Modified-Since'] = response.headers['Last-Modified']
+    return headers